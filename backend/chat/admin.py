@@ -1,9 +1,11 @@
 # chat/admin.py
 from django.contrib import admin
+from django.contrib.admin.utils import quote, unquote
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
 from django.utils.html import format_html, escape, conditional_escape
-from django.urls import reverse
+from django.urls import path, reverse
 from django.template.defaultfilters import truncatechars, linebreaksbr
-from django.db import models
 from django.utils.safestring import mark_safe
 from django.conf import settings
 from .models import Conversation, Message
@@ -73,36 +75,162 @@ class MessageInline(admin.TabularInline):
     reply_to_message_link_inline.short_description = "Reply To"
 
 
+def _render_message_html(msg, user_a_id):
+    """One transcript bubble; expects ``sender`` and ``reply_to_message__sender`` preloaded."""
+    sender_display_name = "Unknown Sender"
+    is_user_a = False
+
+    if msg.sender:
+        sender_display_name = escape(
+            msg.sender.username or msg.sender.email or f"User ID {msg.sender.id}"
+        )
+        if msg.sender.id == user_a_id:
+            is_user_a = True
+
+    wrapper_class = "user-a" if is_user_a else "user-b"
+    bubble_class = "user-a" if is_user_a else "user-b"
+
+    parts = [
+        f'<div class="admin-chat-message-wrapper {wrapper_class}">',
+        f'<div class="admin-chat-message {bubble_class}">',
+    ]
+
+    if msg.reply_to_message:
+        reply_sender_name = "Unknown"
+        if msg.reply_to_message.sender:
+            reply_sender_name = escape(
+                msg.reply_to_message.sender.username
+                or msg.reply_to_message.sender.email
+                or f"User ID {msg.reply_to_message.sender.id}"
+            )
+        reply_content_preview = "Message"
+        if msg.reply_to_message.content:
+            reply_content_preview = truncatechars(str(msg.reply_to_message.content), 40)
+        elif msg.reply_to_message.image:
+            reply_content_preview = "[Image]"
+        parts.append(
+            f'<div class="admin-message-reply-info">'
+            f'<span class="reply-sender">{reply_sender_name}:</span> '
+            f'<span class="reply-content">"{escape(reply_content_preview)}"</span>'
+            f"</div>"
+        )
+
+    if msg.content:
+        escaped_content = escape(msg.content)
+        parts.append(
+            f'<div class="admin-message-content"><p>{escaped_content}</p></div>'
+        )
+
+    if msg.image and hasattr(msg.image, "url") and msg.image.url:
+        img_url_safe = escape(msg.image.url)
+        image_only_class = "image-only" if not msg.content else ""
+        parts.append(
+            f'<div class="admin-message-image {image_only_class}"><a href="{img_url_safe}" target="_blank"><img src="{img_url_safe}" alt="Chat image"></a></div>'
+        )
+
+    meta_parts = [msg.timestamp.strftime("%b %d, %H:%M")]
+    if msg.is_edited:
+        meta_parts.append("Edited")
+    meta_info_str = " • ".join(meta_parts)
+    parts.append(f'<div class="admin-message-meta">{meta_info_str}</div>')
+
+    parts.append("</div>")
+    parts.append("</div>")
+    return "".join(parts)
+
+
+class CounterRangeFilter(admin.SimpleListFilter):
+    """Filters on a counter column by ``ranges``: (value, label, lowest, highest or None)."""
+
+    field_name = None
+    ranges = ()
+
+    def lookups(self, request, model_admin):
+        return [(value, label) for value, label, _, _ in self.ranges]
+
+    def queryset(self, request, queryset):
+        for value, _, lowest, highest in self.ranges:
+            if self.value() == value:
+                queryset = queryset.filter(**{f"{self.field_name}__gte": lowest})
+                if highest is not None:
+                    queryset = queryset.filter(**{f"{self.field_name}__lte": highest})
+                return queryset
+        return queryset
+
+
+class MessageCountFilter(CounterRangeFilter):
+    title = "messages"
+    parameter_name = "messages"
+    field_name = "message_count"
+    ranges = (
+        ("0", "None", 0, 0),
+        ("1-99", "1 to 99", 1, 99),
+        ("100-9999", "100 to 9,999", 100, 9999),
+        ("10000+", "10,000 or more", 10000, None),
+    )
+
+
+class ParticipantCountFilter(CounterRangeFilter):
+    title = "participants"
+    parameter_name = "participants"
+    field_name = "participant_count"
+    ranges = (
+        ("0-1", "Fewer than 2", 0, 1),
+        ("2", "Direct (2)", 2, 2),
+        ("3+", "Group (3 or more)", 3, None),
+    )
+
+
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
     list_display = (
         "id",
         "get_participants_display",
+        "participant_count",
         "message_count",
         "created_at",
         "updated_at",
     )
     filter_horizontal = ("participants",)
     search_fields = ("participants__username", "participants__email", "id")
-    list_filter = ("created_at", "updated_at")
+    list_filter = (
+        ParticipantCountFilter,
+        MessageCountFilter,
+        "created_at",
+        "updated_at",
+    )
 
     fieldsets = (
         (None, {"fields": ("participants",)}),
-        ("Conversation Details", {"fields": ("created_at", "updated_at")}),
+        (
+            "Conversation Details",
+            {
+                "fields": (
+                    "created_at",
+                    "updated_at",
+                    "participant_count",
+                    "message_count",
+                )
+            },
+        ),
         ("Chat Messages", {"fields": ("display_chat_messages",)}),
     )
-    readonly_fields = ("created_at", "updated_at", "display_chat_messages")
+    readonly_fields = (
+        "created_at",
+        "updated_at",
+        "participant_count",
+        "message_count",
+        "display_chat_messages",
+    )
+    # Messages rendered with the change page; older ones load on demand.
+    transcript_page_size = 50
 
     class Media:
         css = {"all": ("admin/css/chat_styles.css",)}
+        js = ("admin/js/chat_transcript.js",)
 
     def get_queryset(self, request):
-        return (
-            super()
-            .get_queryset(request)
-            .prefetch_related("participants")
-            .annotate(num_messages=models.Count("messages"))
-        )
+        return super().get_queryset(request).prefetch_related("participants")
 
     def get_participants_display(self, obj):
         participants = obj.participants.all()
@@ -112,27 +240,70 @@ class ConversationAdmin(admin.ModelAdmin):
             escape(p.username or p.email or f"User ID {p.id}") for p in participants[:5]
         ]
         names_str = ", ".join(participant_names)
-        if participants.count() > 5:
+        if obj.participant_count > 5:
             names_str += "..."
         return names_str
 
     get_participants_display.short_description = "Participants"
 
-    def message_count(self, obj):
-        return obj.num_messages
-
-    message_count.short_description = "Messages"
-    message_count.admin_order_field = "num_messages"
+    def get_urls(self):
+        urls = [
+            path(
+                "<path:object_id>/transcript/",
+                self.admin_site.admin_view(self.transcript_view),
+                name="chat_conversation_transcript",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def transcript_page(self, conversation, before=None):
+        """
+        Up to ``transcript_page_size`` messages before sequence ``before``
+        (the newest ones without it), oldest first, and whether older ones exist.
+        """
+        messages = conversation.messages.select_related(
+            "sender", "reply_to_message__sender"
+        ).order_by("-sequence")
+        if before is not None:
+            messages = messages.filter(sequence__lt=before)
+        page = list(messages[: self.transcript_page_size + 1])
+        has_older = len(page) > self.transcript_page_size
+        return page[: self.transcript_page_size][::-1], has_older
+
+    def transcript_user_a_id(self, conversation):
+        participants = list(conversation.participants.all()[:2])
+        return participants[0].id if participants else None
+
+    def transcript_view(self, request, object_id):
+        """Older transcript messages as an HTML fragment, for the "load older" button."""
+        conversation = self.get_object(request, unquote(object_id))
+        if conversation is None:
+            raise Http404("Conversation not found.")
+        if not self.has_view_or_change_permission(request, conversation):
+            raise PermissionDenied
+        try:
+            before = int(request.GET["before"])
+        except (KeyError, ValueError):
+            return JsonResponse(
+                {"detail": "before must be a message sequence."}, status=400
+            )
 
-    def display_chat_messages(self, obj):
-        messages = (
-            obj.messages.all()
-            .order_by("timestamp")
-            .select_related("sender", "reply_to_message__sender")
+        messages, has_older = self.transcript_page(conversation, before)
+        user_a_id = self.transcript_user_a_id(conversation)
+        return JsonResponse(
+            {
+                "html": "".join(
+                    _render_message_html(msg, user_a_id) for msg in messages
+                ),
+                "before": messages[0].sequence if has_older else None,
+            }
         )
 
-        participants = list(obj.participants.all()[:2])
-        user_a_id = participants[0].id if len(participants) > 0 else None
+    def display_chat_messages(self, obj):
+        if obj.pk is None:
+            return "-"
+        messages, has_older = self.transcript_page(obj)
+        user_a_id = self.transcript_user_a_id(obj)
 
         messages_html_parts = [
             f'<div class="admin-chat-container" id="conv-{obj.id}-chat-container">'
@@ -143,74 +314,17 @@ class ConversationAdmin(admin.ModelAdmin):
                 "<p style='text-align:center; color:#777;'>No messages in this conversation yet.</p>"
             )
         else:
-            for msg in messages:
-                sender_display_name = "Unknown Sender"
-                is_user_a = False
-
-                if msg.sender:
-                    sender_display_name = escape(
-                        msg.sender.username
-                        or msg.sender.email
-                        or f"User ID {msg.sender.id}"
-                    )
-                    if msg.sender.id == user_a_id:
-                        is_user_a = True
-
-                wrapper_class = "user-a" if is_user_a else "user-b"
-                bubble_class = "user-a" if is_user_a else "user-b"
-
-                messages_html_parts.append(
-                    f'<div class="admin-chat-message-wrapper {wrapper_class}">'
+            if has_older:
+                transcript_url = reverse(
+                    "admin:chat_conversation_transcript", args=[quote(obj.pk)]
                 )
                 messages_html_parts.append(
-                    f'<div class="admin-chat-message {bubble_class}">'
+                    f'<button type="button" class="button admin-chat-load-older" '
+                    f'data-url="{escape(transcript_url)}" data-before="{messages[0].sequence}">'
+                    f"Load older messages</button>"
                 )
-
-                if msg.reply_to_message:
-                    reply_sender_name = "Unknown"
-                    if msg.reply_to_message.sender:
-                        reply_sender_name = escape(
-                            msg.reply_to_message.sender.username
-                            or msg.reply_to_message.sender.email
-                            or f"User ID {msg.reply_to_message.sender.id}"
-                        )
-                    reply_content_preview = "Message"
-                    if msg.reply_to_message.content:
-                        reply_content_preview = truncatechars(
-                            str(msg.reply_to_message.content), 40
-                        )
-                    elif msg.reply_to_message.image:
-                        reply_content_preview = "[Image]"
-                    messages_html_parts.append(
-                        f'<div class="admin-message-reply-info">'
-                        f'<span class="reply-sender">{reply_sender_name}:</span> '
-                        f'<span class="reply-content">"{escape(reply_content_preview)}"</span>'
-                        f"</div>"
-                    )
-
-                if msg.content:
-                    escaped_content = escape(msg.content)
-                    messages_html_parts.append(
-                        f'<div class="admin-message-content"><p>{escaped_content}</p></div>'
-                    )
-
-                if msg.image and hasattr(msg.image, "url") and msg.image.url:
-                    img_url_safe = escape(msg.image.url)
-                    image_only_class = "image-only" if not msg.content else ""
-                    messages_html_parts.append(
-                        f'<div class="admin-message-image {image_only_class}"><a href="{img_url_safe}" target="_blank"><img src="{img_url_safe}" alt="Chat image"></a></div>'
-                    )
-
-                meta_parts = [msg.timestamp.strftime("%b %d, %H:%M")]
-                if msg.is_edited:
-                    meta_parts.append("Edited")
-                meta_info_str = " • ".join(meta_parts)
-                messages_html_parts.append(
-                    f'<div class="admin-message-meta">{meta_info_str}</div>'
-                )
-
-                messages_html_parts.append("</div>")
-                messages_html_parts.append("</div>")
+            for msg in messages:
+                messages_html_parts.append(_render_message_html(msg, user_a_id))
 
         messages_html_parts.append("</div>")
 
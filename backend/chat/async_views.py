@@ -0,0 +1,280 @@
+# chat/async_views.py
+"""
+Async versions of the message write endpoints, served under /api/messages/async/.
+
+DRF views are sync, so under ASGI every request crosses into a thread and each
+``async_to_sync(group_send)`` crosses back. These keep DRF's authentication,
+permissions, parsers, serializers and error responses but await their
+handlers: reads use the async ORM, the channel layer is awaited directly, and
+only the transactional write (Django 4.2 has no async transactions) runs in
+one ``sync_to_async`` call. With the outbox on, that call writes the
+broadcast too. Parsing and validating the body, images included, happens in
+a worker thread of its own. They answer like their DRF counterparts in chat/views.py.
+"""
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import exceptions, permissions, serializers, status, views
+from rest_framework.response import Response
+
+from src.metrics import MESSAGES_CREATED
+from src.tracing import span
+from .broadcast import (
+    abroadcast_message_deleted,
+    abroadcast_message_updated,
+    abroadcast_new_message,
+    broadcast_message_deleted,
+    broadcast_message_updated,
+    broadcast_new_message,
+    outbox_enabled,
+)
+from .models import Conversation, Message, MessageChange
+from .serializers import (
+    AsyncMessageCreateSerializer,
+    MessageEditSerializer,
+    MessageSerializer,
+)
+
+CustomUser = get_user_model()
+
+# What MessageSerializer reads, so serializing never queries.
+MESSAGE_RELATIONS = ("sender__profile", "reply_to_message__sender__profile")
+
+
+class AsyncAPIView(views.APIView):
+    """
+    ``APIView`` with async handlers. DRF 3.14 only calls sync ones, so this is
+    its ``dispatch`` with the handler awaited; authentication and permission
+    checks can query the database and run in one ``sync_to_async`` call.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        self.channel_layer = get_channel_layer()
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(
+                    self, request.method.lower(), self.http_method_not_allowed
+                )
+            else:
+                handler = self.http_method_not_allowed
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        response = self.finalize_response(request, response, *args, **kwargs).render()
+        # Handed on as a plain HttpResponse: Django would otherwise render a
+        # DRF Response (again) in a sync thread.
+        rendered = HttpResponse(response.content, status=response.status_code)
+        for header, value in response.items():
+            rendered[header] = value
+        return rendered
+
+    async def http_method_not_allowed(self, request, *args, **kwargs):
+        raise exceptions.MethodNotAllowed(request.method)
+
+    async def options(self, request, *args, **kwargs):
+        return super().options(request, *args, **kwargs)
+
+    async def validate(self, serializer_class, partial=False):
+        """
+        Parse the body and validate it off the event loop: multipart parsing
+        and Pillow's image check would hold up every other request on it.
+        Validation does not query, so it need not share the request's thread.
+        """
+
+        def validated_data():
+            serializer = serializer_class(data=self.request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            return serializer.validated_data
+
+        return await sync_to_async(validated_data, thread_sensitive=False)()
+
+    async def find_reply(self, conversation, reply_to_message_id):
+        if not reply_to_message_id:
+            return None
+        reply = None
+        if conversation.pk is not None:
+            reply = await (
+                Message.objects.select_related("sender__profile")
+                .filter(
+                    id=reply_to_message_id, conversation=conversation, is_deleted=False
+                )
+                .afirst()
+            )
+        if reply is None:
+            raise serializers.ValidationError(
+                {
+                    "detail": "Message being replied to not found in this conversation or has been deleted."
+                }
+            )
+        return reply
+
+    def serialize(self, message):
+        return MessageSerializer(message, context={"request": self.request}).data
+
+    async def create_message(self, conversation, validated_data, new_participants=()):
+        reply_to = await self.find_reply(
+            conversation, validated_data.get("reply_to_message_id")
+        )
+        message_data = await sync_to_async(self.write_new_message)(
+            conversation, validated_data, reply_to, new_participants
+        )
+        MESSAGES_CREATED.inc(source="rest")
+        if not outbox_enabled():
+            with span("broadcast_new_message"):
+                await abroadcast_new_message(
+                    self.channel_layer, conversation, message_data, self.request.user
+                )
+        return Response(message_data, status=status.HTTP_201_CREATED)
+
+    def write_new_message(
+        self, conversation, validated_data, reply_to, new_participants=()
+    ):
+        """
+        Save the message and return it serialized. The broadcast is only made
+        here, in the transaction, when it goes through the outbox.
+        """
+        sender = self.request.user
+        with transaction.atomic():
+            with span("db.create_message"):
+                if new_participants:
+                    conversation.save()
+                    conversation.participants.add(*new_participants)
+                message = Message.objects.create(
+                    sender=sender,
+                    conversation=conversation,
+                    content=validated_data.get("content"),
+                    image=validated_data.get("image"),
+                    reply_to_message=reply_to,
+                )
+                MessageChange.record(message, MessageChange.CREATED)
+                conversation.save()
+            with span("serialize_message"):
+                message_data = self.serialize(message)
+            if outbox_enabled():
+                broadcast_new_message(conversation, message_data, sender)
+        return message_data
+
+    def save_message_change(self, message, action, broadcast):
+        """Like ``write_new_message``, for an edit or delete of ``message``."""
+        with transaction.atomic():
+            message.save()
+            MessageChange.record(message, action)
+            message_data = self.serialize(message)
+            if outbox_enabled():
+                broadcast(message, message_data)
+        return message_data
+
+
+# URL: /api/messages/async/send/<int:receiver_id>/ (POST - async SendMessageToUserView)
+class AsyncSendMessageToUserView(AsyncAPIView):
+    async def post(self, request, receiver_id):
+        validated_data = await self.validate(AsyncMessageCreateSerializer)
+        sender = request.user
+
+        receiver = await CustomUser.objects.filter(id=receiver_id).afirst()
+        if receiver is None:
+            raise exceptions.NotFound("Receiver not found.")
+        if receiver.id == sender.id:
+            raise serializers.ValidationError(
+                {"detail": "Cannot send messages to yourself."}
+            )
+
+        participants_ids = sorted([sender.id, receiver.id])
+        conversation = await (
+            Conversation.objects.annotate(num_participants=Count("participants"))
+            .filter(participants__id=participants_ids[0])
+            .filter(participants__id=participants_ids[1])
+            .filter(num_participants=2)
+            .afirst()
+        )
+        new_participants = ()
+        if conversation is None:
+            # Created together with its first message.
+            conversation, new_participants = Conversation(), (sender, receiver)
+        return await self.create_message(conversation, validated_data, new_participants)
+
+
+# URL: /api/messages/async/conversations/<int:conversation_pk>/messages/ (POST - async MessageListInConversationView.create)
+class AsyncConversationMessageCreateView(AsyncAPIView):
+    async def post(self, request, conversation_pk):
+        conversation = await Conversation.objects.filter(
+            id=conversation_pk, participants=request.user
+        ).afirst()
+        if conversation is None:
+            raise exceptions.NotFound(
+                "Conversation not found or you are not a participant."
+            )
+
+        validated_data = await self.validate(AsyncMessageCreateSerializer)
+        return await self.create_message(conversation, validated_data)
+
+
+# URL: /api/messages/async/<int:message_pk>/ (GET, PUT, PATCH, DELETE - async MessageDetailUpdateDeleteView)
+class AsyncMessageDetailView(AsyncAPIView):
+    async def get_message(self, message_pk):
+        message = await (
+            Message.objects.select_related(*MESSAGE_RELATIONS)
+            .filter(id=message_pk)
+            .afirst()
+        )
+        if message is None:
+            raise exceptions.NotFound()
+        if message.sender_id != self.request.user.id:
+            raise exceptions.PermissionDenied("You are not the sender of this message.")
+        if message.is_deleted:
+            raise serializers.ValidationError(
+                {"detail": "Cannot modify a deleted message."}
+            )
+
+        #  Time limit for editing (24 hours)
+        time_since_sent = timezone.now() - message.timestamp
+        if time_since_sent.total_seconds() > 24 * 60 * 60:
+            raise exceptions.PermissionDenied("Edit time limit exceeded.")
+        return message
+
+    async def get(self, request, message_pk):
+        return Response(self.serialize(await self.get_message(message_pk)))
+
+    async def put(self, request, message_pk, partial=False):
+        message = await self.get_message(message_pk)
+        validated_data = await self.validate(MessageEditSerializer, partial)
+        if "content" in validated_data:
+            message.content = validated_data["content"]
+        message.is_edited = True
+        message_data = await sync_to_async(self.save_message_change)(
+            message, MessageChange.EDITED, broadcast_message_updated
+        )
+
+        if not outbox_enabled():
+            await abroadcast_message_updated(self.channel_layer, message, message_data)
+        return Response(message_data)
+
+    async def patch(self, request, message_pk):
+        return await self.put(request, message_pk, partial=True)
+
+    async def delete(self, request, message_pk):
+        message = await self.get_message(message_pk)
+        message.is_deleted = True
+        message.content = None
+        message.image = None
+        message_data = await sync_to_async(self.save_message_change)(
+            message, MessageChange.DELETED, broadcast_message_deleted
+        )
+
+        if not outbox_enabled():
+            await abroadcast_message_deleted(self.channel_layer, message, message_data)
+        return Response(status=status.HTTP_204_NO_CONTENT)
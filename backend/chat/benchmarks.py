@@ -0,0 +1,601 @@
+"""
+Benchmarks for the REST endpoints in chat/urls.py and users/urls.py.
+
+Every endpoint has a query budget: the most SQL queries one request may run,
+however many conversations, participants or messages it returns. Budgets are
+checked by the test suite against a small dataset and reported by
+``manage.py bench_endpoints`` against a seeded one, together with latency and
+response size. Requests run inside a transaction that is rolled back, so the
+write endpoints leave the dataset untouched.
+
+``run_fanout_benchmarks`` measures message creation against conversation size
+(``manage.py bench_fanout``), where the cost is the notification sent to every
+other participant. ``run_asgi_throughput`` compares the DRF message endpoint
+with its async version under concurrent ASGI requests (``manage.py bench_asgi``).
+``run_local_delivery_benchmark`` compares group sends through Redis with the
+local-delivery layer, for groups with members in and outside the sending
+process (``manage.py bench_local_delivery``).
+"""
+
+import asyncio
+import collections
+import contextvars
+import datetime
+import json
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.models import UserProfile
+
+from .broadcast import send_to_users, user_group_name
+from .layers import BatchedRedisChannelLayer, LocalDeliveryRedisChannelLayer
+from .loadtest import percentile
+from .models import Conversation, Message
+from .pagination import encode_since_token
+
+CustomUser = get_user_model()
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+}
+FANOUT_EMAIL_DOMAIN = "fanout.invalid"
+
+
+class Endpoint:
+    def __init__(self, name, method, url, budget, data=None, requires=()):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.budget = budget
+        # A dict, or a function of the context like ``url``.
+        self.data = data
+        # Context keys the endpoint needs; it is skipped when one is missing.
+        self.requires = requires
+
+
+ENDPOINTS = [
+    Endpoint(
+        "conversation-list", "GET", lambda c: reverse("conversation-list-create"), 7
+    ),
+    Endpoint(
+        "conversation-list-page",
+        "GET",
+        lambda c: reverse("conversation-list-create") + "?limit=30",
+        7,
+    ),
+    Endpoint(
+        "conversation-sync",
+        "GET",
+        lambda c: reverse("conversation-list-create") + f"?since={c['since_token']}",
+        7,
+        requires=("since_token",),
+    ),
+    Endpoint(
+        "conversation-create",
+        "POST",
+        lambda c: reverse("conversation-list-create"),
+        14,
+        data=lambda c: {"participant_ids": [c["other_user_id"]]},
+        requires=("other_user_id",),
+    ),
+    Endpoint(
+        "conversation-messages",
+        "GET",
+        lambda c: reverse(
+            "conversation-messages-list-create", args=[c["conversation_id"]]
+        ),
+        6,
+        requires=("conversation_id",),
+    ),
+    Endpoint(
+        "conversation-messages-tail",
+        "GET",
+        lambda c: reverse(
+            "conversation-messages-list-create", args=[c["conversation_id"]]
+        )
+        + f"?after_sequence={c['tail_sequence']}",
+        6,
+        requires=("conversation_id",),
+    ),
+    Endpoint(
+        "messages-with-user",
+        "GET",
+        lambda c: reverse("messages-with-user", args=[c["other_user_id"]]),
+        7,
+        requires=("other_user_id",),
+    ),
+    Endpoint(
+        "message-change-feed",
+        "GET",
+        lambda c: reverse("message-change-feed") + "?since=0",
+        2,
+    ),
+    Endpoint(
+        "conversation-export",
+        "GET",
+        lambda c: reverse("conversation-export", args=[c["conversation_id"]]),
+        5,
+        requires=("conversation_id",),
+    ),
+    Endpoint("users-sidebar", "GET", lambda c: reverse("list-sidebar"), 2),
+    Endpoint("users-search", "GET", lambda c: reverse("list-sidebar") + "?search=a", 2),
+    Endpoint("auth-check", "GET", lambda c: reverse("check"), 2),
+    Endpoint(
+        "message-create",
+        "POST",
+        lambda c: reverse(
+            "conversation-messages-list-create", args=[c["conversation_id"]]
+        ),
+        13,
+        data={"content": "benchmark message"},
+        requires=("conversation_id",),
+    ),
+    Endpoint(
+        "message-edit",
+        "PATCH",
+        lambda c: reverse("message-detail-update-delete", args=[c["own_message_id"]]),
+        8,
+        data={"content": "benchmark edit"},
+        requires=("own_message_id",),
+    ),
+    Endpoint(
+        "send-to-user",
+        "POST",
+        lambda c: reverse("messages-send-to-user", args=[c["other_user_id"]]),
+        14,
+        data={"content": "benchmark direct message"},
+        requires=("other_user_id",),
+    ),
+    Endpoint(
+        "async-message-create",
+        "POST",
+        lambda c: reverse(
+            "async-conversation-messages-create", args=[c["conversation_id"]]
+        ),
+        13,
+        data={"content": "benchmark message"},
+        requires=("conversation_id",),
+    ),
+    Endpoint(
+        "async-message-edit",
+        "PATCH",
+        lambda c: reverse(
+            "async-message-detail-update-delete", args=[c["own_message_id"]]
+        ),
+        6,
+        data={"content": "benchmark edit"},
+        requires=("own_message_id",),
+    ),
+    Endpoint(
+        "async-send-to-user",
+        "POST",
+        lambda c: reverse("async-messages-send-to-user", args=[c["other_user_id"]]),
+        14,
+        data={"content": "benchmark direct message"},
+        requires=("other_user_id",),
+    ),
+]
+
+# URL names deliberately left out: chunked uploads are dominated by file IO,
+# and the auth endpoints by password hashing and token signing.
+UNBENCHMARKED = {
+    "conversation-upload-create",
+    "upload-detail",
+    "upload-finalize",
+    "signup",
+    "login",
+    "logout",
+    "token_obtain_pair",
+    "token_refresh",
+    "token_verify",
+    "update-profile",
+}
+
+
+def build_context(user):
+    """Ids the endpoint URLs are built from, taken from ``user``'s data."""
+    epoch = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+    context = {"since_token": encode_since_token(epoch, 0)}
+    busiest = (
+        user.conversations.annotate(message_total=Count("messages"))
+        .order_by("-message_total")
+        .values_list("id", "last_sequence")
+        .first()
+    )
+    if busiest:
+        context["conversation_id"], last_sequence = busiest
+        context["tail_sequence"] = max(0, last_sequence - 50)
+
+    direct = (
+        Conversation.objects.annotate(participant_total=Count("participants"))
+        .filter(participants=user, participant_total=2)
+        .values_list("id", flat=True)
+        .first()
+    )
+    if direct:
+        context["other_user_id"] = (
+            Conversation.participants.through.objects.filter(conversation_id=direct)
+            .exclude(customuser_id=user.id)
+            .values_list("customuser_id", flat=True)
+            .first()
+        )
+
+    # Messages can only be edited for a day after they were sent.
+    own_message_id = (
+        Message.objects.filter(
+            sender=user,
+            is_deleted=False,
+            timestamp__gte=timezone.now() - datetime.timedelta(hours=23),
+        )
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    if own_message_id:
+        context["own_message_id"] = own_message_id
+    return context
+
+
+def run_endpoint(client, endpoint, context, iterations=10):
+    """
+    Time ``iterations`` requests (after one warm-up request) and count the
+    queries of the last one.
+    """
+    url = endpoint.url(context)
+    data = endpoint.data(context) if callable(endpoint.data) else endpoint.data
+    timings = []
+    for iteration in range(iterations + 1):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.generic(
+                    endpoint.method,
+                    url,
+                    data=None if data is None else json.dumps(data),
+                    content_type="application/json",
+                )
+                body = (
+                    b"".join(response.streaming_content)
+                    if response.streaming
+                    else response.content
+                )
+                elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        if iteration:
+            timings.append(elapsed)
+
+    queries = len(captured.captured_queries)
+    return {
+        "name": endpoint.name,
+        "method": endpoint.method,
+        "path": url,
+        "status": response.status_code,
+        "latency_ms_p50": round(percentile(timings, 0.50) * 1000, 2),
+        "latency_ms_p95": round(percentile(timings, 0.95) * 1000, 2),
+        "queries": queries,
+        "query_budget": endpoint.budget,
+        "over_budget": queries > endpoint.budget,
+        "bytes": len(body),
+    }
+
+
+def run_benchmarks(user, iterations=10, names=None):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+    context = build_context(user)
+
+    results = []
+    with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+        for endpoint in ENDPOINTS:
+            if names and endpoint.name not in names:
+                continue
+            if any(context.get(key) is None for key in endpoint.requires):
+                continue
+            results.append(run_endpoint(client, endpoint, context, iterations))
+    return results
+
+
+def compare_to_baseline(results, baseline, latency_tolerance=0.5):
+    """
+    Regressions of ``results`` against a stored ``baseline`` run: any endpoint
+    that now runs more queries, or whose p50 latency grew by more than
+    ``latency_tolerance`` (a fraction), as ``(name, description)`` pairs.
+    """
+    previous = {result["name"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result["name"])
+        if before is None:
+            continue
+        if result["queries"] > before["queries"]:
+            regressions.append(
+                (result["name"], f"queries {before['queries']} -> {result['queries']}")
+            )
+        allowed = before["latency_ms_p50"] * (1 + latency_tolerance)
+        if before["latency_ms_p50"] and result["latency_ms_p50"] > allowed:
+            regressions.append(
+                (
+                    result["name"],
+                    f"p50 {before['latency_ms_p50']}ms -> {result['latency_ms_p50']}ms",
+                )
+            )
+    return regressions
+
+
+def run_fanout_benchmarks(sizes, iterations=10):
+    """
+    For each conversation size: the latency of posting a message, and of its
+    participant notifications on their own, sent as one batch
+    (``send_to_users``) and as one ``group_send`` per participant. Uses the
+    configured channel layer; every participant's personal group has one
+    subscribed channel. The fixtures are rolled back afterwards.
+    """
+    results = []
+    for size in sizes:
+        with transaction.atomic():
+            results.append(run_fanout(size, iterations))
+            transaction.set_rollback(True)
+    return results
+
+
+def create_fanout_conversation(size):
+    run_id = uuid.uuid4().hex[:8]
+    CustomUser.objects.bulk_create(
+        CustomUser(
+            email=f"{run_id}-{index}@{FANOUT_EMAIL_DOMAIN}",
+            username=f"fanout-{run_id}-{index}",
+            password=make_password(None),
+        )
+        for index in range(size)
+    )
+    users = list(
+        CustomUser.objects.filter(
+            email__startswith=f"{run_id}-", email__endswith=f"@{FANOUT_EMAIL_DOMAIN}"
+        ).order_by("id")
+    )
+    UserProfile.objects.bulk_create(UserProfile(user=user) for user in users)
+    conversation = Conversation.objects.create()
+    conversation.participants.add(*users)
+    return conversation, users
+
+
+async def subscribe(channel_layer, groups):
+    channels = [await channel_layer.new_channel() for _ in groups]
+    await asyncio.gather(
+        *(
+            channel_layer.group_add(group, channel)
+            for group, channel in zip(groups, channels)
+        )
+    )
+    return channels
+
+
+async def unsubscribe(channel_layer, groups, channels):
+    await asyncio.gather(
+        *(
+            channel_layer.group_discard(group, channel)
+            for group, channel in zip(groups, channels)
+        )
+    )
+
+
+def timed(function, iterations):
+    """Seconds per call of ``function(iteration)``, after one warm-up call."""
+    timings = []
+    for iteration in range(iterations + 1):
+        started = time.perf_counter()
+        function(iteration)
+        if iteration:
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def run_fanout(size, iterations):
+    conversation, users = create_fanout_conversation(size)
+    sender, recipient_ids = users[0], [user.id for user in users[1:]]
+    channel_layer = get_channel_layer()
+    groups = [user_group_name(user.id) for user in users]
+    channels = async_to_sync(subscribe)(channel_layer, groups)
+
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(sender)}")
+    url = reverse("conversation-messages-list-create", args=[conversation.id])
+    statuses = set()
+
+    def post_message(iteration):
+        response = client.post(url, {"content": f"fan-out {iteration}"}, format="json")
+        statuses.add(response.status_code)
+
+    event = {
+        "type": "new.message.notification",
+        "message": {"content": "fan-out"},
+        "conversation_id": conversation.id,
+        "sender_id": sender.id,
+        "sender_username": sender.username,
+    }
+
+    def send_batched(iteration):
+        send_to_users(recipient_ids, event)
+
+    def send_sequential(iteration):
+        for recipient_id in recipient_ids:
+            async_to_sync(channel_layer.group_send)(
+                user_group_name(recipient_id), event
+            )
+
+    try:
+        request_timings = timed(post_message, iterations)
+        batched_timings = timed(send_batched, iterations)
+        sequential_timings = timed(send_sequential, iterations)
+    finally:
+        async_to_sync(unsubscribe)(channel_layer, groups, channels)
+
+    return {
+        "size": size,
+        "status": max(statuses),
+        "request_ms_p50": round(percentile(request_timings, 0.50) * 1000, 2),
+        "request_ms_p95": round(percentile(request_timings, 0.95) * 1000, 2),
+        "fanout_batched_ms_p50": round(percentile(batched_timings, 0.50) * 1000, 2),
+        "fanout_sequential_ms_p50": round(
+            percentile(sequential_timings, 0.50) * 1000, 2
+        ),
+    }
+
+
+# (label, URL name) of the endpoints compared by run_asgi_throughput.
+ASGI_ROUTES = (
+    ("sync", "conversation-messages-list-create"),
+    ("async", "async-conversation-messages-create"),
+)
+
+
+def run_asgi_throughput(size=10, requests=200, concurrency=20):
+    """
+    Post ``requests`` messages to a conversation of ``size`` participants from
+    ``concurrency`` clients at once, through Django's ASGI handler with all
+    middleware, once per route in ``ASGI_ROUTES``. Unlike the other benchmarks
+    this commits its writes (their database work runs on asgiref's sync
+    thread, outside any transaction here), so the fixtures are deleted
+    afterwards.
+    """
+    conversation, users = create_fanout_conversation(size)
+    token = AccessToken.for_user(users[0])
+    try:
+        return [
+            # A fresh context: none of the caller's asgiref state (e.g. from
+            # an earlier async_to_sync in this thread) leaks into the run.
+            contextvars.Context().run(
+                asyncio.run,
+                post_concurrently(
+                    label,
+                    reverse(url_name, args=[conversation.id]),
+                    token,
+                    requests,
+                    concurrency,
+                ),
+            )
+            for label, url_name in ASGI_ROUTES
+        ]
+    finally:
+        conversation.delete()
+        CustomUser.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+
+async def post_concurrently(label, url, token, requests, concurrency):
+    client = AsyncClient()
+    # Per request: Django 4.2's AsyncClient drops client-wide headers.
+    headers = {"Authorization": f"Bearer {token}"}
+    pending = iter(range(requests))
+    timings, statuses = [], collections.Counter()
+
+    async def post_until_done():
+        for index in pending:
+            started = time.perf_counter()
+            response = await client.post(
+                url,
+                {"content": f"throughput {index}"},
+                content_type="application/json",
+                headers=headers,
+            )
+            timings.append(time.perf_counter() - started)
+            statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(post_until_done() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "route": label,
+        "path": url,
+        "requests": requests,
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1),
+        "latency_ms_p50": round(percentile(timings, 0.50) * 1000, 2),
+        "latency_ms_p95": round(percentile(timings, 0.95) * 1000, 2),
+        "statuses": dict(statuses),
+    }
+
+
+# (label, layer class) compared by run_local_delivery_benchmark.
+GROUP_SEND_LAYERS = (
+    ("redis", BatchedRedisChannelLayer),
+    ("local", LocalDeliveryRedisChannelLayer),
+)
+
+
+def run_local_delivery_benchmark(
+    hosts, recipients=100, local_shares=(0, 0.5, 1), iterations=20
+):
+    """
+    The time from one ``group_send`` until all ``recipients`` members of the
+    group have received it, per layer in ``GROUP_SEND_LAYERS``. A share of the
+    members receive in the sending process and the rest in another one,
+    simulated by a second layer instance on the same Redis ``hosts``.
+    """
+    results = []
+    for local_share in local_shares:
+        local_count = round(recipients * local_share)
+        result = {
+            "recipients": recipients,
+            "local": local_count,
+            "remote": recipients - local_count,
+        }
+        for label, layer_class in GROUP_SEND_LAYERS:
+            timings = contextvars.Context().run(
+                asyncio.run,
+                time_group_send(
+                    layer_class, hosts, recipients, local_count, iterations
+                ),
+            )
+            result[f"{label}_ms_p50"] = round(percentile(timings, 0.50) * 1000, 2)
+            result[f"{label}_ms_p95"] = round(percentile(timings, 0.95) * 1000, 2)
+        results.append(result)
+    return results
+
+
+async def time_group_send(layer_class, hosts, recipients, local_count, iterations):
+    sender, other = layer_class(hosts=hosts), layer_class(hosts=hosts)
+    members = [sender if index < local_count else other for index in range(recipients)]
+    channels = [await layer.new_channel() for layer in members]
+    group = f"bench_group_send_{uuid.uuid4().hex}"
+    await asyncio.gather(
+        *(layer.group_add(group, channel) for layer, channel in zip(members, channels))
+    )
+    timings = []
+    try:
+        for iteration in range(iterations + 1):
+            receiving = [
+                asyncio.ensure_future(layer.receive(channel))
+                for layer, channel in zip(members, channels)
+            ]
+            # Let the receivers start waiting, as consumers would be.
+            await asyncio.sleep(0.01)
+            started = time.perf_counter()
+            await sender.group_send(
+                group, {"type": "bench.message", "iteration": iteration}
+            )
+            await asyncio.wait_for(asyncio.gather(*receiving), 10)
+            if iteration:
+                timings.append(time.perf_counter() - started)
+    finally:
+        await asyncio.gather(
+            *(
+                layer.group_discard(group, channel)
+                for layer, channel in zip(members, channels)
+            )
+        )
+        await sender.close_pools()
+        await other.close_pools()
+    return timings
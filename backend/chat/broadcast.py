@@ -0,0 +1,200 @@
+import contextvars
+import logging
+from contextlib import contextmanager
+from functools import partial
+
+import redis
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .event_buffer import get_event_buffer
+from .layers import group_send_many
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Broadcasts held back by the innermost defer_broadcasts() block.
+_deferred = contextvars.ContextVar("deferred_broadcasts", default=None)
+
+
+def conversation_group_name(conversation_id):
+    return f"conversation_{conversation_id}"
+
+
+def user_group_name(user_id):
+    return f"user_{user_id}"
+
+
+def buffer_conversation_event(conversation_id, event):
+    """
+    Stamp ``event`` with the next ``event_id`` of the conversation and keep it
+    in the replay buffer. A buffer outage must not block delivery, so the event
+    then simply goes out without an id.
+    """
+    try:
+        event["event_id"] = get_event_buffer().append(conversation_id, event)
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not buffer event for conversation {conversation_id}: {e}")
+    return event
+
+
+def outbox_enabled():
+    return settings.CHAT_BROADCAST_OUTBOX
+
+
+@contextmanager
+def defer_broadcasts():
+    """
+    Hold the broadcasts made in the block back until it has completed, so the
+    transaction it wraps is committed before anyone is told about the write,
+    and nothing is sent if it fails. With the outbox on, broadcasts are outbox
+    rows written on the spot instead, in that same transaction.
+    """
+    if _deferred.get() is not None:
+        yield
+        return
+    pending = []
+    token = _deferred.set(pending)
+    try:
+        yield
+    finally:
+        _deferred.reset(token)
+    for publish in pending:
+        publish()
+
+
+def _send_or_defer(publish):
+    pending = _deferred.get()
+    if pending is None:
+        publish()
+    else:
+        pending.append(publish)
+
+
+def send_conversation_event(conversation_id, event):
+    buffer_conversation_event(conversation_id, event)
+    async_to_sync(get_channel_layer().group_send)(
+        conversation_group_name(conversation_id), event
+    )
+
+
+def publish_conversation_event(conversation_id, event):
+    """``send_conversation_event`` now, after the enclosing write, or through the outbox."""
+    if outbox_enabled():
+        OutboxEvent.objects.create(
+            kind=OutboxEvent.CONVERSATION, conversation_id=conversation_id, event=event
+        )
+        return
+    _send_or_defer(partial(send_conversation_event, conversation_id, event))
+
+
+def send_to_users(user_ids, event):
+    """Send ``event`` to the personal groups of ``user_ids`` in one batch."""
+    async_to_sync(group_send_many)(
+        get_channel_layer(), [user_group_name(user_id) for user_id in user_ids], event
+    )
+
+
+def publish_to_users(user_ids, event):
+    """``send_to_users`` now, after the enclosing write, or through the outbox."""
+    user_ids = list(user_ids)
+    if outbox_enabled():
+        if user_ids:
+            OutboxEvent.objects.create(
+                kind=OutboxEvent.USERS, user_ids=user_ids, event=event
+            )
+        return
+    _send_or_defer(partial(send_to_users, user_ids, event))
+
+
+async def apublish_conversation_event(channel_layer, conversation_id, event):
+    await sync_to_async(buffer_conversation_event)(conversation_id, event)
+    await channel_layer.group_send(conversation_group_name(conversation_id), event)
+
+
+def broadcast_new_message(conversation, message_data, sender):
+    """
+    Push a freshly created message to the conversation's open chat sockets and
+    a notification to every other participant's personal group.
+    """
+    publish_conversation_event(
+        conversation.id, {"type": "chat.message", "message": message_data}
+    )
+
+    recipient_ids = conversation.participants.exclude(pk=sender.pk).values_list(
+        "pk", flat=True
+    )
+    publish_to_users(
+        recipient_ids,
+        {
+            "type": "new.message.notification",
+            "message": message_data,
+            "conversation_id": conversation.id,
+            "sender_id": sender.id,
+            "sender_username": sender.get_full_name() or sender.username,
+        },
+    )
+
+
+async def abroadcast_new_message(channel_layer, conversation, message_data, sender):
+    """``broadcast_new_message`` for async views, awaiting the channel layer directly."""
+    await apublish_conversation_event(
+        channel_layer,
+        conversation.id,
+        {"type": "chat.message", "message": message_data},
+    )
+
+    recipient_ids = conversation.participants.exclude(pk=sender.pk).values_list(
+        "pk", flat=True
+    )
+    await group_send_many(
+        channel_layer,
+        [user_group_name(recipient_id) async for recipient_id in recipient_ids],
+        {
+            "type": "new.message.notification",
+            "message": message_data,
+            "conversation_id": conversation.id,
+            "sender_id": sender.id,
+            "sender_username": sender.get_full_name() or sender.username,
+        },
+    )
+
+
+def broadcast_message_updated(message, message_data):
+    publish_conversation_event(
+        message.conversation_id, {"type": "message.updated", "message": message_data}
+    )
+
+
+def broadcast_message_deleted(message, message_data):
+    publish_conversation_event(
+        message.conversation_id,
+        {
+            "type": "message.deleted",
+            "message_id": message.id,
+            "deleted_message_data": message_data,
+            "conversation_id": message.conversation_id,
+        },
+    )
+
+
+async def abroadcast_message_updated(channel_layer, message, message_data):
+    await apublish_conversation_event(
+        channel_layer,
+        message.conversation_id,
+        {"type": "message.updated", "message": message_data},
+    )
+
+
+async def abroadcast_message_deleted(channel_layer, message, message_data):
+    await apublish_conversation_event(
+        channel_layer,
+        message.conversation_id,
+        {
+            "type": "message.deleted",
+            "message_id": message.id,
+            "deleted_message_data": message_data,
+            "conversation_id": message.conversation_id,
+        },
+    )
@@ -0,0 +1,59 @@
+import hashlib
+
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+class ConditionalGetMixin:
+    """
+    Answers ``If-None-Match`` on list endpoints with ``304 Not Modified``.
+
+    Views implement ``get_validator_parts()`` returning a few cheap values
+    (timestamps, counters, max ids) that change whenever the response body
+    would, or ``None`` to skip conditional handling. The full queryset and
+    serializer only run when the validator no longer matches.
+    """
+
+    def get_validator_parts(self):
+        raise NotImplementedError
+
+    def get_etag(self, request):
+        parts = self.get_validator_parts()
+        if parts is None:
+            return None
+        key = repr(
+            (
+                request.user.pk,
+                request.get_full_path(),
+                request.headers.get("Accept", ""),
+                *parts,
+            )
+        )
+        return 'W/"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is not None:
+            client_etags = parse_etags(request.headers.get("If-None-Match", ""))
+            if "*" in client_etags or _strip_weak(etag) in map(
+                _strip_weak, client_etags
+            ):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                return self._add_validator_headers(response, etag)
+
+        response = super().get(request, *args, **kwargs)
+        if etag is not None and response.status_code == status.HTTP_200_OK:
+            self._add_validator_headers(response, etag)
+        return response
+
+    def _add_validator_headers(self, response, etag):
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        patch_vary_headers(response, ("Accept", "Authorization"))
+        return response
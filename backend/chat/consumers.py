@@ -1,15 +1,33 @@
 # chat/consumers.py
 import json
 import logging
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from .models import Message, Conversation
+from django.conf import settings
+from django.db import transaction
+from .models import Message, MessageChange, Conversation
 from django.contrib.auth import get_user_model
 from .serializers import MessageSerializer
+from .broadcast import apublish_conversation_event
+from .db import database_sync_to_async
+from .event_buffer import get_event_buffer
 from django.db.models.functions import Now
+from src.db_router import pin_to_primary
+from src.query_profiler import current_profile, query_profile
+from src.tracing import current_span, start_trace
+from src.metrics import (
+    MESSAGES_CREATED,
+    WEBSOCKET_CONNECTIONS,
+    WEBSOCKET_CONNECTS,
+    WEBSOCKET_FRAMES_RECEIVED,
+)
 
 CustomUser = get_user_model()
 
+# Frame types counted by name; anything else a client sends is "other".
+KNOWN_FRAME_TYPES = {"chat_message_new", "resume", "typing_started", "typing_stopped"}
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -18,6 +36,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.user = self.scope.get("user")
 
         if not self.user or not self.user.is_authenticated:
+            WEBSOCKET_CONNECTS.inc(consumer="chat", outcome="unauthenticated")
             await self.close()
             return
 
@@ -28,6 +47,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logging.warning(
                 f"User {self.user.id} attempted to connect to conversation {self.conversation_id} but is not a participant."
             )
+            WEBSOCKET_CONNECTS.inc(consumer="chat", outcome="forbidden")
             await self.close()
             return
 
@@ -35,11 +55,23 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.conversation_group_name, self.channel_name
         )
         await self.accept()
+        self.counted_connection = True
+        WEBSOCKET_CONNECTS.inc(consumer="chat", outcome="accepted")
+        WEBSOCKET_CONNECTIONS.inc(consumer="chat")
         logging.info(
             f"User {self.user.id} connected to chat {self.conversation_id}, channel {self.channel_name}"
         )
 
+        # A reconnecting client may pass the last event it saw as ?last_event_id=N
+        query_params = parse_qs(self.scope.get("query_string", b"").decode("utf-8"))
+        last_event_id = query_params.get("last_event_id", [None])[0]
+        if last_event_id is not None:
+            await self.replay_missed_events(last_event_id)
+
     async def disconnect(self, close_code):
+        if getattr(self, "counted_connection", False):
+            self.counted_connection = False
+            WEBSOCKET_CONNECTIONS.dec(consumer="chat")
         if (
             hasattr(self, "conversation_group_name")
             and self.user
@@ -61,6 +93,24 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 f"User {self.user.id} disconnected from chat {self.conversation_id}, channel {self.channel_name}"
             )
 
+    async def websocket_receive(self, message):
+        # Profiles and traces one client event, across its DB helpers.
+        with start_trace(
+            "ws.receive", conversation_id=self.conversation_id
+        ), query_profile("ws chat"):
+            await super().websocket_receive(message)
+
+    async def dispatch(self, message):
+        # Channel layer events sent from a traced request or frame carry its
+        # context; delivering them to this socket continues that trace.
+        if "trace" in message:
+            with start_trace(
+                "ws.deliver", parent=message["trace"], event_type=message["type"]
+            ):
+                await super().dispatch(message)
+            return
+        await super().dispatch(message)
+
     async def receive(self, text_data):
         if not self.user or not self.user.is_authenticated:
             await self.close()
@@ -69,6 +119,16 @@ class ChatConsumer(AsyncWebsocketConsumer):
         try:
             text_data_json = json.loads(text_data)
             message_type = text_data_json.get("type")
+            counted_type = (
+                message_type if message_type in KNOWN_FRAME_TYPES else "other"
+            )
+            WEBSOCKET_FRAMES_RECEIVED.inc(consumer="chat", type=counted_type)
+            profile = current_profile()
+            if profile is not None:
+                profile.label = f"ws chat {counted_type}"
+            trace = current_span()
+            if trace is not None:
+                trace.set(event_type=counted_type, user_id=self.user.id)
 
             client_conversation_id_raw = text_data_json.get("conversation_id")
             client_conversation_id = (
@@ -108,15 +168,20 @@ class ChatConsumer(AsyncWebsocketConsumer):
                             )
                         )
                         return
+                    MESSAGES_CREATED.inc(source="websocket")
 
                     await self.update_conversation_timestamp(self.conversation_id)
                     serialized_message = await self.serialize_db_message(message_db)
 
-                    await self.channel_layer.group_send(
-                        self.conversation_group_name,
+                    await apublish_conversation_event(
+                        self.channel_layer,
+                        self.conversation_id,
                         {"type": "chat.message", "message": serialized_message},
                     )
 
+            elif message_type == "resume":
+                await self.replay_missed_events(text_data_json.get("last_event_id"))
+
             elif message_type == "typing_started":
                 await self.channel_layer.group_send(
                     self.conversation_group_name,
@@ -153,17 +218,74 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 exc_info=True,
             )
 
+    async def replay_missed_events(self, last_event_id):
+        """
+        Re-send the buffered events after ``last_event_id``, and the few
+        before it that a concurrent sender may not have delivered yet, or
+        tell the client to resync over REST when they are no longer all in the
+        buffer. The socket joins the group before replaying so nothing falls
+        in between; clients drop any event_id they have already seen.
+        """
+        try:
+            last_event_id = int(last_event_id)
+        except (TypeError, ValueError):
+            await self.send(
+                text_data=json.dumps({"error": "last_event_id must be an integer."})
+            )
+            return
+
+        events, head = await sync_to_async(get_event_buffer().since)(
+            self.conversation_id, last_event_id, settings.CHAT_EVENT_REPLAY_OVERLAP
+        )
+        if events is None:
+            logging.info(
+                f"User {self.user.id} must resync chat {self.conversation_id}: event {last_event_id} is no longer buffered"
+            )
+            await self.send(
+                text_data=json.dumps(
+                    {
+                        "type": "resync_required",
+                        "conversation_id": self.conversation_id,
+                        "last_event_id": head,
+                    }
+                )
+            )
+            return
+
+        for event in events:
+            await self.dispatch(event)
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "resume_complete",
+                    "conversation_id": self.conversation_id,
+                    "replayed": len(events),
+                    "last_event_id": head,
+                }
+            )
+        )
+
     async def chat_message(self, event):
         message_data = event["message"]
         await self.send(
-            text_data=json.dumps({"type": "chat_message", "message": message_data})
+            text_data=json.dumps(
+                {
+                    "type": "chat_message",
+                    "message": message_data,
+                    "event_id": event.get("event_id"),
+                }
+            )
         )
 
     async def message_updated(self, event):
         updated_message_data = event["message"]
         await self.send(
             text_data=json.dumps(
-                {"type": "message_updated", "message": updated_message_data}
+                {
+                    "type": "message_updated",
+                    "message": updated_message_data,
+                    "event_id": event.get("event_id"),
+                }
             )
         )
 
@@ -174,7 +296,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     "type": "message_deleted",
                     "message_id": event["message_id"],
                     "conversation_id": event["conversation_id"],
-                    "message": event.get("message"),
+                    "message": event.get("deleted_message_data"),
+                    "event_id": event.get("event_id"),
                 }
             )
         )
@@ -223,12 +346,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
         try:
             conv_id = int(conv_id_str)
             conv = Conversation.objects.get(id=conv_id)
-            msg = Message.objects.create(
-                conversation=conv,
-                sender=sender_obj,
-                content=content_text,
-                image=image_obj,
-            )
+            with transaction.atomic():
+                msg = Message.objects.create(
+                    conversation=conv,
+                    sender=sender_obj,
+                    content=content_text,
+                    image=image_obj,
+                )
+                MessageChange.record(msg, MessageChange.CREATED)
+            pin_to_primary(sender_obj.pk)
             return msg
         except Conversation.DoesNotExist:
             logging.error(
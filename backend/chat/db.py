@@ -0,0 +1,71 @@
+"""
+``database_sync_to_async`` that reports how backed up the database thread is.
+
+Consumers run their ORM calls through ``database_sync_to_async``, which hands
+them to asgiref's thread-sensitive executor: one thread, first come first
+served. When that thread is busy, calls queue up and every socket waits; the
+queue depth and wait time recorded here make that visible. The calls' queries
+also go to the query profiler, and each call gets a tracing span.
+"""
+
+import contextvars
+import functools
+import time
+
+from channels.db import DatabaseSyncToAsync as BaseDatabaseSyncToAsync
+
+from src.metrics import (
+    DB_THREAD_CALL_SECONDS,
+    DB_THREAD_QUEUE_DEPTH,
+    DB_THREAD_WAIT_SECONDS,
+)
+from src.query_profiler import record_queries
+from src.tracing import span
+
+# The executor runs the call in a copy of the caller's context, so the call
+# can find its own queue entry here.
+_queued_call = contextvars.ContextVar("queued_db_call", default=None)
+
+
+class QueuedCall:
+    def __init__(self):
+        self.queued_at = time.perf_counter()
+        self.started = False
+        self.waited = None
+
+    def start(self):
+        self.started = True
+        self.waited = time.perf_counter() - self.queued_at
+        DB_THREAD_QUEUE_DEPTH.dec()
+        DB_THREAD_WAIT_SECONDS.observe(self.waited)
+
+
+class DatabaseSyncToAsync(BaseDatabaseSyncToAsync):
+    def __init__(self, func, *args, **kwargs):
+        @functools.wraps(func)
+        def run(*call_args, **call_kwargs):
+            call = _queued_call.get()
+            if call is not None and not call.started:
+                call.start()
+            waited_ms = round(call.waited * 1000, 2) if call is not None else None
+            with span(
+                f"db.{func.__name__}", queue_wait_ms=waited_ms
+            ), DB_THREAD_CALL_SECONDS.time(), record_queries(func.__qualname__):
+                return func(*call_args, **call_kwargs)
+
+        super().__init__(run, *args, **kwargs)
+
+    async def __call__(self, *args, **kwargs):
+        call = QueuedCall()
+        token = _queued_call.set(call)
+        DB_THREAD_QUEUE_DEPTH.inc()
+        try:
+            return await super().__call__(*args, **kwargs)
+        finally:
+            _queued_call.reset(token)
+            if not call.started:
+                # Cancelled (or failed) before it got a thread.
+                DB_THREAD_QUEUE_DEPTH.dec()
+
+
+database_sync_to_async = DatabaseSyncToAsync
@@ -0,0 +1,149 @@
+"""
+Bounded per-conversation buffer of recent broadcast events.
+
+Every message event sent to a conversation group gets a dense, per-conversation
+``event_id`` and is kept in the buffer, so a ``ChatConsumer`` that reconnects
+can replay exactly what it missed. Only when the gap is older than the buffer
+does the client have to resync over REST.
+
+Ids are handed out before the event is sent to the group, so concurrent
+senders can deliver id N+1 before id N, and a client that saw N+1 last may
+never have got N. Replays therefore start ``overlap`` ids below the client's
+last one (``CHAT_EVENT_REPLAY_OVERLAP``), and clients drop the ids they
+already have.
+"""
+
+import json
+import logging
+import threading
+from collections import deque
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REDIS_EVENT_COUNTER_KEY = "chat_app:conversation:{}:event_id"
+REDIS_EVENT_BUFFER_KEY = "chat_app:conversation:{}:events"
+
+# Assigns the next event id and stores "<id>:<json>" scored by that id in one
+# round trip, trimming the buffer to its size and refreshing both TTLs.
+_APPEND_SCRIPT = """
+local event_id = redis.call('INCR', KEYS[1])
+redis.call('ZADD', KEYS[2], event_id, event_id .. ':' .. ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -(tonumber(ARGV[2]) + 1))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return event_id
+"""
+
+
+class InMemoryEventBuffer:
+    """Per-process buffer for development, mirroring the in-memory channel layer."""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._events = {}
+
+    def append(self, conversation_id, event):
+        conversation_id = str(conversation_id)
+        with self._lock:
+            event_id = self._counters.get(conversation_id, 0) + 1
+            self._counters[conversation_id] = event_id
+            buffer = self._events.setdefault(conversation_id, deque(maxlen=self.size))
+            buffer.append((event_id, json.dumps(event)))
+            return event_id
+
+    def since(self, conversation_id, last_event_id, overlap=0):
+        conversation_id = str(conversation_id)
+        with self._lock:
+            head = self._counters.get(conversation_id, 0)
+            buffered = list(self._events.get(conversation_id, ()))
+        return _replayable(buffered, head, last_event_id, overlap)
+
+
+class RedisEventBuffer:
+    def __init__(self, client, size, ttl):
+        self.client = client
+        self.size = size
+        self.ttl = ttl
+        self._append = client.register_script(_APPEND_SCRIPT)
+
+    def append(self, conversation_id, event):
+        return int(
+            self._append(
+                keys=[
+                    REDIS_EVENT_COUNTER_KEY.format(conversation_id),
+                    REDIS_EVENT_BUFFER_KEY.format(conversation_id),
+                ],
+                args=[json.dumps(event), self.size, self.ttl],
+            )
+        )
+
+    def since(self, conversation_id, last_event_id, overlap=0):
+        buffer_key = REDIS_EVENT_BUFFER_KEY.format(conversation_id)
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.get(REDIS_EVENT_COUNTER_KEY.format(conversation_id))
+        pipeline.zrange(buffer_key, 0, 0, withscores=True)
+        pipeline.zrangebyscore(buffer_key, f"({last_event_id - overlap}", "+inf")
+        head, oldest, members = pipeline.execute()
+
+        buffered = []
+        if oldest:
+            # The oldest entry is enough to tell whether the gap was trimmed.
+            buffered.append((int(oldest[0][1]), None))
+        for member in members:
+            event_id, _, payload = member.partition(":")
+            buffered.append((int(event_id), payload))
+        return _replayable(buffered, int(head or 0), last_event_id, overlap)
+
+
+def _replayable(buffered, head, last_event_id, overlap=0):
+    """
+    Returns ``(events, head)`` with the buffered events after
+    ``last_event_id - overlap``, or ``(None, head)`` when the ones after
+    ``last_event_id`` can no longer all be replayed and the client must resync.
+    """
+    if last_event_id > head:
+        # The client saw ids this buffer never handed out (e.g. Redis was flushed).
+        return None, head
+
+    oldest_id = buffered[0][0] if buffered else head + 1
+    if oldest_id > last_event_id + 1:
+        return None, head
+
+    events = []
+    for event_id, payload in buffered:
+        if event_id > last_event_id - overlap and payload is not None:
+            event = json.loads(payload)
+            event["event_id"] = event_id
+            events.append(event)
+    return events, head
+
+
+_event_buffer = None
+
+
+def get_event_buffer():
+    global _event_buffer
+    if _event_buffer is not None:
+        return _event_buffer
+
+    size = settings.CHAT_EVENT_BUFFER_SIZE
+    if getattr(settings, "USE_REDIS_FOR_EVENT_BUFFER", False):
+        try:
+            client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+            client.ping()
+            _event_buffer = RedisEventBuffer(
+                client, size, settings.CHAT_EVENT_BUFFER_TTL
+            )
+            return _event_buffer
+        except redis.exceptions.RedisError as e:
+            logger.error(
+                f"Event buffer: could not connect to Redis: {e}. Falling back to in-memory buffer."
+            )
+
+    _event_buffer = InMemoryEventBuffer(size)
+    return _event_buffer
@@ -0,0 +1,100 @@
+"""
+NDJSON export of conversations for compliance.
+
+Each conversation is written as one ``{"type": "conversation", ...}`` line
+followed by one ``{"type": "message", ...}`` line per message, in sequence
+order. Messages are read through chunked server-side cursors and encoded
+(optionally gzip-compressed) on the fly, so memory use does not depend on
+the size of the conversation. ``manage.py import_messages`` reads the same
+format back.
+"""
+
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FLUSH_SIZE = 256 * 1024
+
+
+def conversation_record(conversation):
+    return {
+        "type": "conversation",
+        "id": conversation.id,
+        "created_at": conversation.created_at,
+        "updated_at": conversation.updated_at,
+        "last_sequence": conversation.last_sequence,
+        "participants": [
+            {
+                "id": user.id,
+                "email": user.email,
+                "username": user.username,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
+            }
+            for user in conversation.participants.order_by("id")
+        ],
+    }
+
+
+def message_record(message):
+    image_name = message.image.name if message.image else None
+    return {
+        "type": "message",
+        "id": message.id,
+        "conversation_id": message.conversation_id,
+        "sequence": message.sequence,
+        "sender_id": message.sender_id,
+        "sender_email": message.sender.email,
+        "content": message.content,
+        "image": image_name,
+        "image_url": f"{settings.MEDIA_URL}{image_name}" if image_name else None,
+        "timestamp": message.timestamp,
+        "updated_at": message.updated_at,
+        "is_edited": message.is_edited,
+        "is_deleted": message.is_deleted,
+        "reply_to_message_id": message.reply_to_message_id,
+    }
+
+
+def iter_conversation_records(conversations, chunk_size=EXPORT_CHUNK_SIZE):
+    for conversation in conversations.order_by("id").iterator(chunk_size=100):
+        yield conversation_record(conversation)
+        messages = (
+            conversation.messages.select_related("sender")
+            .order_by("sequence")
+            .iterator(chunk_size=chunk_size)
+        )
+        for message in messages:
+            yield message_record(message)
+
+
+def iter_ndjson(records, compress=False):
+    """
+    Encode ``records`` as NDJSON bytes, in chunks of roughly
+    ``EXPORT_FLUSH_SIZE``. With ``compress`` the output is a gzip stream.
+    """
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def emit(data):
+        return compressor.compress(data) if compressor else data
+
+    buffer, buffered_size = [], 0
+    for record in records:
+        line = encoder.encode(record) + "\n"
+        buffer.append(line)
+        buffered_size += len(line)
+        if buffered_size >= EXPORT_FLUSH_SIZE:
+            chunk = emit("".join(buffer).encode("utf-8"))
+            buffer, buffered_size = [], 0
+            if chunk:
+                yield chunk
+
+    tail = emit("".join(buffer).encode("utf-8"))
+    if compressor:
+        tail += compressor.flush()
+    if tail:
+        yield tail
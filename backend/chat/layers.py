@@ -0,0 +1,329 @@
+"""
+Channel layer wrapper that records call counts and latency.
+
+Configured as the layer backend with the real one in ``CONFIG["BACKEND"]``:
+
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "chat.layers.InstrumentedChannelLayer",
+            "CONFIG": {
+                "BACKEND": "chat.layers.LocalDeliveryRedisChannelLayer",
+                "CONFIG": {"hosts": [...]},
+            },
+        }
+    }
+
+Everything that is not timed here is passed through to the wrapped layer.
+Sent events carry the trace context of the sender (``src.tracing.inject``).
+
+``group_send_many()`` sends one event to many groups, e.g. a notification to
+every participant's personal group. ``BatchedRedisChannelLayer`` does that in
+one pipelined round trip per Redis shard for the lookup and one for the
+delivery, instead of a couple of round trips per group; other layers fall
+back to concurrent ``group_send`` calls.
+
+``LocalDeliveryRedisChannelLayer`` also skips Redis for the channels of its
+own process, delivering to them in memory.
+"""
+
+import asyncio
+import collections
+import copy
+import logging
+import time
+
+from channels.exceptions import ChannelFull
+from channels_redis.core import RedisChannelLayer
+from django.utils.module_loading import import_string
+
+from src.metrics import (
+    CHANNEL_LAYER_DELIVERIES,
+    CHANNEL_LAYER_OPERATIONS,
+    CHANNEL_LAYER_SECONDS,
+)
+from src.tracing import inject, span
+
+logger = logging.getLogger(__name__)
+
+# Operations whose payload is an event, which gets the trace context.
+EVENT_OPERATIONS = ("send", "group_send", "group_send_many")
+
+# channels_redis's group_send script: add the message to each channel that is
+# below capacity, return how many were not.
+GROUP_SEND_LUA = """
+    local over_capacity = 0
+    local current_time = ARGV[#ARGV - 1]
+    local expiry = ARGV[#ARGV]
+    for i=1,#KEYS do
+        if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+            redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+            redis.call('EXPIRE', KEYS[i], expiry)
+        else
+            over_capacity = over_capacity + 1
+        end
+    end
+    return over_capacity
+"""
+
+
+async def group_send_many(layer, groups, message):
+    """Send ``message`` to every group in ``groups``, batched when ``layer`` can."""
+    groups = list(dict.fromkeys(groups))
+    if not groups:
+        return
+    send_many = getattr(layer, "group_send_many", None)
+    if send_many is not None:
+        return await send_many(groups, message)
+    await asyncio.gather(*(layer.group_send(group, message) for group in groups))
+
+
+class BatchedRedisChannelLayer(RedisChannelLayer):
+    async def group_send_many(self, groups, message):
+        """
+        ``group_send`` to all of ``groups`` at once. A channel that is in
+        several of them gets the message once.
+        """
+        groups = list(dict.fromkeys(groups))
+        for group in groups:
+            assert self.valid_group_name(group), "Group name not valid"
+
+        channel_names = await self.group_members(groups)
+        if not channel_names:
+            return
+        over_capacity = await self.send_to_channels(sorted(channel_names), message)
+        if over_capacity > 0:
+            logger.info(
+                f"{over_capacity} of {len(channel_names)} channels over capacity "
+                f"sending to {len(groups)} groups"
+            )
+
+    async def group_members(self, groups):
+        """The channels in any of ``groups``, in one pipeline per shard."""
+        groups_by_connection = collections.defaultdict(list)
+        for group in groups:
+            groups_by_connection[self.consistent_hash(group)].append(group)
+        channel_names = set()
+        for index, shard_groups in groups_by_connection.items():
+            pipe = self.connection(index).pipeline()
+            for group in shard_groups:
+                key = self._group_key(group)
+                pipe.zremrangebyscore(
+                    key, min=0, max=int(time.time()) - self.group_expiry
+                )
+                pipe.zrange(key, 0, -1)
+            members = await pipe.execute()
+            for names in members[1::2]:
+                channel_names.update(name.decode("utf8") for name in names)
+        return channel_names
+
+    async def send_to_channels(self, channel_names, message):
+        """
+        Send ``message`` to each of ``channel_names``, one pipeline per shard.
+        Returns how many channels were over capacity and skipped.
+        """
+        (
+            connection_to_channel_keys,
+            channel_keys_to_message,
+            channel_keys_to_capacity,
+        ) = self._map_channel_keys_to_connection(channel_names, message)
+        over_capacity = 0
+        for index, channel_keys in connection_to_channel_keys.items():
+            pipe = self.connection(index).pipeline()
+            for key in channel_keys:
+                pipe.zremrangebyscore(
+                    key, min=0, max=int(time.time()) - int(self.expiry)
+                )
+            args = [channel_keys_to_message[key] for key in channel_keys]
+            args += [channel_keys_to_capacity[key] for key in channel_keys]
+            args += [time.time(), self.expiry]
+            pipe.eval(GROUP_SEND_LUA, len(channel_keys), *channel_keys, *args)
+            *_, shard_over_capacity = await pipe.execute()
+            over_capacity += shard_over_capacity
+        return over_capacity
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class LocalDeliveryRedisChannelLayer(BatchedRedisChannelLayer):
+    """
+    Hands messages for the channels of this process over in memory instead of
+    through Redis.
+
+    Consumer channels are named ``specific.<client_prefix>!<id>``, and the ones
+    with this layer's ``client_prefix`` receive here. Group membership stays in
+    Redis, so groups still span every process: a group send reads the members
+    from Redis as before, then queues the message for the local ones and
+    writes to Redis only for the rest. ``receive_single`` returns queued local
+    messages as if it had pulled them from Redis, so the channels_redis receive
+    loop hands them out unchanged.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (expires at, channel name or names, message), oldest first
+        self.local_messages = collections.deque()
+        # How many of those are for each channel, for the capacity check.
+        self.local_counts = collections.Counter()
+        self._local_waiter = None
+        # The pull from Redis in progress. Kept across receive_single calls
+        # rather than cancelled when a local message wins, as cancelling it
+        # mid-pop could lose a message.
+        self._remote_receive = None
+
+    def is_local(self, channel):
+        return "!" in channel and self.non_local_name(channel).endswith(
+            self.client_prefix + "!"
+        )
+
+    def local_backlog(self, channel):
+        queue = self.receive_buffer.get(channel)
+        return self.local_counts[channel] + (queue.qsize() if queue is not None else 0)
+
+    def _pop_local_message(self):
+        expires_at, channels, message = self.local_messages.popleft()
+        for channel in [channels] if isinstance(channels, str) else channels:
+            self.local_counts[channel] -= 1
+            if not self.local_counts[channel]:
+                del self.local_counts[channel]
+        return expires_at, channels, message
+
+    def deliver_locally(self, channels, message):
+        """
+        Queue ``message`` for ``channels``, a local channel name or a list of
+        them as in ``__asgi_channel__``. They share one copy of it, just as
+        the channels of one process do when it comes from Redis.
+        """
+        now = time.time()
+        while self.local_messages and self.local_messages[0][0] < now:
+            # Nobody has been receiving for ``expiry`` seconds, as in Redis.
+            self._pop_local_message()
+        self.local_messages.append(
+            (now + self.expiry, channels, copy.deepcopy(message))
+        )
+        self.local_counts.update([channels] if isinstance(channels, str) else channels)
+        waiter = self._local_waiter
+        if waiter is not None and not waiter.done():
+            waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+
+    async def send(self, channel, message):
+        if not self.is_local(channel):
+            return await super().send(channel, message)
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+        if self.local_backlog(channel) >= self.get_capacity(channel):
+            raise ChannelFull()
+        self.deliver_locally(channel, message)
+
+    async def group_send(self, group, message):
+        await self.group_send_many([group], message)
+
+    async def send_to_channels(self, channel_names, message):
+        local, remote = [], []
+        for channel in channel_names:
+            (local if self.is_local(channel) else remote).append(channel)
+        over_capacity = 0
+        if local:
+            receiving = [
+                channel
+                for channel in local
+                if self.local_backlog(channel) < self.get_capacity(channel)
+            ]
+            over_capacity += len(local) - len(receiving)
+            if receiving:
+                self.deliver_locally(receiving, message)
+            CHANNEL_LAYER_DELIVERIES.inc(len(receiving), route="local")
+        if remote:
+            over_capacity += await super().send_to_channels(remote, message)
+            CHANNEL_LAYER_DELIVERIES.inc(len(remote), route="redis")
+        return over_capacity
+
+    async def receive_single(self, channel):
+        if not self.is_local(channel):
+            return await super().receive_single(channel)
+        loop = asyncio.get_running_loop()
+        if (
+            self._remote_receive is not None
+            and self._remote_receive.get_loop() is not loop
+        ):
+            # Started on an event loop that has gone away since.
+            self._remote_receive = None
+        while True:
+            now = time.time()
+            while self.local_messages:
+                expires_at, channels, message = self._pop_local_message()
+                if expires_at >= now:
+                    return channels, message
+            if self._remote_receive is None:
+                self._remote_receive = asyncio.ensure_future(
+                    super().receive_single(channel)
+                )
+            self._local_waiter = loop.create_future()
+            try:
+                await asyncio.wait(
+                    [self._remote_receive, self._local_waiter],
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                self._local_waiter.cancel()
+                self._local_waiter = None
+            if self._remote_receive.done():
+                remote_receive, self._remote_receive = self._remote_receive, None
+                return remote_receive.result()
+
+    async def close_pools(self):
+        if self._remote_receive is not None:
+            self._remote_receive.cancel()
+            self._remote_receive = None
+        await super().close_pools()
+
+
+class InstrumentedChannelLayer:
+    def __init__(self, BACKEND, CONFIG=None):
+        self.layer = import_string(BACKEND)(**(CONFIG or {}))
+
+    def __getattr__(self, name):
+        return getattr(self.layer, name)
+
+    async def _timed(self, operation, target, payload, call=None):
+        call = call or getattr(self.layer, operation)
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            with span(f"channel_layer.{operation}", target=target):
+                if operation in EVENT_OPERATIONS:
+                    payload = inject(payload)
+                return await call(target, payload)
+        except Exception as e:
+            # ChannelFull is how a slow consumer shows up; keep it apart.
+            outcome = "full" if isinstance(e, ChannelFull) else "error"
+            raise
+        finally:
+            CHANNEL_LAYER_SECONDS.observe(
+                time.perf_counter() - started, operation=operation
+            )
+            CHANNEL_LAYER_OPERATIONS.inc(operation=operation, outcome=outcome)
+
+    async def send(self, channel, message):
+        return await self._timed("send", channel, message)
+
+    async def group_send(self, group, message):
+        return await self._timed("group_send", group, message)
+
+    async def group_send_many(self, groups, message):
+        groups = list(groups)
+        return await self._timed(
+            "group_send_many",
+            f"{len(groups)} groups",
+            message,
+            call=lambda _target, payload: group_send_many(self.layer, groups, payload),
+        )
+
+    async def group_add(self, group, channel):
+        return await self._timed("group_add", group, channel)
+
+    async def group_discard(self, group, channel):
+        return await self._timed("group_discard", group, channel)
@@ -0,0 +1,291 @@
+"""
+WebSocket load generator for ChatConsumer and PresenceConsumer.
+
+Each simulated client opens a chat socket (and optionally a presence socket),
+sends messages and typing events at a jittered interval and churns its
+presence connection. Message content carries the send time, so every copy a
+client receives through the broadcast gives one end-to-end latency sample.
+Clients either talk to ``src.asgi.application`` in this process through
+``WebsocketCommunicator`` or to a running server over real sockets (needs the
+optional ``websockets`` package). Used by ``manage.py loadtest_ws``.
+"""
+
+import asyncio
+import json
+import math
+import random
+import time
+import tracemalloc
+
+LATENCY_PREFIX = "lt:"
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values`` (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class InProcessTransport:
+    """Runs the ASGI app in this event loop; no network involved."""
+
+    def __init__(self, application):
+        self.application = application
+        self.communicator = None
+
+    async def connect(self, path, timeout):
+        from channels.testing import WebsocketCommunicator
+
+        self.communicator = WebsocketCommunicator(self.application, path)
+        connected, _ = await self.communicator.connect(timeout=timeout)
+        return connected
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def receive(self):
+        # receive_from() cancels the application when it times out, so wait
+        # (practically) forever and let the caller cancel the reader instead.
+        return await self.communicator.receive_from(timeout=24 * 60 * 60)
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketTransport:
+    """Connects to a running server (daphne) over a real WebSocket."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.socket = None
+
+    async def connect(self, path, timeout):
+        import websockets
+
+        self.socket = await asyncio.wait_for(
+            websockets.connect(self.base_url + path, max_queue=None), timeout
+        )
+        return True
+
+    async def send(self, text):
+        await self.socket.send(text)
+
+    async def receive(self):
+        return await self.socket.recv()
+
+    async def close(self):
+        await self.socket.close()
+
+
+class LoadTestStats:
+    def __init__(self):
+        self.connect_times = []
+        self.connect_failures = 0
+        self.sent = 0
+        self.typing_events = 0
+        self.presence_reconnects = 0
+        self.received = 0
+        self.latencies = []
+        self.errors = 0
+        self.started = self.finished = None
+        self.memory_per_connection = None
+
+    def report(self):
+        elapsed = max((self.finished or time.monotonic()) - (self.started or 0), 1e-9)
+        return {
+            "duration_s": round(elapsed, 2),
+            "connections": len(self.connect_times),
+            "connect_failures": self.connect_failures,
+            "connect_p50_ms": round(percentile(self.connect_times, 0.50) * 1000, 2),
+            "connect_p99_ms": round(percentile(self.connect_times, 0.99) * 1000, 2),
+            "messages_sent": self.sent,
+            "messages_sent_per_s": round(self.sent / elapsed, 1),
+            "deliveries": self.received,
+            "deliveries_per_s": round(self.received / elapsed, 1),
+            "latency_p50_ms": round(percentile(self.latencies, 0.50) * 1000, 2),
+            "latency_p99_ms": round(percentile(self.latencies, 0.99) * 1000, 2),
+            "latency_max_ms": round(max(self.latencies, default=0) * 1000, 2),
+            "typing_events": self.typing_events,
+            "presence_reconnects": self.presence_reconnects,
+            "errors": self.errors,
+            "memory_per_connection_kb": (
+                round(self.memory_per_connection / 1024, 1)
+                if self.memory_per_connection is not None
+                else None
+            ),
+        }
+
+
+class SimulatedClient:
+    def __init__(self, runner, conversation_id, token):
+        self.runner = runner
+        self.conversation_id = conversation_id
+        self.token = token
+        self.chat = None
+        self.presence = None
+        self.readers = []
+
+    @property
+    def stats(self):
+        return self.runner.stats
+
+    async def open(self, path):
+        transport = self.runner.make_transport()
+        started = time.monotonic()
+        try:
+            async with self.runner.connect_slots:
+                connected = await transport.connect(
+                    f"{path}?token={self.token}", self.runner.connect_timeout
+                )
+        except Exception:
+            connected = False
+        if not connected:
+            self.stats.connect_failures += 1
+            return None
+        self.stats.connect_times.append(time.monotonic() - started)
+        self.readers.append(asyncio.ensure_future(self.read(transport)))
+        return transport
+
+    async def connect(self):
+        self.chat = await self.open(f"/ws/chat/{self.conversation_id}/")
+        if self.runner.with_presence:
+            self.presence = await self.open("/ws/presence/")
+        return self.chat is not None
+
+    async def read(self, transport):
+        try:
+            while True:
+                frame = json.loads(await transport.receive())
+                if frame.get("type") != "chat_message":
+                    continue
+                content = (frame.get("message") or {}).get("content") or ""
+                if content.startswith(LATENCY_PREFIX):
+                    sent_at = float(content[len(LATENCY_PREFIX) :].split(" ", 1)[0])
+                    self.stats.latencies.append(time.perf_counter() - sent_at)
+                    self.stats.received += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket closed (e.g. presence churn); nothing more to read.
+            return
+
+    async def send(self, payload):
+        try:
+            await self.chat.send(
+                json.dumps({"conversation_id": self.conversation_id, **payload})
+            )
+        except Exception:
+            self.stats.errors += 1
+
+    async def run(self, deadline):
+        interval = self.runner.message_interval
+        # Spread the first sends so clients do not move in lockstep.
+        await asyncio.sleep(random.uniform(0, interval))
+        while time.monotonic() < deadline:
+            if random.random() < self.runner.typing_ratio:
+                await self.send({"type": "typing_started"})
+                await self.send({"type": "typing_stopped"})
+                self.stats.typing_events += 2
+            await self.send(
+                {
+                    "type": "chat_message_new",
+                    "content": f"{LATENCY_PREFIX}{time.perf_counter()} load test",
+                }
+            )
+            self.stats.sent += 1
+
+            if (
+                self.presence is not None
+                and random.random() < self.runner.presence_churn
+            ):
+                await self.presence.close()
+                self.presence = await self.open("/ws/presence/")
+                self.stats.presence_reconnects += 1
+
+            await asyncio.sleep(random.uniform(0.5 * interval, 1.5 * interval))
+
+    async def close(self):
+        for transport in (self.chat, self.presence):
+            if transport is not None:
+                try:
+                    await transport.close()
+                except Exception:
+                    pass
+        for reader in self.readers:
+            reader.cancel()
+        await asyncio.gather(*self.readers, return_exceptions=True)
+
+
+class LoadTestRunner:
+    """
+    ``clients`` is a list of ``(conversation_id, access_token)`` pairs, one
+    per simulated client. Pass ``application`` for in-process runs or
+    ``base_url`` (``ws://host:port``) for a running server.
+    """
+
+    def __init__(
+        self,
+        clients,
+        duration,
+        application=None,
+        base_url=None,
+        message_interval=1.0,
+        typing_ratio=0.2,
+        with_presence=True,
+        presence_churn=0.05,
+        connect_concurrency=100,
+        connect_timeout=30.0,
+        drain_seconds=2.0,
+    ):
+        self.clients = clients
+        self.duration = duration
+        self.application = application
+        self.base_url = base_url
+        self.message_interval = message_interval
+        self.typing_ratio = typing_ratio
+        self.with_presence = with_presence
+        self.presence_churn = presence_churn
+        self.connect_concurrency = connect_concurrency
+        self.connect_timeout = connect_timeout
+        self.drain_seconds = drain_seconds
+        self.stats = LoadTestStats()
+
+    def make_transport(self):
+        if self.application is not None:
+            return InProcessTransport(self.application)
+        return SocketTransport(self.base_url)
+
+    async def run(self):
+        self.connect_slots = asyncio.Semaphore(self.connect_concurrency)
+        simulated = [SimulatedClient(self, *client) for client in self.clients]
+
+        # Memory per connection is only meaningful when the server side runs
+        # here too; remotely it would only measure the client objects.
+        measure_memory = self.application is not None
+        if measure_memory:
+            tracemalloc.start()
+            baseline = tracemalloc.take_snapshot()
+        await asyncio.gather(*(client.connect() for client in simulated))
+        if measure_memory:
+            connected = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            connections = len(self.stats.connect_times)
+            grown = sum(
+                stat.size_diff for stat in connected.compare_to(baseline, "filename")
+            )
+            if connections:
+                self.stats.memory_per_connection = grown / connections
+
+        active = [client for client in simulated if client.chat is not None]
+        self.stats.started = time.monotonic()
+        deadline = self.stats.started + self.duration
+        await asyncio.gather(*(client.run(deadline) for client in active))
+        # Let in-flight broadcasts arrive before counting.
+        await asyncio.sleep(self.drain_seconds)
+        self.stats.finished = time.monotonic()
+
+        await asyncio.gather(*(client.close() for client in simulated))
+        return self.stats.report()
@@ -0,0 +1,76 @@
+import functools
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from chat.benchmarks import IN_MEMORY_CHANNEL_LAYERS, run_asgi_throughput
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare message-post throughput of the DRF endpoint and its async "
+        "version under concurrent requests through the ASGI handler."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--participants",
+            type=int,
+            default=10,
+            help="Size of the conversation posted to; each post notifies the others.",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200, help="Posts per endpoint."
+        )
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument(
+            "--layer",
+            choices=["configured", "memory"],
+            default="configured",
+            help="CHANNEL_LAYERS (Redis in production) or InMemoryChannelLayer.",
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        if options["participants"] < 2:
+            raise CommandError("A conversation needs at least two participants.")
+        if options["requests"] < 1 or options["concurrency"] < 1:
+            raise CommandError("--requests and --concurrency must be at least 1.")
+
+        run = functools.partial(
+            run_asgi_throughput,
+            options["participants"],
+            options["requests"],
+            options["concurrency"],
+        )
+        if options["layer"] == "memory":
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+                results = run()
+        else:
+            results = run()
+
+        self.stdout.write(
+            f"{'route':<6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9}  statuses"
+        )
+        for result in results:
+            statuses = ", ".join(
+                f"{code}: {count}" for code, count in sorted(result["statuses"].items())
+            )
+            self.stdout.write(
+                f"{result['route']:<6} {result['requests_per_second']:>8} "
+                f"{result['latency_ms_p50']:>9} {result['latency_ms_p95']:>9}  {statuses}"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump({"results": results}, output_file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
+
+        failed = [
+            result["route"]
+            for result in results
+            if any(code >= 400 for code in result["statuses"])
+        ]
+        if failed:
+            raise CommandError(f"Some posts failed on: {', '.join(failed)}.")
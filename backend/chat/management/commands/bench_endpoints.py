@@ -0,0 +1,115 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from chat.benchmarks import ENDPOINTS, compare_to_baseline, run_benchmarks
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the REST endpoints as one user: latency, SQL query count and "
+        "response size per endpoint, checked against the query budgets and "
+        "optionally against a stored JSON baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            help="Email of the user to run as; defaults to the one in most conversations.",
+        )
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument(
+            "--only",
+            action="append",
+            choices=[endpoint.name for endpoint in ENDPOINTS],
+            help="Benchmark only this endpoint; may be repeated.",
+        )
+        parser.add_argument(
+            "--output", help="Write the results to this JSON file (a baseline)."
+        )
+        parser.add_argument(
+            "--baseline", help="Compare against a JSON file written by --output."
+        )
+        parser.add_argument(
+            "--latency-tolerance",
+            type=float,
+            default=0.5,
+            help="Allowed p50 latency growth over the baseline, as a fraction.",
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options["user"])
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        results = run_benchmarks(user, options["iterations"], options["only"])
+
+        self.stdout.write(
+            f"{'endpoint':<28} {'status':>6} {'queries':>9} {'p50 ms':>9} {'p95 ms':>9} {'bytes':>9}"
+        )
+        for result in results:
+            queries = f"{result['queries']}/{result['query_budget']}"
+            line = (
+                f"{result['name']:<28} {result['status']:>6} {queries:>9} "
+                f"{result['latency_ms_p50']:>9} {result['latency_ms_p95']:>9} {result['bytes']:>9}"
+            )
+            self.stdout.write(self.style.ERROR(line) if result["over_budget"] else line)
+
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump(
+                    {
+                        "user": user.email,
+                        "iterations": options["iterations"],
+                        "results": results,
+                    },
+                    output_file,
+                    indent=2,
+                )
+            self.stdout.write(f"Results written to {options['output']}.")
+
+        problems = [
+            f"{result['name']}: {result['queries']} queries, budget {result['query_budget']}"
+            for result in results
+            if result["over_budget"]
+        ]
+        problems += [
+            f"{result['name']}: HTTP {result['status']}"
+            for result in results
+            if result["status"] >= 400
+        ]
+        if baseline is not None:
+            problems += [
+                f"{name}: {description}"
+                for name, description in compare_to_baseline(
+                    results, baseline, options["latency_tolerance"]
+                )
+            ]
+        if problems:
+            raise CommandError(
+                "Endpoint benchmarks failed:\n  " + "\n  ".join(problems)
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"{len(results)} endpoints within budget.")
+        )
+
+    def get_user(self, email):
+        if email:
+            try:
+                return CustomUser.objects.get(email=email)
+            except CustomUser.DoesNotExist:
+                raise CommandError(f"No user with email {email}.")
+        user = (
+            CustomUser.objects.annotate(conversation_total=Count("conversations"))
+            .order_by("-conversation_total")
+            .first()
+        )
+        if user is None:
+            raise CommandError("No users to benchmark as; run seed_chat first.")
+        return user
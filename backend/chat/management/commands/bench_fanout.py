@@ -0,0 +1,74 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from chat.benchmarks import IN_MEMORY_CHANNEL_LAYERS, run_fanout_benchmarks
+
+
+def parse_sizes(value):
+    try:
+        sizes = [int(size) for size in value.split(",")]
+    except ValueError:
+        raise CommandError(f"--sizes must be comma-separated integers, not {value!r}.")
+    if any(size < 2 for size in sizes):
+        raise CommandError("A conversation needs at least two participants.")
+    return sizes
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark message creation against conversation size: request latency, "
+        "and the participant notifications sent batched versus one group_send "
+        "per participant, on the configured channel layer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="2,10,100,500",
+            help="Comma-separated participant counts to measure.",
+        )
+        parser.add_argument("--iterations", type=int, default=10)
+        parser.add_argument(
+            "--layer",
+            choices=["configured", "memory"],
+            default="configured",
+            help="CHANNEL_LAYERS (Redis in production) or InMemoryChannelLayer.",
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        sizes = parse_sizes(options["sizes"])
+        if options["layer"] == "memory":
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+                results = run_fanout_benchmarks(sizes, options["iterations"])
+        else:
+            results = run_fanout_benchmarks(sizes, options["iterations"])
+
+        self.stdout.write(
+            f"{'participants':>12} {'status':>6} {'p50 ms':>9} {'p95 ms':>9} "
+            f"{'batched ms':>11} {'sequential ms':>14}"
+        )
+        for result in results:
+            line = (
+                f"{result['size']:>12} {result['status']:>6} {result['request_ms_p50']:>9} "
+                f"{result['request_ms_p95']:>9} {result['fanout_batched_ms_p50']:>11} "
+                f"{result['fanout_sequential_ms_p50']:>14}"
+            )
+            self.stdout.write(
+                self.style.ERROR(line) if result["status"] >= 400 else line
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump(
+                    {"iterations": options["iterations"], "results": results},
+                    output_file,
+                    indent=2,
+                )
+            self.stdout.write(f"Results written to {options['output']}.")
+
+        failed = [result["size"] for result in results if result["status"] >= 400]
+        if failed:
+            raise CommandError(f"Message creation failed for sizes {failed}.")
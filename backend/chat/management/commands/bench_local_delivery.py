@@ -0,0 +1,80 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from redis.exceptions import RedisError
+
+from chat.benchmarks import GROUP_SEND_LAYERS, run_local_delivery_benchmark
+
+
+def parse_shares(value):
+    try:
+        shares = [float(share) for share in value.split(",")]
+    except ValueError:
+        raise CommandError(
+            f"--local-shares must be comma-separated numbers, not {value!r}."
+        )
+    if any(not 0 <= share <= 1 for share in shares):
+        raise CommandError("--local-shares must be between 0 and 1.")
+    return shares
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark group sends through Redis against the local-delivery layer, "
+        "for groups with members both in the sending process and in another one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--recipients", type=int, default=100, help="Group members."
+        )
+        parser.add_argument(
+            "--local-shares",
+            default="0,0.5,0.9,1",
+            help="Comma-separated shares of the members in the sending process.",
+        )
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument(
+            "--redis-url",
+            default=settings.REDIS_URL,
+            help="Redis to run against (REDIS_URL by default).",
+        )
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+
+    def handle(self, *args, **options):
+        if options["recipients"] < 1:
+            raise CommandError("--recipients must be at least 1.")
+        shares = parse_shares(options["local_shares"])
+        try:
+            results = run_local_delivery_benchmark(
+                [options["redis_url"]],
+                options["recipients"],
+                shares,
+                options["iterations"],
+            )
+        except (OSError, RedisError) as e:
+            raise CommandError(f"Could not use Redis at {options['redis_url']}: {e}")
+
+        header = f"{'recipients':>10} {'local':>6} {'remote':>6}"
+        for label, _ in GROUP_SEND_LAYERS:
+            header += f" {label + ' p50 ms':>16} {label + ' p95 ms':>16}"
+        self.stdout.write(header)
+        for result in results:
+            line = (
+                f"{result['recipients']:>10} {result['local']:>6} {result['remote']:>6}"
+            )
+            for label, _ in GROUP_SEND_LAYERS:
+                line += (
+                    f" {result[label + '_ms_p50']:>16} {result[label + '_ms_p95']:>16}"
+                )
+            self.stdout.write(line)
+
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump(
+                    {"iterations": options["iterations"], "results": results},
+                    output_file,
+                    indent=2,
+                )
+            self.stdout.write(f"Results written to {options['output']}.")
@@ -0,0 +1,79 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.models import OutboxEvent
+from chat.outbox import dispatch_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Send the broadcasts written to the outbox (CHAT_BROADCAST_OUTBOX) to "
+        "the channel layer, in batches, retrying the ones that fail."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Outbox events claimed and sent at a time.",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.2,
+            help="Seconds to wait when the outbox has nothing due.",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=settings.CHAT_OUTBOX_MAX_ATTEMPTS,
+            help="Attempts before an event is marked failed and left alone.",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Queue the events marked failed again before starting.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once nothing is due instead of waiting for more.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        max_attempts = options["max_attempts"]
+        if max_attempts < 1:
+            raise CommandError("--max-attempts must be at least 1.")
+
+        if options["retry_failed"]:
+            requeued = OutboxEvent.objects.filter(failed_at__isnull=False).update(
+                failed_at=None, attempts=0, available_at=timezone.now()
+            )
+            self.stdout.write(f"Queued {requeued} failed events again.")
+
+        sent_total = failed_total = 0
+        try:
+            while True:
+                sent, failed = dispatch_batch(batch_size, max_attempts)
+                sent_total += sent
+                failed_total += failed
+                if sent + failed == batch_size:
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Sent {sent_total} events, {failed_total} attempts failed."
+            )
+        )
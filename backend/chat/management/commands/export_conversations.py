@@ -0,0 +1,71 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import iter_conversation_records, iter_ndjson
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        "Export conversations and their messages as NDJSON (optionally gzipped), "
+        "streaming with constant memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "conversation_ids",
+            nargs="*",
+            type=int,
+            help="Conversations to export. Required unless --all is given.",
+        )
+        parser.add_argument(
+            "--all", action="store_true", help="Export every conversation."
+        )
+        parser.add_argument(
+            "-o",
+            "--output",
+            help="File to write to. Defaults to stdout.",
+        )
+        parser.add_argument(
+            "--gzip", action="store_true", help="Gzip-compress the output."
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Messages fetched per server-side cursor round trip.",
+        )
+
+    def handle(self, *args, **options):
+        conversation_ids = options["conversation_ids"]
+        if not conversation_ids and not options["all"]:
+            raise CommandError("Give conversation ids or --all.")
+
+        conversations = Conversation.objects.all()
+        if conversation_ids:
+            conversations = conversations.filter(id__in=conversation_ids)
+            missing = set(conversation_ids) - set(
+                conversations.values_list("id", flat=True)
+            )
+            if missing:
+                raise CommandError(
+                    f"Conversations not found: {', '.join(map(str, sorted(missing)))}"
+                )
+
+        chunks = iter_ndjson(
+            iter_conversation_records(conversations, chunk_size=options["chunk_size"]),
+            compress=options["gzip"],
+        )
+
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                written = sum(output.write(chunk) for chunk in chunks)
+            self.stderr.write(
+                self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}")
+            )
+        else:
+            output = sys.stdout.buffer
+            for chunk in chunks:
+                output.write(chunk)
+            output.flush()
@@ -0,0 +1,339 @@
+import gzip
+import io
+import json
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from chat.bulk import preserved_timestamps
+from chat.models import Conversation, Message
+
+CustomUser = get_user_model()
+
+COPY_COLUMNS = (
+    "id",
+    "conversation_id",
+    "sender_id",
+    "content",
+    "image",
+    "timestamp",
+    "updated_at",
+    "is_edited",
+    "is_deleted",
+    "reply_to_message_id",
+    "sequence",
+)
+
+
+def copy_text_value(value):
+    """Encode one value for PostgreSQL's COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def open_input(path):
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8")
+    with open(path, "rb") as probe:
+        is_gzip = probe.read(2) == b"\x1f\x8b"
+    if is_gzip:
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-import conversations and messages from NDJSON in the format written "
+        "by export_conversations. Users are matched by email."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", help="NDJSON file (optionally gzipped), or - for stdin."
+        )
+        parser.add_argument(
+            "--method",
+            choices=["bulk", "copy"],
+            default="bulk",
+            help="bulk_create (any database) or COPY (PostgreSQL only, fastest).",
+        )
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--create-missing-users",
+            action="store_true",
+            help="Create inactive users for unknown emails instead of skipping their messages.",
+        )
+
+    def handle(self, *args, **options):
+        if options["method"] == "copy" and connection.vendor != "postgresql":
+            raise CommandError("--method copy needs PostgreSQL.")
+
+        self.method = options["method"]
+        self.batch_size = options["batch_size"]
+        self.create_missing_users = options["create_missing_users"]
+        self.user_ids = {}
+        self.conversation_ids = {}
+        self.message_ids = {}
+        self.next_sequence = {}
+        self.last_timestamp = {}
+        self.pending_replies = []
+        self.imported = self.skipped = 0
+        self.started = time.monotonic()
+
+        batch = []
+        with open_input(options["path"]) as lines, preserved_timestamps(
+            Message, Conversation
+        ):
+            for line_number, line in enumerate(lines, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise CommandError(f"Line {line_number}: invalid JSON ({e}).")
+
+                if record.get("type") == "conversation":
+                    self.flush(batch)
+                    batch = []
+                    self.import_conversation(record)
+                elif record.get("type") == "message":
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        self.flush(batch)
+                        batch = []
+                else:
+                    raise CommandError(f"Line {line_number}: unknown record type.")
+            self.flush(batch)
+
+        self.resolve_pending_replies()
+        self.fix_up_conversations()
+
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {self.imported} messages into {len(self.conversation_ids)} "
+                f"conversations in {elapsed:.1f}s ({self.imported / max(elapsed, 1e-9):.0f} rows/s), "
+                f"skipped {self.skipped}."
+            )
+        )
+
+    def resolve_users(self, emails):
+        """Map emails to user ids with one query per batch of unknown emails."""
+        unknown = {email.lower() for email in emails if email} - self.user_ids.keys()
+        if not unknown:
+            return
+        # Emails are stored as entered, so match them case-insensitively; the
+        # oldest account wins if several differ only in case.
+        matches = (
+            CustomUser.objects.annotate(email_lower=Lower("email"))
+            .filter(email_lower__in=unknown)
+            .order_by("-id")
+            .values_list("id", "email_lower")
+        )
+        for user_id, email in matches:
+            self.user_ids[email] = user_id
+        missing = unknown - self.user_ids.keys()
+        if missing and self.create_missing_users:
+            for email in missing:
+                user = CustomUser.objects.create_user(email, None, is_active=False)
+                self.user_ids[user.email.lower()] = user.id
+
+    def import_conversation(self, record):
+        emails = [p["email"] for p in record.get("participants", []) if p.get("email")]
+        self.resolve_users(emails)
+
+        now = timezone.now()
+        with transaction.atomic():
+            conversation = Conversation.objects.create(
+                created_at=(
+                    parse_datetime(record["created_at"])
+                    if record.get("created_at")
+                    else now
+                ),
+                updated_at=(
+                    parse_datetime(record["updated_at"])
+                    if record.get("updated_at")
+                    else now
+                ),
+            )
+            participant_ids = {
+                self.user_ids[email.lower()]
+                for email in emails
+                if email.lower() in self.user_ids
+            }
+            Conversation.participants.through.objects.bulk_create(
+                [
+                    Conversation.participants.through(
+                        conversation_id=conversation.id, customuser_id=user_id
+                    )
+                    for user_id in participant_ids
+                ]
+            )
+            Conversation.objects.filter(id=conversation.id).update(
+                participant_count=len(participant_ids)
+            )
+        self.conversation_ids[record["id"]] = conversation.id
+        self.next_sequence[conversation.id] = 0
+
+    def flush(self, records):
+        if not records:
+            return
+        self.resolve_users(record.get("sender_email") for record in records)
+
+        messages = []
+        external_ids = []
+        now = timezone.now()
+        for record in records:
+            conversation_id = self.conversation_ids.get(record.get("conversation_id"))
+            sender_id = self.user_ids.get((record.get("sender_email") or "").lower())
+            if conversation_id is None or sender_id is None:
+                self.skipped += 1
+                continue
+
+            self.next_sequence[conversation_id] += 1
+            timestamp = (
+                parse_datetime(record["timestamp"]) if record.get("timestamp") else now
+            )
+            updated_at = (
+                parse_datetime(record["updated_at"])
+                if record.get("updated_at")
+                else timestamp
+            )
+            self.last_timestamp[conversation_id] = max(
+                timestamp, self.last_timestamp.get(conversation_id, timestamp)
+            )
+            messages.append(
+                Message(
+                    conversation_id=conversation_id,
+                    sender_id=sender_id,
+                    content=record.get("content"),
+                    image=record.get("image") or None,
+                    timestamp=timestamp,
+                    updated_at=updated_at,
+                    is_edited=bool(record.get("is_edited")),
+                    is_deleted=bool(record.get("is_deleted")),
+                    sequence=self.next_sequence[conversation_id],
+                )
+            )
+            external_ids.append((record.get("id"), record.get("reply_to_message_id")))
+        if not messages:
+            return
+
+        with transaction.atomic():
+            if self.method == "copy":
+                # Ids come from the table sequence up front, so replies within
+                # this batch are linked before the rows are written at all.
+                self.reserve_ids(messages)
+                self.link_replies(messages, external_ids)
+                self.copy_messages(messages)
+            else:
+                Message.objects.bulk_create(messages, batch_size=self.batch_size)
+                replies = self.link_replies(messages, external_ids)
+                if replies:
+                    Message.objects.bulk_update(
+                        replies, ["reply_to_message"], batch_size=self.batch_size
+                    )
+
+        self.imported += len(messages)
+        elapsed = time.monotonic() - self.started
+        self.stderr.write(
+            f"{self.imported} messages imported ({self.imported / max(elapsed, 1e-9):.0f} rows/s)"
+        )
+
+    def link_replies(self, messages, external_ids):
+        """
+        Point replies at the new ids of their targets. Targets that have not
+        been imported yet are remembered and resolved once the file is done.
+        """
+        for message, (external_id, _) in zip(messages, external_ids):
+            if external_id is not None:
+                self.message_ids[external_id] = message.id
+
+        replies = []
+        for message, (_, reply_to_external_id) in zip(messages, external_ids):
+            if reply_to_external_id is None:
+                continue
+            if reply_to_external_id in self.message_ids:
+                message.reply_to_message_id = self.message_ids[reply_to_external_id]
+                replies.append(message)
+            else:
+                self.pending_replies.append((message.id, reply_to_external_id))
+        return replies
+
+    def resolve_pending_replies(self):
+        replies = [
+            Message(
+                id=message_id,
+                reply_to_message_id=self.message_ids[reply_to_external_id],
+            )
+            for message_id, reply_to_external_id in self.pending_replies
+            if reply_to_external_id in self.message_ids
+        ]
+        if replies:
+            Message.objects.bulk_update(
+                replies, ["reply_to_message"], batch_size=self.batch_size
+            )
+
+    def fix_up_conversations(self):
+        """
+        bulk_create and COPY skip Message.save(), so the per-conversation
+        counters and activity timestamp are set here in one pass.
+        """
+        with transaction.atomic():
+            for conversation_id, last_sequence in self.next_sequence.items():
+                updates = {
+                    "last_sequence": last_sequence,
+                    "message_count": last_sequence,
+                }
+                if conversation_id in self.last_timestamp:
+                    updates["updated_at"] = self.last_timestamp[conversation_id]
+                Conversation.objects.filter(id=conversation_id).update(**updates)
+
+    def reserve_ids(self, messages):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [Message._meta.db_table, len(messages)],
+            )
+            for message, (reserved_id,) in zip(messages, cursor.fetchall()):
+                message.id = reserved_id
+
+    def copy_messages(self, messages):
+        """COPY a batch into the message table using the text format."""
+        rows = io.StringIO()
+        for message in messages:
+            values = (
+                message.id,
+                message.conversation_id,
+                message.sender_id,
+                message.content,
+                message.image.name or None,
+                message.timestamp.isoformat(),
+                message.updated_at.isoformat(),
+                message.is_edited,
+                message.is_deleted,
+                message.reply_to_message_id,
+                message.sequence,
+            )
+            rows.write("\t".join(copy_text_value(value) for value in values) + "\n")
+        rows.seek(0)
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert(
+                f"COPY {Message._meta.db_table} ({', '.join(COPY_COLUMNS)}) FROM STDIN",
+                rows,
+            )
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.loadtest import LoadTestRunner
+from chat.models import Conversation
+from users.models import UserProfile
+
+CustomUser = get_user_model()
+
+LOADTEST_EMAIL_DOMAIN = "loadtest.invalid"
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive simulated WebSocket clients against the chat and presence consumers "
+        "and report broadcast latency, throughput and memory per connection."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=200)
+        parser.add_argument(
+            "--conversation-size",
+            type=int,
+            default=10,
+            help="Clients per conversation; every message fans out to this many sockets.",
+        )
+        parser.add_argument(
+            "--duration", type=float, default=30.0, help="Seconds of chatting."
+        )
+        parser.add_argument(
+            "--message-interval",
+            type=float,
+            default=2.0,
+            help="Average seconds between messages per client.",
+        )
+        parser.add_argument("--typing-ratio", type=float, default=0.2)
+        parser.add_argument(
+            "--no-presence", action="store_true", help="Skip presence sockets."
+        )
+        parser.add_argument(
+            "--presence-churn",
+            type=float,
+            default=0.05,
+            help="Chance per message that a client reconnects its presence socket.",
+        )
+        parser.add_argument("--connect-concurrency", type=int, default=100)
+        parser.add_argument(
+            "--url",
+            help=(
+                "Base URL of a running server, e.g. ws://127.0.0.1:8000 (needs the "
+                "websockets package). Without it the ASGI app runs in this process."
+            ),
+        )
+        parser.add_argument(
+            "--layer",
+            choices=["memory", "configured"],
+            default="memory",
+            help="Channel layer for in-process runs: InMemoryChannelLayer or CHANNEL_LAYERS.",
+        )
+        parser.add_argument(
+            "--keep-data", action="store_true", help="Keep the load-test users."
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Print the report as JSON."
+        )
+
+    def handle(self, *args, **options):
+        if options["clients"] < 2 or options["conversation_size"] < 2:
+            raise CommandError(
+                "Need at least 2 clients and 2 clients per conversation."
+            )
+        if options["url"]:
+            try:
+                import websockets  # noqa: F401
+            except ImportError:
+                raise CommandError(
+                    "--url needs the websockets package (pip install websockets)."
+                )
+
+        run_id = uuid.uuid4().hex[:8]
+        clients = self.create_fixtures(
+            run_id, options["clients"], options["conversation_size"]
+        )
+        runner_options = dict(
+            duration=options["duration"],
+            message_interval=options["message_interval"],
+            typing_ratio=options["typing_ratio"],
+            with_presence=not options["no_presence"],
+            presence_churn=options["presence_churn"],
+            connect_concurrency=options["connect_concurrency"],
+        )
+        try:
+            if options["url"]:
+                runner = LoadTestRunner(
+                    clients, base_url=options["url"], **runner_options
+                )
+                report = asyncio.run(runner.run())
+            else:
+                from src.asgi import application
+
+                runner = LoadTestRunner(
+                    clients, application=application, **runner_options
+                )
+                if options["layer"] == "memory":
+                    with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+                        report = asyncio.run(runner.run())
+                else:
+                    report = asyncio.run(runner.run())
+        finally:
+            if not options["keep_data"]:
+                self.delete_fixtures(run_id)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for key, value in report.items():
+            self.stdout.write(f"{key:>26}: {value}")
+
+    def create_fixtures(self, run_id, client_count, conversation_size):
+        """Users and conversations for this run, plus one token per client."""
+        users = CustomUser.objects.bulk_create(
+            CustomUser(
+                email=f"{run_id}-{index}@{LOADTEST_EMAIL_DOMAIN}",
+                username=f"loadtest-{run_id}-{index}",
+                first_name="Load",
+                last_name=f"Test {index}",
+                password=make_password(None),
+            )
+            for index in range(client_count)
+        )
+        if users[0].pk is None:
+            users = list(
+                CustomUser.objects.filter(email__endswith=f"@{LOADTEST_EMAIL_DOMAIN}")
+                .filter(email__startswith=f"{run_id}-")
+                .order_by("id")
+            )
+        UserProfile.objects.bulk_create(UserProfile(user=user) for user in users)
+
+        clients = []
+        memberships = []
+        Participant = Conversation.participants.through
+        for start in range(0, client_count, conversation_size):
+            group = users[start : start + conversation_size]
+            conversation = Conversation.objects.create(participant_count=len(group))
+            memberships.extend(
+                Participant(conversation_id=conversation.id, customuser_id=user.id)
+                for user in group
+            )
+            clients.extend(
+                (str(conversation.id), str(AccessToken.for_user(user)))
+                for user in group
+            )
+        Participant.objects.bulk_create(memberships)
+        return clients
+
+    def delete_fixtures(self, run_id):
+        users = CustomUser.objects.filter(
+            email__startswith=f"{run_id}-", email__endswith=f"@{LOADTEST_EMAIL_DOMAIN}"
+        )
+        Conversation.objects.filter(
+            id__in=Conversation.participants.through.objects.filter(
+                customuser__in=users
+            ).values("conversation_id")
+        ).delete()
+        users.delete()
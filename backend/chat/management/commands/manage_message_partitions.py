@@ -0,0 +1,168 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chat.partitions import (
+    DEFAULT_PARTITION,
+    MESSAGE_TABLE,
+    add_months,
+    attached_partitions,
+    create_month_partition,
+    is_partitioned,
+    month_start,
+    partition_name,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the monthly partitions of chat_message on PostgreSQL: create "
+        "upcoming months and archive old ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead",
+            type=int,
+            default=3,
+            help="Months after the current one that should already have a partition.",
+        )
+        parser.add_argument(
+            "--archive-older-than",
+            type=int,
+            metavar="MONTHS",
+            help="Archive partitions whose whole month is at least this many months old.",
+        )
+        parser.add_argument(
+            "--tablespace",
+            help=(
+                "Cold tablespace archived partitions (and their indexes) are moved to. "
+                "They stay attached, so queries keep seeing their messages."
+            ),
+        )
+        parser.add_argument(
+            "--detach",
+            action="store_true",
+            help=(
+                "Detach archived partitions instead. Their messages disappear from "
+                "the app, exports and sync, but the tables are kept for dumping, "
+                "dropping or attaching again with the printed statement. Asks "
+                "for confirmation first."
+            ),
+        )
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_false",
+            dest="interactive",
+            help="Detach without asking for confirmation.",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if not is_partitioned(connection):
+            raise CommandError(
+                f"{MESSAGE_TABLE} is not a partitioned PostgreSQL table."
+            )
+        archive_older_than = options["archive_older_than"]
+        if archive_older_than is not None:
+            if not (options["tablespace"] or options["detach"]):
+                raise CommandError("Archiving needs --tablespace or --detach.")
+            if archive_older_than < 1:
+                raise CommandError("--archive-older-than must be at least 1.")
+
+        self.dry_run = options["dry_run"]
+        current = month_start(timezone.now())
+
+        with connection.cursor() as cursor:
+            existing = attached_partitions(cursor)
+            for offset in range(options["ahead"] + 1):
+                month = add_months(current, offset)
+                if partition_name(month) not in existing:
+                    self.create_partition(cursor, month)
+
+            if archive_older_than is not None:
+                cutoff = add_months(current, -archive_older_than)
+                archived = {
+                    name: (month, tablespace)
+                    for name, (month, tablespace) in sorted(existing.items())
+                    if month < cutoff
+                }
+                if options["detach"]:
+                    if archived and not self.dry_run and options["interactive"]:
+                        self.confirm_detach(archived)
+                    for name, (month, _) in archived.items():
+                        self.detach_partition(cursor, name, month)
+                else:
+                    for name, (_, tablespace) in archived.items():
+                        if tablespace != options["tablespace"]:
+                            self.move_partition(cursor, name, options["tablespace"])
+
+    def run(self, cursor, sql):
+        self.stdout.write(sql)
+        if not self.dry_run:
+            cursor.execute(sql)
+
+    def create_partition(self, cursor, month):
+        """
+        Create the partition for ``month``. Rows that already landed in the
+        default partition for that month are moved into it, otherwise
+        Postgres refuses to create the new partition.
+        """
+        lower = f"'{month:%Y-%m-%d} 00:00:00+00'"
+        upper = f"'{add_months(month, 1):%Y-%m-%d} 00:00:00+00'"
+        cursor.execute(
+            f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" '
+            f'WHERE "timestamp" >= {lower} AND "timestamp" < {upper})'
+        )
+        stray_rows = cursor.fetchone()[0]
+
+        self.stdout.write(f"Creating {partition_name(month)}")
+        if self.dry_run:
+            return
+        if not stray_rows:
+            create_month_partition(cursor, month)
+            return
+
+        where = f'WHERE "timestamp" >= {lower} AND "timestamp" < {upper}'
+        with transaction.atomic():
+            cursor.execute(
+                f'ALTER TABLE "{MESSAGE_TABLE}" DETACH PARTITION "{DEFAULT_PARTITION}"'
+            )
+            create_month_partition(cursor, month)
+            cursor.execute(
+                f'INSERT INTO "{MESSAGE_TABLE}" SELECT * FROM "{DEFAULT_PARTITION}" {where}'
+            )
+            cursor.execute(f'DELETE FROM "{DEFAULT_PARTITION}" {where}')
+            cursor.execute(
+                f'ALTER TABLE "{MESSAGE_TABLE}" ATTACH PARTITION "{DEFAULT_PARTITION}" DEFAULT'
+            )
+
+    def move_partition(self, cursor, name, tablespace):
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", [name])
+        index_names = [row[0] for row in cursor.fetchall()]
+        self.run(cursor, f'ALTER TABLE "{name}" SET TABLESPACE "{tablespace}"')
+        for index_name in index_names:
+            self.run(
+                cursor, f'ALTER INDEX "{index_name}" SET TABLESPACE "{tablespace}"'
+            )
+
+    def confirm_detach(self, archived):
+        self.stdout.write(
+            self.style.WARNING(
+                f"Detaching {', '.join(archived)} removes their messages from the app, "
+                "conversation exports and sync until they are attached again."
+            )
+        )
+        if input("Type 'yes' to continue, or 'no' to cancel: ") != "yes":
+            raise CommandError("Detaching cancelled.")
+
+    def detach_partition(self, cursor, name, month):
+        # Not CONCURRENTLY: PostgreSQL refuses that while the table has a
+        # default partition, which chat_message always has.
+        self.run(cursor, f'ALTER TABLE "{MESSAGE_TABLE}" DETACH PARTITION "{name}"')
+        self.stdout.write(
+            f'To restore it: ALTER TABLE "{MESSAGE_TABLE}" ATTACH PARTITION "{name}" '
+            f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') "
+            f"TO ('{add_months(month, 1):%Y-%m-%d} 00:00:00+00');"
+        )
@@ -0,0 +1,95 @@
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.models import UploadSession
+from chat.uploads import discard_part
+
+
+def is_uuid(value):
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete chunked uploads that were never finalized and have expired, "
+        "along with their part files and any part file left without a session."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="Sessions deleted per query.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report what would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        dry_run = options["dry_run"]
+
+        expired = UploadSession.objects.filter(
+            message__isnull=True, expires_at__lte=timezone.now()
+        ).order_by("pk")
+        sessions = 0
+        last_id = None
+        while True:
+            batch = expired if last_id is None else expired.filter(pk__gt=last_id)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            sessions += len(batch)
+            if dry_run:
+                continue
+            for session in batch:
+                discard_part(session)
+            UploadSession.objects.filter(
+                pk__in=[session.pk for session in batch]
+            ).delete()
+
+        # Part files whose session is gone, e.g. deleted with its conversation.
+        # Only old ones, so a session being created right now is left alone.
+        orphans = 0
+        upload_dir = Path(settings.CHUNKED_UPLOAD_TEMP_DIR)
+        if upload_dir.is_dir():
+            cutoff = time.time() - settings.CHUNKED_UPLOAD_EXPIRY
+            parts = {
+                path.stem: path
+                for path in upload_dir.glob("*.part")
+                if path.stat().st_mtime < cutoff
+            }
+            known = {
+                str(pk)
+                for pk in UploadSession.objects.filter(
+                    pk__in=[stem for stem in parts if is_uuid(stem)]
+                ).values_list("pk", flat=True)
+            }
+            for stem, path in parts.items():
+                if stem in known:
+                    continue
+                orphans += 1
+                if not dry_run:
+                    path.unlink(missing_ok=True)
+
+        verb = "would be deleted" if dry_run else "deleted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{sessions} expired upload sessions and {orphans} orphaned part files {verb}."
+            )
+        )
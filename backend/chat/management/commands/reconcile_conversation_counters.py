@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from chat.models import Conversation, Message
+
+COUNTED_FIELDS = ("message_count", "participant_count")
+
+
+def actual_count(queryset):
+    return Coalesce(
+        Subquery(
+            queryset.filter(conversation=OuterRef("pk"))
+            .order_by()
+            .values("conversation")
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare Conversation.message_count and participant_count with the "
+        "message and membership rows and fix the conversations that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Conversations checked (and fixed) per transaction.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the drifted conversations.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        dry_run = options["dry_run"]
+
+        conversations = Conversation.objects.annotate(
+            actual_message_count=actual_count(Message.objects.all()),
+            actual_participant_count=actual_count(
+                Conversation.participants.through.objects.all()
+            ),
+        ).order_by("pk")
+        drifted = ~Q(message_count=F("actual_message_count")) | ~Q(
+            participant_count=F("actual_participant_count")
+        )
+
+        checked = fixed = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    Conversation.objects.filter(pk__gt=last_id)
+                    .order_by("pk")
+                    .values_list("pk", flat=True)[:batch_size]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1]
+                checked += len(batch)
+                stale = list(
+                    conversations.filter(pk__in=batch)
+                    .filter(drifted)
+                    .values(
+                        "pk",
+                        *COUNTED_FIELDS,
+                        "actual_message_count",
+                        "actual_participant_count",
+                    )
+                )
+                for row in stale:
+                    self.stdout.write(
+                        f"Conversation {row['pk']}: "
+                        f"message_count {row['message_count']} -> {row['actual_message_count']}, "
+                        f"participant_count {row['participant_count']} -> {row['actual_participant_count']}"
+                    )
+                if stale and not dry_run:
+                    Conversation.refresh_counters([row["pk"] for row in stale])
+                fixed += len(stale)
+
+        verb = "would be fixed" if dry_run else "fixed"
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} conversations, {fixed} {verb}.")
+        )
@@ -0,0 +1,343 @@
+import io
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from chat.bulk import preserved_timestamps, reset_id_sequences
+from chat.models import Conversation, Message
+from users.models import UserProfile
+
+CustomUser = get_user_model()
+
+FIRST_NAMES = [
+    "Aziz",
+    "Dilnoza",
+    "Jasur",
+    "Malika",
+    "Sardor",
+    "Nigora",
+    "Bekzod",
+    "Kamola",
+    "Alex",
+    "Maria",
+    "John",
+    "Sofia",
+    "David",
+    "Emma",
+    "Omar",
+    "Lena",
+]
+LAST_NAMES = [
+    "Karimov",
+    "Yusupova",
+    "Rashidov",
+    "Aliyeva",
+    "Smith",
+    "Garcia",
+    "Müller",
+    "Rossi",
+    "Kim",
+    "Ivanova",
+    "Tanaka",
+    "Nowak",
+]
+WORDS = (
+    "hey hi ok yes no maybe sure thanks please today tomorrow tonight meeting call "
+    "lunch coffee project deadline review code bug fix deploy release test done "
+    "working on it sounds good see you later what about the new plan send me "
+    "file photo link check this out great nice lol haha sorry late running"
+).split()
+SEED_IMAGE_COLORS = ["#e76f51", "#2a9d8f", "#264653", "#e9c46a", "#f4a261", "#8ab17d"]
+
+
+def pareto_int(alpha, minimum, maximum):
+    """An integer in [minimum, maximum] with a power-law (Pareto) tail."""
+    return min(maximum, minimum - 1 + int(random.paretovariate(alpha)))
+
+
+def split_proportionally(total, weights):
+    """Split ``total`` into integer parts proportional to ``weights``."""
+    weight_sum = sum(weights) or 1
+    parts = [int(total * weight / weight_sum) for weight in weights]
+    for index in random.sample(range(len(parts)), min(len(parts), total - sum(parts))):
+        parts[index] += 1
+    return parts
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic chat dataset: users with profiles, 1:1 and group "
+        "conversations with power-law sizes and activity, and messages with "
+        "replies, edits, deletes and images. Everything is bulk-inserted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--conversations", type=int, default=2000)
+        parser.add_argument("--messages", type=int, default=100_000)
+        parser.add_argument(
+            "--group-ratio",
+            type=float,
+            default=0.25,
+            help="Share of group conversations.",
+        )
+        parser.add_argument("--max-group-size", type=int, default=200)
+        parser.add_argument(
+            "--size-alpha",
+            type=float,
+            default=1.6,
+            help="Pareto shape of group sizes; smaller means more huge groups.",
+        )
+        parser.add_argument(
+            "--activity-alpha",
+            type=float,
+            default=1.2,
+            help="Pareto shape of messages per conversation.",
+        )
+        parser.add_argument("--reply-ratio", type=float, default=0.1)
+        parser.add_argument("--edit-ratio", type=float, default=0.05)
+        parser.add_argument("--delete-ratio", type=float, default=0.02)
+        parser.add_argument("--image-ratio", type=float, default=0.03)
+        parser.add_argument("--days", type=int, default=365, help="History length.")
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument(
+            "--password", default="password", help="Password of every seeded user."
+        )
+        parser.add_argument("--email-domain", default="seed.local")
+        parser.add_argument(
+            "--seed", type=int, help="Random seed for a reproducible dataset."
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 2:
+            raise CommandError("Need at least 2 users.")
+        if options["seed"] is not None:
+            random.seed(options["seed"])
+
+        self.options = options
+        self.started = time.monotonic()
+        self.now = timezone.now()
+
+        user_ids = self.create_users()
+        conversations = self.create_conversations(user_ids)
+        image_names = self.create_images()
+        self.create_messages(conversations, image_names)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {len(user_ids)} users, {len(conversations)} conversations and "
+                f"{options['messages']} messages in {time.monotonic() - self.started:.1f}s."
+            )
+        )
+
+    def log(self, text):
+        self.stderr.write(f"[{time.monotonic() - self.started:7.1f}s] {text}")
+
+    def create_users(self):
+        count, domain = self.options["users"], self.options["email_domain"]
+        offset = CustomUser.objects.filter(email__endswith=f"@{domain}").count()
+        # Hashing is slow on purpose, so every seeded user shares one hash.
+        password = make_password(self.options["password"])
+        joined_earliest = self.now - timedelta(days=self.options["days"])
+
+        users = []
+        for index in range(offset, offset + count):
+            first_name, last_name = random.choice(FIRST_NAMES), random.choice(
+                LAST_NAMES
+            )
+            users.append(
+                CustomUser(
+                    email=f"user{index}@{domain}",
+                    username=f"seed_{domain.split('.')[0]}_{index}",
+                    first_name=first_name,
+                    last_name=last_name,
+                    password=password,
+                    date_joined=joined_earliest
+                    + (self.now - joined_earliest) * random.random(),
+                )
+            )
+        CustomUser.objects.bulk_create(users, batch_size=self.options["batch_size"])
+        user_ids = list(
+            CustomUser.objects.filter(
+                email__in=[user.email for user in users]
+            ).values_list("id", flat=True)
+        )
+        UserProfile.objects.bulk_create(
+            (
+                UserProfile(
+                    user_id=user_id,
+                    bio=random.choice([None, " ".join(random.sample(WORDS, 5))]),
+                )
+                for user_id in user_ids
+            ),
+            batch_size=self.options["batch_size"],
+        )
+        self.log(f"{len(user_ids)} users")
+        return user_ids
+
+    def create_conversations(self, user_ids):
+        """Returns ``[(conversation_id, participant_ids, started_at)]``."""
+        options = self.options
+        history = timedelta(days=options["days"])
+        max_group_size = min(options["max_group_size"], len(user_ids))
+
+        pairs = set()
+        drafts = []
+        for _ in range(options["conversations"]):
+            if random.random() < options["group_ratio"] and max_group_size >= 3:
+                participants = random.sample(
+                    user_ids, pareto_int(options["size_alpha"], 3, max_group_size)
+                )
+            else:
+                # The app keeps one 1:1 conversation per pair of users.
+                for _attempt in range(10):
+                    pair = tuple(sorted(random.sample(user_ids, 2)))
+                    if pair not in pairs:
+                        break
+                else:
+                    continue
+                pairs.add(pair)
+                participants = list(pair)
+            drafts.append((participants, self.now - history * random.random()))
+
+        with preserved_timestamps(Conversation):
+            created = Conversation.objects.bulk_create(
+                [
+                    Conversation(
+                        created_at=started,
+                        updated_at=started,
+                        participant_count=len(participants),
+                    )
+                    for participants, started in drafts
+                ],
+                batch_size=options["batch_size"],
+            )
+
+        Participant = Conversation.participants.through
+        Participant.objects.bulk_create(
+            (
+                Participant(conversation_id=conversation.id, customuser_id=user_id)
+                for conversation, (participants, _) in zip(created, drafts)
+                for user_id in participants
+            ),
+            batch_size=options["batch_size"],
+        )
+        self.log(f"{len(created)} conversations")
+        return [
+            (conversation.id, participants, started)
+            for conversation, (participants, started) in zip(created, drafts)
+        ]
+
+    def create_images(self):
+        names = []
+        for index, color in enumerate(SEED_IMAGE_COLORS):
+            name = f"message_images/seed/seed_{index}.png"
+            if not default_storage.exists(name):
+                buffer = io.BytesIO()
+                Image.new("RGB", (320, 240), color).save(buffer, format="PNG")
+                name = default_storage.save(name, ContentFile(buffer.getvalue()))
+            names.append(name)
+        return names
+
+    def create_messages(self, conversations, image_names):
+        options = self.options
+        activity = [
+            random.paretovariate(options["activity_alpha"]) for _ in conversations
+        ]
+        message_counts = split_proportionally(options["messages"], activity)
+
+        # Ids are assigned here so replies can point at messages that are not
+        # inserted yet; the id sequence is moved past them at the end.
+        next_id = (Message.objects.aggregate(Max("id"))["id__max"] or 0) + 1
+        batch, inserted = [], 0
+        conversation_updates = []
+
+        def flush():
+            nonlocal batch, inserted
+            with preserved_timestamps(Message):
+                Message.objects.bulk_create(batch)
+            inserted += len(batch)
+            rate = inserted / max(time.monotonic() - self.started, 1e-9)
+            self.log(f"{inserted} messages ({rate:.0f} rows/s overall)")
+            batch = []
+
+        for (conversation_id, participants, started), count in zip(
+            conversations, message_counts
+        ):
+            if not count:
+                continue
+            # A few members do most of the talking.
+            sender_weights = list(
+                accumulate(1 / (rank + 1) for rank in range(len(participants)))
+            )
+            senders = random.sample(participants, len(participants))
+            mean_gap = (self.now - started).total_seconds() / (count + 1)
+            timestamp = started
+            recent_ids = []
+
+            for sequence in range(1, count + 1):
+                timestamp += timedelta(
+                    seconds=random.expovariate(1 / mean_gap) if mean_gap else 0
+                )
+                timestamp = min(timestamp, self.now)
+                message = Message(
+                    id=next_id,
+                    conversation_id=conversation_id,
+                    sender_id=random.choices(senders, cum_weights=sender_weights)[0],
+                    content=" ".join(random.choices(WORDS, k=random.randint(1, 14))),
+                    timestamp=timestamp,
+                    updated_at=timestamp,
+                    sequence=sequence,
+                )
+                if recent_ids and random.random() < options["reply_ratio"]:
+                    message.reply_to_message_id = random.choice(recent_ids)
+                if random.random() < options["image_ratio"]:
+                    message.image = random.choice(image_names)
+                    if random.random() < 0.5:
+                        message.content = None
+                roll = random.random()
+                if roll < options["delete_ratio"]:
+                    message.is_deleted = True
+                    message.content = None
+                    message.image = None
+                elif roll < options["delete_ratio"] + options["edit_ratio"]:
+                    message.is_edited = True
+                    message.updated_at = timestamp + timedelta(
+                        minutes=random.uniform(1, 60)
+                    )
+
+                batch.append(message)
+                recent_ids.append(next_id)
+                if len(recent_ids) > 50:
+                    recent_ids.pop(0)
+                next_id += 1
+                if len(batch) >= options["batch_size"]:
+                    flush()
+
+            conversation_updates.append(
+                Conversation(
+                    id=conversation_id,
+                    last_sequence=count,
+                    message_count=count,
+                    updated_at=timestamp,
+                )
+            )
+
+        if batch:
+            flush()
+        reset_id_sequences(Message)
+        Conversation.objects.bulk_update(
+            conversation_updates,
+            ["last_sequence", "message_count", "updated_at"],
+            batch_size=1000,
+        )
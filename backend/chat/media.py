@@ -0,0 +1,152 @@
+"""
+Access-checked media delivery for production.
+
+Django only decides *whether* a file may be served and which validators and
+cache headers apply; the bytes are always sent by the front proxy. With the
+default ``nginx`` backend, nginx needs an internal location matching
+``MEDIA_ACCEL_REDIRECT_PREFIX``::
+
+    location /protected-media/ {
+        internal;
+        alias /path/to/backend/media/;
+    }
+
+nginx (and Apache's mod_xsendfile for the ``apache`` backend) answer
+``Range`` requests on the redirected file themselves.
+"""
+
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from rest_framework import permissions, views
+
+from users.authentication import QueryParamJWTAuthentication
+from .models import Message
+
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# Files under these prefixes are visible to every signed in user (avatars).
+PUBLIC_MEDIA_PREFIXES = ("profile_pics/", "default/")
+MESSAGE_MEDIA_PREFIX = "message_images/"
+
+_BYTE_RANGE_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def can_access_media(user, path):
+    if user.is_staff:
+        return True
+    if path.startswith(PUBLIC_MEDIA_PREFIXES):
+        return True
+    if path.startswith(MESSAGE_MEDIA_PREFIX):
+        return Message.objects.filter(
+            image=path, is_deleted=False, conversation__participants=user
+        ).exists()
+    return False
+
+
+def make_etag(stat_result):
+    """The ETag nginx sends for the file, so both agree on revalidation."""
+    return f'"{int(stat_result.st_mtime):x}-{stat_result.st_size:x}"'
+
+
+def is_range_satisfiable(range_header, size):
+    """
+    ``False`` only when a syntactically valid ``Range`` header asks for bytes
+    that do not exist. Malformed headers are ignored, as RFC 9110 allows.
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return True
+    for byte_range in ranges.split(","):
+        match = _BYTE_RANGE_RE.match(byte_range)
+        if not match:
+            return True
+        first, last = match.groups()
+        if first and int(first) < size:
+            return True
+        if not first and last and int(last) > 0 and size > 0:
+            return True
+    return False
+
+
+def offload_response(path, full_path, content_type):
+    backend = settings.MEDIA_SENDFILE_BACKEND
+    if backend == "django":
+        if not (settings.DEBUG or settings.TESTING):
+            raise ImproperlyConfigured(
+                'MEDIA_SENDFILE_BACKEND = "django" is only allowed in DEBUG and the tests.'
+            )
+        return FileResponse(open(full_path, "rb"), content_type=content_type)
+
+    response = HttpResponse(content_type=content_type)
+    if backend == "apache":
+        response["X-Sendfile"] = full_path
+    else:
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(
+            path
+        )
+    return response
+
+
+# URL: /media/<path> (GET - Serves a media file the current user may see)
+class ProtectedMediaView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_authenticators(self):
+        # <img> tags cannot send an Authorization header, so also accept ?token=.
+        return super().get_authenticators() + [QueryParamJWTAuthentication()]
+
+    def get(self, request, path, *args, **kwargs):
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, path)
+        except SuspiciousFileOperation:
+            raise Http404("Media file not found.")
+
+        if not can_access_media(request.user, path):
+            raise Http404("Media file not found.")
+
+        try:
+            stat_result = os.stat(full_path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise Http404("Media file not found.")
+
+        etag = make_etag(stat_result)
+        conditional = get_conditional_response(
+            request, etag=etag, last_modified=int(stat_result.st_mtime)
+        )
+        if conditional is not None:
+            self._set_validators(conditional, etag, stat_result)
+            return conditional
+
+        range_header = request.headers.get("Range")
+        if_range = request.headers.get("If-Range")
+        range_applies = range_header and (not if_range or etag in parse_etags(if_range))
+        if range_applies and not is_range_satisfiable(
+            range_header, stat_result.st_size
+        ):
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat_result.st_size}"
+            return response
+
+        content_type, encoding = mimetypes.guess_type(full_path)
+        response = offload_response(
+            path, full_path, content_type or "application/octet-stream"
+        )
+        if encoding:
+            response["Content-Encoding"] = encoding
+        self._set_validators(response, etag, stat_result)
+        return response
+
+    def _set_validators(self, response, etag, stat_result):
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(stat_result.st_mtime)
+        response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        response["Accept-Ranges"] = "bytes"
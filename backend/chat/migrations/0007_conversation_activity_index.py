@@ -0,0 +1,19 @@
+# Generated by Django 4.2.10 on 2026-10-19 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0006_uploadsession"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="conversation",
+            index=models.Index(
+                fields=["updated_at", "id"], name="chat_conver_updated_47af34_idx"
+            ),
+        ),
+    ]
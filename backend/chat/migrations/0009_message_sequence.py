@@ -0,0 +1,77 @@
+from django.db import migrations, models
+
+
+def backfill_sequences(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE chat_message AS m
+                SET sequence = numbered.rn
+                FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY conversation_id ORDER BY timestamp, id
+                    ) AS rn
+                    FROM chat_message
+                ) AS numbered
+                WHERE m.id = numbered.id
+                """
+            )
+            cursor.execute(
+                """
+                UPDATE chat_conversation AS c
+                SET last_sequence = COALESCE(
+                    (SELECT MAX(sequence) FROM chat_message WHERE conversation_id = c.id), 0
+                )
+                """
+            )
+        return
+
+    Conversation = apps.get_model("chat", "Conversation")
+    Message = apps.get_model("chat", "Message")
+    for conversation in Conversation.objects.all().iterator():
+        messages = list(
+            Message.objects.filter(conversation=conversation).order_by(
+                "timestamp", "id"
+            )
+        )
+        for sequence, message in enumerate(messages, start=1):
+            message.sequence = sequence
+        Message.objects.bulk_update(messages, ["sequence"], batch_size=1000)
+        Conversation.objects.filter(pk=conversation.pk).update(
+            last_sequence=len(messages)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_messagechange"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="last_sequence",
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="sequence",
+            field=models.PositiveBigIntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_sequences, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="message",
+            name="sequence",
+            field=models.PositiveBigIntegerField(editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name="message",
+            constraint=models.UniqueConstraint(
+                fields=("conversation", "sequence"),
+                name="chat_message_conversation_sequence_uniq",
+            ),
+        ),
+    ]
@@ -0,0 +1,169 @@
+"""
+Turn chat_message into a table range-partitioned by month on PostgreSQL.
+
+A unique constraint on a partitioned table has to include the partition key,
+so the primary key becomes (id, timestamp) and the per-conversation sequence
+constraint becomes (conversation_id, sequence, timestamp). ids still come from
+a single sequence and sequences from Conversation.allocate_sequences, so both
+stay unique in practice. Nothing can hold a foreign key to a table without a
+unique id, so foreign keys pointing at messages are kept in Django only
+(db_constraint=False); on_delete is enforced by the ORM either way.
+
+The table is rebuilt inside the migration's transaction, which rewrites every
+message. On other databases only the foreign key change applies.
+"""
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+from chat.partitions import (
+    DEFAULT_PARTITION,
+    MESSAGE_TABLE,
+    add_months,
+    create_month_partition,
+    is_partitioned,
+    month_start,
+)
+
+PARTITIONS_AHEAD = 3
+
+
+def rebuild_message_table(cursor, partitioned):
+    old_table = f"{MESSAGE_TABLE}_old"
+
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = to_regclass(%s) AND contype = 'f'
+        """,
+        [MESSAGE_TABLE],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT indexdef FROM pg_indexes
+        WHERE tablename = %s AND indexname NOT IN (
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u')
+        )
+        """,
+        [MESSAGE_TABLE, MESSAGE_TABLE],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT attidentity FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = 'id'",
+        [MESSAGE_TABLE],
+    )
+    is_identity = cursor.fetchone()[0] != ""
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [MESSAGE_TABLE])
+    serial_sequence = cursor.fetchone()[0]
+    cursor.execute(f'SELECT MIN("timestamp") FROM "{MESSAGE_TABLE}"')
+    first_timestamp = cursor.fetchone()[0]
+
+    cursor.execute(f'ALTER TABLE "{MESSAGE_TABLE}" RENAME TO "{old_table}"')
+    like = "INCLUDING DEFAULTS INCLUDING STORAGE"
+    if is_identity:
+        like += " INCLUDING IDENTITY"
+    cursor.execute(
+        f'CREATE TABLE "{MESSAGE_TABLE}" (LIKE "{old_table}" {like})'
+        + (' PARTITION BY RANGE ("timestamp")' if partitioned else "")
+    )
+
+    if partitioned:
+        cursor.execute(
+            f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{MESSAGE_TABLE}" DEFAULT'
+        )
+        now = timezone.now()
+        month = month_start(first_timestamp or now)
+        last_month = add_months(month_start(now), PARTITIONS_AHEAD)
+        while month <= last_month:
+            create_month_partition(cursor, month)
+            month = add_months(month, 1)
+
+    cursor.execute(f'INSERT INTO "{MESSAGE_TABLE}" SELECT * FROM "{old_table}"')
+    if is_identity:
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(MAX(id), 0) + 1, false) "
+            f'FROM "{MESSAGE_TABLE}"',
+            [MESSAGE_TABLE],
+        )
+    elif serial_sequence:
+        cursor.execute(
+            f'ALTER SEQUENCE {serial_sequence} OWNED BY "{MESSAGE_TABLE}".id'
+        )
+    cursor.execute(f'DROP TABLE "{old_table}"')
+
+    key = ', "timestamp"' if partitioned else ""
+    cursor.execute(f'ALTER TABLE "{MESSAGE_TABLE}" ADD PRIMARY KEY (id{key})')
+    cursor.execute(
+        f'ALTER TABLE "{MESSAGE_TABLE}" ADD CONSTRAINT chat_message_conversation_sequence_uniq '
+        f"UNIQUE (conversation_id, sequence{key})"
+    )
+    for indexdef in indexes:
+        cursor.execute(indexdef)
+    for name, definition in foreign_keys:
+        cursor.execute(
+            f'ALTER TABLE "{MESSAGE_TABLE}" ADD CONSTRAINT "{name}" {definition}'
+        )
+
+
+def partition_messages(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql" or is_partitioned(connection):
+        return
+    with connection.cursor() as cursor:
+        rebuild_message_table(cursor, partitioned=True)
+
+
+def unpartition_messages(apps, schema_editor):
+    connection = schema_editor.connection
+    if not is_partitioned(connection):
+        return
+    with connection.cursor() as cursor:
+        rebuild_message_table(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0009_message_sequence"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="reply_to_message",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="replies",
+                to="chat.message",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="uploadsession",
+            name="message",
+            field=models.OneToOneField(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="upload_session",
+                to="chat.message",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="messagechange",
+            name="message",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="changes",
+                to="chat.message",
+            ),
+        ),
+        migrations.RunPython(partition_messages, unpartition_messages),
+    ]
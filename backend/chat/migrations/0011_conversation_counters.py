@@ -0,0 +1,48 @@
+# Generated by Django 4.2.10 on 2026-10-19 10:32
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Conversation = apps.get_model("chat", "Conversation")
+    Message = apps.get_model("chat", "Message")
+    Participant = Conversation.participants.through
+
+    def count(model):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(conversation=OuterRef("pk"))
+                .order_by()
+                .values("conversation")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+
+    Conversation.objects.update(
+        message_count=count(Message), participant_count=count(Participant)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0010_partition_messages"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="conversation",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="participant_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.10 on 2026-10-19 10:54
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0011_conversation_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("conversation", "Conversation group"),
+                            ("users", "User groups"),
+                        ],
+                        max_length=12,
+                    ),
+                ),
+                ("conversation_id", models.BigIntegerField(blank=True, null=True)),
+                ("user_ids", models.JSONField(blank=True, default=list)),
+                ("event", models.JSONField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "available_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True)),
+                ("failed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(
+                        fields=["failed_at", "available_at", "id"],
+                        name="chat_outbox_failed__5cac03_idx",
+                    )
+                ],
+            },
+        ),
+    ]
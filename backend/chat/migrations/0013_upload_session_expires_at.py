@@ -0,0 +1,21 @@
+# Generated by Django 4.2.10 on 2026-10-19 11:15
+
+import chat.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0012_outbox_event"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadsession",
+            name="expires_at",
+            field=models.DateTimeField(
+                db_index=True, default=chat.models.upload_expiry
+            ),
+        ),
+    ]
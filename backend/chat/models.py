@@ -1,6 +1,16 @@
 # chat/models.py
-from django.db import models
+import contextvars
+import uuid
+from collections import Counter
+from datetime import timedelta
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.utils.html import escape
 
 
@@ -10,6 +20,97 @@ class Conversation(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Highest Message.sequence handed out in this conversation.
+    last_sequence = models.PositiveBigIntegerField(default=0, editable=False)
+    # Denormalized row counts (soft-deleted messages included), kept up to date
+    # by Message.save() and the signal handlers at the end of this module.
+    # bulk_create and raw SQL skip both; refresh_counters() and
+    # `manage.py reconcile_conversation_counters` put them right.
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+    participant_count = models.PositiveIntegerField(default=0, editable=False)
+
+    COUNTER_FIELDS = ("last_sequence", "message_count", "participant_count")
+
+    @classmethod
+    def allocate_sequences(cls, conversation_id, count=1):
+        """
+        Reserve ``count`` consecutive message sequence numbers and return the
+        first one. Must run inside a transaction: the row lock taken by the
+        UPDATE serializes concurrent senders until their messages are
+        committed, which keeps the numbers dense. The same UPDATE counts the
+        messages in ``message_count``.
+        """
+        cls.objects.filter(pk=conversation_id).update(
+            last_sequence=F("last_sequence") + count,
+            message_count=F("message_count") + count,
+        )
+        last_sequence = (
+            cls.objects.filter(pk=conversation_id)
+            .values_list("last_sequence", flat=True)
+            .get()
+        )
+        return last_sequence - count + 1
+
+    @classmethod
+    def refresh_counters(
+        cls, conversation_ids=None, fields=("message_count", "participant_count")
+    ):
+        """
+        Recount ``fields`` from the message and membership rows, for the given
+        conversations (all of them by default). Returns the number updated.
+        """
+        Participant = cls.participants.through
+        counts = {
+            "message_count": Message.objects.filter(conversation=OuterRef("pk")),
+            "participant_count": Participant.objects.filter(
+                conversation=OuterRef("pk")
+            ),
+        }
+        conversations = cls.objects.all()
+        if conversation_ids is not None:
+            conversations = conversations.filter(pk__in=conversation_ids)
+        return conversations.update(
+            **{
+                field: Coalesce(
+                    Subquery(
+                        counts[field]
+                        .order_by()
+                        .values("conversation")
+                        .annotate(total=Count("pk"))
+                        .values("total")
+                    ),
+                    0,
+                )
+                for field in fields
+            }
+        )
+
+    @classmethod
+    def subtract_messages(cls, counts):
+        """Take ``{conversation_id: deleted messages}`` off message_count in one UPDATE."""
+        if not counts:
+            return
+        cls.objects.filter(pk__in=counts).update(
+            message_count=F("message_count")
+            - Case(
+                *[When(pk=pk, then=Value(count)) for pk, count in counts.items()],
+                output_field=models.PositiveIntegerField(),
+            )
+        )
+
+    def save(self, *args, **kwargs):
+        # Counters are only changed with atomic UPDATEs; never write back a
+        # possibly stale in-memory copy when the conversation is touched.
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            deferred_fields = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS
+                and field.attname not in deferred_fields
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         participant_names = []
@@ -18,13 +119,38 @@ class Conversation(models.Model):
             participant_names.append(str(name))
 
         names_str = ", ".join(participant_names)
-        if self.participants.count() > 3:
+        if self.participant_count > 3:
             names_str += "..."
 
         return f"Conversation ({self.id}) with: {names_str if names_str else 'No Participants'}"
 
     class Meta:
         ordering = ["-updated_at"]
+        indexes = [models.Index(fields=["updated_at", "id"])]
+
+
+# Messages deleted per conversation by the MessageQuerySet.delete() in progress.
+_deleted_messages = contextvars.ContextVar("deleted_messages", default=None)
+
+
+class MessageQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Like ``QuerySet.delete()``, but message_count is decremented with one
+        UPDATE for all the conversations involved instead of one per message.
+        """
+        deleted = Counter()
+        token = _deleted_messages.set(deleted)
+        try:
+            with transaction.atomic(using=self.db, savepoint=False):
+                result = super().delete()
+                Conversation.subtract_messages(deleted)
+        finally:
+            _deleted_messages.reset(token)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
 
 
 class Message(models.Model):
@@ -40,11 +166,31 @@ class Message(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     is_edited = models.BooleanField(default=False)
+    # Foreign keys to messages have no database constraint: on PostgreSQL
+    # chat_message is partitioned by month and its id alone is not unique
+    # there (see chat.partitions). The ORM still enforces on_delete.
     reply_to_message = models.ForeignKey(
-        "self", null=True, blank=True, on_delete=models.SET_NULL, related_name="replies"
+        "self",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="replies",
+        db_constraint=False,
     )
 
     is_deleted = models.BooleanField(default=False)
+    # Dense, per-conversation position (1, 2, 3, ...) assigned on insert.
+    sequence = models.PositiveBigIntegerField(editable=False)
+
+    objects = MessageQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.sequence is None:
+            with transaction.atomic():
+                self.sequence = Conversation.allocate_sequences(self.conversation_id)
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
 
     def __str__(self):
         sender_name = "Unknown Sender"
@@ -67,3 +213,197 @@ class Message(models.Model):
 
     class Meta:
         ordering = ["timestamp"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["conversation", "sequence"],
+                name="chat_message_conversation_sequence_uniq",
+            )
+        ]
+
+
+def upload_expiry():
+    return timezone.now() + timedelta(seconds=settings.CHUNKED_UPLOAD_EXPIRY)
+
+
+class UploadSession(models.Model):
+    """A resumable, chunked upload of a message image."""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    uploader = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="upload_sessions",
+    )
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    total_size = models.PositiveBigIntegerField()
+    # Sorted, non-overlapping half-open [start, end) byte ranges already on disk.
+    received_ranges = models.JSONField(default=list, blank=True)
+    message = models.OneToOneField(
+        Message,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="upload_session",
+        db_constraint=False,
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Pushed back by every chunk; unfinished sessions past it are purged
+    # (manage.py purge_upload_sessions).
+    expires_at = models.DateTimeField(default=upload_expiry, db_index=True)
+
+    @property
+    def received_bytes(self):
+        return sum(end - start for start, end in self.received_ranges)
+
+    @property
+    def is_complete(self):
+        return self.received_ranges == [[0, self.total_size]]
+
+    @property
+    def is_finalized(self):
+        return self.message_id is not None
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.received_bytes}/{self.total_size} bytes) by User ID {self.uploader_id}"
+
+    class Meta:
+        ordering = ["-created_at"]
+
+
+class MessageChange(models.Model):
+    """
+    Append-only log of message creates, edits and deletes. The auto-increment
+    id is the cursor clients use to catch up on what changed since they last
+    synced.
+    """
+
+    CREATED = "created"
+    EDITED = "edited"
+    DELETED = "deleted"
+    ACTION_CHOICES = [
+        (CREATED, "Created"),
+        (EDITED, "Edited"),
+        (DELETED, "Deleted"),
+    ]
+
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="message_changes"
+    )
+    message = models.ForeignKey(
+        Message, on_delete=models.CASCADE, related_name="changes", db_constraint=False
+    )
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def record(cls, message, action):
+        return cls.objects.create(
+            conversation_id=message.conversation_id, message=message, action=action
+        )
+
+    def __str__(self):
+        return f"Change #{self.id}: Msg {self.message_id} {self.action}"
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["conversation", "id"])]
+
+
+class OutboxEvent(models.Model):
+    """
+    A broadcast written in the transaction of the write it announces, and sent
+    to the channel layer afterwards by ``manage.py dispatch_outbox``. Sent
+    events are deleted; ones that keep failing are kept with ``failed_at`` set.
+    """
+
+    CONVERSATION = "conversation"
+    USERS = "users"
+    KIND_CHOICES = [
+        (CONVERSATION, "Conversation group"),
+        (USERS, "User groups"),
+    ]
+
+    kind = models.CharField(max_length=12, choices=KIND_CHOICES)
+    conversation_id = models.BigIntegerField(null=True, blank=True)
+    user_ids = models.JSONField(default=list, blank=True)
+    event = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        target = (
+            f"conversation {self.conversation_id}"
+            if self.kind == self.CONVERSATION
+            else f"{len(self.user_ids)} users"
+        )
+        return f"Outbox #{self.id}: {self.event.get('type')} to {target}"
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["failed_at", "available_at", "id"])]
+
+
+def _deleting(origin, model):
+    """Whether a delete started from ``model`` instances (or a queryset of them)."""
+    return isinstance(origin, model) or getattr(origin, "model", None) is model
+
+
+@receiver(post_delete, sender=Message)
+def count_deleted_message(sender, instance, origin=None, **kwargs):
+    # A deleted conversation takes its counters along, and a deleted sender's
+    # conversations are recounted by count_deleted_user.
+    if _deleting(origin, Conversation) or _deleting(origin, get_user_model()):
+        return
+    deleted = _deleted_messages.get()
+    if deleted is not None:
+        deleted[instance.conversation_id] += 1
+        return
+    Conversation.objects.filter(pk=instance.conversation_id).update(
+        message_count=F("message_count") - 1
+    )
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def count_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    # Membership rows are an auto-created model, which gets no delete
+    # signals, and pk_set may name ids that were not (or already) members;
+    # recounting the affected conversations is one UPDATE and always right.
+    if action == "pre_clear" and reverse:
+        instance._cleared_conversation_ids = list(
+            instance.conversations.values_list("pk", flat=True)
+        )
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        conversation_ids = [instance.pk]
+    elif action == "post_clear":
+        conversation_ids = instance.__dict__.pop("_cleared_conversation_ids", [])
+    else:
+        conversation_ids = list(pk_set)
+    if conversation_ids:
+        Conversation.refresh_counters(conversation_ids, fields=("participant_count",))
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def remember_user_conversations(sender, instance, **kwargs):
+    # The user's membership rows go with it, without signals of their own.
+    instance._deleted_from_conversation_ids = list(
+        instance.conversations.values_list("pk", flat=True)
+    )
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def count_deleted_user(sender, instance, **kwargs):
+    # Its sent messages may have gone too; one recount covers both.
+    conversation_ids = instance.__dict__.pop("_deleted_from_conversation_ids", [])
+    if conversation_ids:
+        Conversation.refresh_counters(conversation_ids)
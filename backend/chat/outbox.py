@@ -0,0 +1,172 @@
+# chat/outbox.py
+"""
+Sends the broadcasts the REST views wrote to chat.OutboxEvent (see
+``CHAT_BROADCAST_OUTBOX``). ``manage.py dispatch_outbox`` calls
+``dispatch_batch`` in a loop; several dispatchers can run side by side. Each
+claims a batch in a short transaction (SKIP LOCKED, on PostgreSQL) by moving
+its ``available_at`` forward by ``CHAT_OUTBOX_LEASE_SECONDS``, sends it with
+no transaction open, then deletes or reschedules it in a second one. A
+dispatcher that dies mid-batch leaves its events to be claimed again once
+the lease runs out, so an event can be sent twice but is not lost.
+
+Within a batch a conversation's events go out in order, and conversations in
+parallel. An event that failed is retried with backoff, so it can reach the
+conversation after newer ones; it keeps the ``event_id`` it was given, and
+clients place messages by ``id`` and ``sequence`` anyway.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .broadcast import (
+    buffer_conversation_event,
+    conversation_group_name,
+    user_group_name,
+)
+from .layers import group_send_many
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+RETRY_MAX_DELAY = 300
+LAST_ERROR_LENGTH = 1000
+
+
+def retry_delay(attempts):
+    """Seconds before attempt ``attempts + 1``: 2, 4, 8, ... up to five minutes."""
+    return min(2**attempts, RETRY_MAX_DELAY)
+
+
+async def send_event(channel_layer, outbox_event):
+    event = outbox_event.event
+    if outbox_event.kind == OutboxEvent.USERS:
+        await group_send_many(
+            channel_layer,
+            [user_group_name(user_id) for user_id in outbox_event.user_ids],
+            event,
+        )
+        return
+    if "event_id" not in event:
+        # Buffered on the first attempt only; a retry resends the same event.
+        await sync_to_async(buffer_conversation_event)(
+            outbox_event.conversation_id, event
+        )
+    await channel_layer.group_send(
+        conversation_group_name(outbox_event.conversation_id), event
+    )
+
+
+async def send_events(channel_layer, outbox_events):
+    """Send ``outbox_events`` and return, for each one, the error it raised or None."""
+    errors = [None] * len(outbox_events)
+    ordered = defaultdict(list)
+    for index, outbox_event in enumerate(outbox_events):
+        if outbox_event.kind == OutboxEvent.CONVERSATION:
+            ordered[outbox_event.conversation_id].append(index)
+        else:
+            ordered[("users", index)].append(index)
+
+    async def send_in_order(indexes):
+        for index in indexes:
+            try:
+                await send_event(channel_layer, outbox_events[index])
+            except Exception as e:
+                errors[index] = e
+
+    await asyncio.gather(*(send_in_order(indexes) for indexes in ordered.values()))
+    return errors
+
+
+def pending_events():
+    return OutboxEvent.objects.filter(failed_at__isnull=True)
+
+
+def claim_events(batch_size, now):
+    """
+    Lease up to ``batch_size`` due events, oldest first, so that other
+    dispatchers skip them until the lease runs out. Returns them and the time
+    their lease ends, which the dispatcher still holding them finds in
+    ``available_at``.
+    """
+    leased_until = now + timedelta(seconds=settings.CHAT_OUTBOX_LEASE_SECONDS)
+    with transaction.atomic():
+        outbox_events = list(
+            pending_events()
+            .filter(available_at__lte=now)
+            .select_for_update(skip_locked=True)
+            .order_by("pk")[:batch_size]
+        )
+        if outbox_events:
+            OutboxEvent.objects.filter(pk__in=[e.pk for e in outbox_events]).update(
+                available_at=leased_until
+            )
+    return outbox_events, leased_until
+
+
+def dispatch_batch(batch_size=100, max_attempts=None, channel_layer=None):
+    """
+    Send up to ``batch_size`` due outbox events, oldest first. Sent ones are
+    deleted; failed ones are retried later, or marked failed after
+    ``max_attempts``. Returns the numbers sent and failed.
+    """
+    if max_attempts is None:
+        max_attempts = settings.CHAT_OUTBOX_MAX_ATTEMPTS
+    channel_layer = channel_layer or get_channel_layer()
+    outbox_events, leased_until = claim_events(batch_size, timezone.now())
+    if not outbox_events:
+        return 0, 0
+    errors = async_to_sync(send_events)(channel_layer, outbox_events)
+
+    now = timezone.now()
+    sent_ids, failed = [], []
+    for outbox_event, error in zip(outbox_events, errors):
+        if error is None:
+            sent_ids.append(outbox_event.pk)
+            continue
+        outbox_event.attempts += 1
+        outbox_event.last_error = f"{type(error).__name__}: {error}"[:LAST_ERROR_LENGTH]
+        if outbox_event.attempts >= max_attempts:
+            outbox_event.failed_at = now
+            logger.error(
+                f"Giving up on outbox event {outbox_event.pk} after "
+                f"{outbox_event.attempts} attempts: {outbox_event.last_error}"
+            )
+        else:
+            outbox_event.available_at = now + timedelta(
+                seconds=retry_delay(outbox_event.attempts)
+            )
+            logger.warning(
+                f"Outbox event {outbox_event.pk} failed (attempt "
+                f"{outbox_event.attempts}), retrying: {outbox_event.last_error}"
+            )
+        failed.append(outbox_event)
+
+    with transaction.atomic():
+        # Only the events still leased to this dispatcher: one whose lease ran
+        # out during the sends belongs to whichever dispatcher claimed it since.
+        still_leased = set(
+            OutboxEvent.objects.filter(
+                pk__in=[e.pk for e in outbox_events], available_at=leased_until
+            )
+            .select_for_update()
+            .values_list("pk", flat=True)
+        )
+        if sent_ids:
+            OutboxEvent.objects.filter(
+                pk__in=still_leased.intersection(sent_ids)
+            ).delete()
+        failed_leased = [e for e in failed if e.pk in still_leased]
+        if failed_leased:
+            # The event too, to keep an event_id it was given.
+            OutboxEvent.objects.bulk_update(
+                failed_leased,
+                ["attempts", "last_error", "available_at", "failed_at", "event"],
+            )
+    return len(sent_ids), len(failed)
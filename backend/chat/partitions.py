@@ -0,0 +1,77 @@
+"""
+Monthly range partitioning of ``chat_message`` on PostgreSQL.
+
+Partitions are named ``chat_message_pYYYYMM`` and cover one calendar month
+(UTC) of ``timestamp``. A ``chat_message_default`` partition catches rows
+outside every month so inserts never fail, but ``manage_message_partitions``
+keeps partitions created ahead of time so it normally stays empty. On other
+databases ``chat_message`` stays a plain table and these helpers are unused.
+"""
+
+import datetime
+import re
+
+MESSAGE_TABLE = "chat_message"
+DEFAULT_PARTITION = f"{MESSAGE_TABLE}_default"
+PARTITION_NAME_RE = re.compile(rf"^{MESSAGE_TABLE}_p(\d{{4}})(\d{{2}})$")
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{MESSAGE_TABLE}_p{month:%Y%m}"
+
+
+def partition_month(name):
+    match = PARTITION_NAME_RE.match(name)
+    if not match:
+        return None
+    return datetime.date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def is_partitioned(connection):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [MESSAGE_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def create_month_partition(cursor, month):
+    """Create the partition for ``month`` if it does not exist yet."""
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(month)}" '
+        f'PARTITION OF "{MESSAGE_TABLE}" '
+        f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') "
+        f"TO ('{add_months(month, 1):%Y-%m-%d} 00:00:00+00')"
+    )
+
+
+def attached_partitions(cursor):
+    """``{name: (month, tablespace)}`` for the month partitions of chat_message."""
+    cursor.execute(
+        """
+        SELECT child.relname, COALESCE(ts.spcname, '')
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        LEFT JOIN pg_tablespace ts ON ts.oid = child.reltablespace
+        WHERE pg_inherits.inhparent = to_regclass(%s)
+        """,
+        [MESSAGE_TABLE],
+    )
+    partitions = {}
+    for name, tablespace in cursor.fetchall():
+        month = partition_month(name)
+        if month is not None:
+            partitions[name] = (month, tablespace)
+    return partitions
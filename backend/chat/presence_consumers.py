@@ -4,6 +4,7 @@ import redis
 from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
+from src.metrics import WEBSOCKET_CONNECTIONS, WEBSOCKET_CONNECTS
 
 _online_users_registry_in_memory = set()
 _redis_client = None
@@ -65,10 +66,13 @@ class PresenceConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope.get("user")
         if not self.user or not self.user.is_authenticated:
+            WEBSOCKET_CONNECTS.inc(consumer="presence", outcome="unauthenticated")
             await self.close()
             return
 
         await self.accept()
+        WEBSOCKET_CONNECTS.inc(consumer="presence", outcome="accepted")
+        WEBSOCKET_CONNECTIONS.inc(consumer="presence")
         self.user_id_str = str(self.user.id)
 
         await self.add_user_to_online_set(self.user_id_str)
@@ -86,6 +90,7 @@ class PresenceConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         if hasattr(self, "user_id_str"):
+            WEBSOCKET_CONNECTIONS.dec(consumer="presence")
             await self.remove_user_from_online_set(self.user_id_str)
             current_online_users = await self.get_all_online_users()
             print(
@@ -1,6 +1,10 @@
 # chat/serializers.py
+import os
+from django.conf import settings
+from django.utils.text import get_valid_filename
 from rest_framework import serializers
-from .models import Conversation, Message
+from .models import Conversation, Message, MessageChange, UploadSession
+from .uploads import missing_ranges
 from users.serializers import UserSerializer, LightUserSerializer
 
 
@@ -31,6 +35,7 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = [
             "id",
             "conversation",
+            "sequence",
             "sender",
             "content",
             "image_url",
@@ -43,6 +48,7 @@ class MessageSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = [
             "id",
+            "sequence",
             "sender",
             "timestamp",
             "updated_at",
@@ -82,6 +88,16 @@ class MessageCreateSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class AsyncMessageCreateSerializer(MessageCreateSerializer):
+    """
+    For the async views, where validation cannot query the database; they
+    look the replied-to message up themselves, within the conversation.
+    """
+
+    def validate_reply_to_message_id(self, value):
+        return value
+
+
 class MessageEditSerializer(serializers.ModelSerializer):
     content = serializers.CharField(required=True, allow_blank=False)
 
@@ -90,6 +106,39 @@ class MessageEditSerializer(serializers.ModelSerializer):
         fields = ["content"]
 
 
+class ConversationListSerializer(serializers.ListSerializer):
+    """
+    Loads the last message of every conversation in one query when the
+    queryset is annotated with ``last_message_id_annotated``, instead of one
+    query (plus sender and reply lookups) per conversation.
+    """
+
+    def to_representation(self, data):
+        conversations = list(data.all() if hasattr(data, "all") else data)
+        annotated = [
+            conversation
+            for conversation in conversations
+            if hasattr(conversation, "last_message_id_annotated")
+        ]
+        message_ids = [
+            conversation.last_message_id_annotated
+            for conversation in annotated
+            if conversation.last_message_id_annotated is not None
+        ]
+        messages = (
+            Message.objects.select_related(
+                "sender__profile", "reply_to_message__sender__profile"
+            ).in_bulk(message_ids)
+            if message_ids
+            else {}
+        )
+        for conversation in annotated:
+            conversation.last_message_loaded = messages.get(
+                conversation.last_message_id_annotated
+            )
+        return super().to_representation(conversations)
+
+
 class ConversationSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     participant_ids = serializers.ListField(
@@ -106,6 +155,9 @@ class ConversationSerializer(serializers.ModelSerializer):
             "participant_ids",
             "created_at",
             "updated_at",
+            "last_sequence",
+            "message_count",
+            "participant_count",
             "last_message",
             "unread_count",
         ]
@@ -113,32 +165,109 @@ class ConversationSerializer(serializers.ModelSerializer):
             "id",
             "created_at",
             "updated_at",
+            "last_sequence",
+            "message_count",
+            "participant_count",
             "participants",
             "last_message",
             "unread_count",
         ]
+        list_serializer_class = ConversationListSerializer
 
     def get_last_message(self, obj):
-        latest_msg = (
-            obj.messages.filter(is_deleted=False).order_by("-timestamp").first()
-        )
+        if hasattr(obj, "last_message_loaded"):
+            latest_msg = obj.last_message_loaded
+        else:
+            latest_msg = (
+                obj.messages.filter(is_deleted=False).order_by("-timestamp").first()
+            )
         if latest_msg:
             return MessageSerializer(latest_msg, context=self.context).data
         return None
 
     def get_unread_count(self, obj):
-        request = self.context.get('request')
-        if request and hasattr(request, 'user') and request.user.is_authenticated:
+        request = self.context.get("request")
+        if request and hasattr(request, "user") and request.user.is_authenticated:
             user = request.user
-            if hasattr(obj, f'unread_for_{user.id}'):
-                 return getattr(obj, f'unread_for_{user.id}')
+            if hasattr(obj, f"unread_for_{user.id}"):
+                return getattr(obj, f"unread_for_{user.id}")
 
-            return obj.unread_messages_for_user(user) if hasattr(obj, 'unread_messages_for_user') else 0
+            return (
+                obj.unread_messages_for_user(user)
+                if hasattr(obj, "unread_messages_for_user")
+                else 0
+            )
         return 0
-    
+
     def create(self, validated_data):
         participants_qs = validated_data.pop("participants_qs", None)
         conversation = Conversation.objects.create()
         if participants_qs:
             conversation.participants.set(participants_qs)
+            conversation.refresh_from_db(fields=["participant_count"])
         return conversation
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    missing_ranges = serializers.SerializerMethodField()
+    received_bytes = serializers.IntegerField(read_only=True)
+    is_complete = serializers.BooleanField(read_only=True)
+    message_id = serializers.IntegerField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            "id",
+            "conversation",
+            "filename",
+            "content_type",
+            "total_size",
+            "received_ranges",
+            "missing_ranges",
+            "received_bytes",
+            "is_complete",
+            "message_id",
+            "created_at",
+            "updated_at",
+            "expires_at",
+        ]
+        read_only_fields = fields
+
+    def get_missing_ranges(self, obj):
+        return missing_ranges(obj.received_ranges, obj.total_size)
+
+
+class UploadSessionCreateSerializer(serializers.ModelSerializer):
+    total_size = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = UploadSession
+        fields = ["filename", "content_type", "total_size"]
+
+    def validate_filename(self, value):
+        filename = get_valid_filename(os.path.basename(value))
+        if not filename:
+            raise serializers.ValidationError("A valid file name is required.")
+        return filename
+
+    def validate_total_size(self, value):
+        max_size = settings.CHUNKED_UPLOAD_MAX_SIZE
+        if value > max_size:
+            raise serializers.ValidationError(
+                f"Uploads are limited to {max_size} bytes."
+            )
+        return value
+
+
+class UploadFinalizeSerializer(serializers.Serializer):
+    content = serializers.CharField(allow_blank=True, required=False)
+    reply_to_message_id = serializers.IntegerField(required=False, allow_null=True)
+
+
+class MessageChangeSerializer(serializers.ModelSerializer):
+    message = MessageSerializer(read_only=True)
+
+    class Meta:
+        model = MessageChange
+        fields = ["id", "action", "conversation", "message", "created_at"]
+        read_only_fields = fields
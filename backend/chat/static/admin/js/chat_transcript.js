@@ -0,0 +1,38 @@
+/* chat/static/admin/js/chat_transcript.js */
+
+// Loads older messages into the conversation transcript, one page per click.
+document.addEventListener("click", function (event) {
+    const button = event.target.closest(".admin-chat-load-older");
+    if (!button || button.disabled) {
+        return;
+    }
+    const container = button.parentElement;
+    button.disabled = true;
+
+    fetch(button.dataset.url + "?before=" + encodeURIComponent(button.dataset.before), {
+        credentials: "same-origin",
+        headers: { Accept: "application/json" },
+    })
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error("HTTP " + response.status);
+            }
+            return response.json();
+        })
+        .then(function (page) {
+            // Keep the messages in view where they were while prepending.
+            const previousHeight = container.scrollHeight;
+            button.insertAdjacentHTML("afterend", page.html);
+            container.scrollTop += container.scrollHeight - previousHeight;
+            if (page.before === null) {
+                button.remove();
+            } else {
+                button.dataset.before = page.before;
+                button.disabled = false;
+            }
+        })
+        .catch(function () {
+            button.textContent = "Could not load older messages, try again";
+            button.disabled = false;
+        });
+});
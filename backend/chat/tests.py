@@ -1,9 +1,71 @@
 # chat/tests.py
-from django.test import TestCase
+import asyncio
+import contextvars
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
+from uuid import UUID
+import redis
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
 from django.contrib.auth import get_user_model
+from django.db.models import Count
+from django.urls import get_resolver, resolve, reverse
 from django.utils import timezone
 from freezegun import freeze_time
-from .models import Conversation, Message
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.tokens import AccessToken
+from src import metrics, query_profiler, tracing
+from src.db_pool.pool import ConnectionPool, PoolTimeout
+from src.db_router import ReplicaRouter, ReplicaRoutingMiddleware
+from users.middleware import JWTAuthMiddleware
+from . import benchmarks, event_buffer, export, partitions
+from .broadcast import (
+    buffer_conversation_event,
+    conversation_group_name,
+    defer_broadcasts,
+    publish_conversation_event,
+    user_group_name,
+)
+from .layers import InstrumentedChannelLayer, LocalDeliveryRedisChannelLayer
+from .loadtest import percentile
+from .models import Conversation, Message, MessageChange, OutboxEvent, UploadSession
+from .outbox import dispatch_batch, pending_events
+from .routing import websocket_urlpatterns
+from .serializers import AsyncMessageCreateSerializer
+from .streaming import StreamingListMixin
+from .uploads import get_part_path, merge_range, missing_ranges
+from .views import UploadSessionMixin
 
 CustomUser = get_user_model()
 
@@ -145,6 +207,31 @@ class ChatModelTests(TestCase):
         self.assertEqual(messages_in_conv.first(), msg1)
         self.assertEqual(messages_in_conv.last(), msg2)
 
+    def test_message_sequence_is_dense_per_conversation(self):
+        """Test that messages get consecutive sequence numbers per conversation."""
+        other_conversation = Conversation.objects.create()
+        other_conversation.participants.add(self.user1, self.user3)
+
+        first = Message.objects.create(
+            conversation=self.conversation, sender=self.user1, content="1"
+        )
+        other = Message.objects.create(
+            conversation=other_conversation, sender=self.user1, content="x"
+        )
+        second = Message.objects.create(
+            conversation=self.conversation, sender=self.user2, content="2"
+        )
+
+        self.assertEqual((first.sequence, second.sequence), (1, 2))
+        self.assertEqual(other.sequence, 1)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_sequence, 2)
+
+        second.content = "edited"
+        second.save()
+        second.refresh_from_db()
+        self.assertEqual(second.sequence, 2)
+
     def test_message_on_delete_sender_cascade(self):
         """Test that if a sender is deleted, their messages are also deleted (CASCADE)."""
         temp_user = CustomUser.objects.create_user(email="temp@del.com", password="pw")
@@ -185,3 +272,2879 @@ class ChatModelTests(TestCase):
         reply_msg.refresh_from_db()
 
         self.assertIsNone(reply_msg.reply_to_message)
+
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+}
+
+
+def make_png_bytes(size=(40, 40), color="red"):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TempMediaMixin:
+    """Points MEDIA_ROOT and the chunked upload directory at a temp dir."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_dir,
+            CHUNKED_UPLOAD_TEMP_DIR=f"{self.media_dir}/parts",
+            CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_dir, ignore_errors=True)
+        super().tearDown()
+
+
+class UploadRangeHelperTests(TestCase):
+
+    def test_merge_range_coalesces_overlapping_and_adjacent(self):
+        ranges = merge_range([], 10, 20)
+        ranges = merge_range(ranges, 0, 5)
+        ranges = merge_range(ranges, 5, 10)
+        self.assertEqual(ranges, [[0, 20]])
+        self.assertEqual(merge_range(ranges, 30, 40), [[0, 20], [30, 40]])
+
+    def test_missing_ranges(self):
+        self.assertEqual(
+            missing_ranges([[5, 10], [20, 25]], 30), [[0, 5], [10, 20], [25, 30]]
+        )
+        self.assertEqual(missing_ranges([[0, 30]], 30), [])
+
+
+class ChunkedUploadAPITests(TempMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="up1@chat.com", password="pw1", username="up1"
+        )
+        cls.user2 = CustomUser.objects.create_user(
+            email="up2@chat.com", password="pw2", username="up2"
+        )
+        cls.outsider = CustomUser.objects.create_user(
+            email="up3@chat.com", password="pw3", username="up3"
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+        self.image_bytes = make_png_bytes()
+
+    def create_session(self):
+        response = self.client.post(
+            reverse("conversation-upload-create", args=[self.conversation.id]),
+            {
+                "filename": "photo.png",
+                "content_type": "image/png",
+                "total_size": len(self.image_bytes),
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def put_chunk(self, upload_id, start, end):
+        return self.client.put(
+            reverse("upload-detail", args=[upload_id]),
+            data=self.image_bytes[start:end],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes {start}-{end - 1}/{len(self.image_bytes)}",
+        )
+
+    def test_out_of_order_chunks_are_tracked_and_finalized(self):
+        upload_id = self.create_session()
+        total = len(self.image_bytes)
+        middle = total // 2
+
+        response = self.put_chunk(upload_id, middle, total)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["missing_ranges"], [[0, middle]])
+
+        response = self.client.post(
+            reverse("upload-finalize", args=[upload_id]), {"content": "hi"}
+        )
+        self.assertEqual(response.status_code, 409)
+
+        self.put_chunk(upload_id, 0, middle)
+        status_response = self.client.get(reverse("upload-detail", args=[upload_id]))
+        self.assertTrue(status_response.data["is_complete"])
+
+        response = self.client.post(
+            reverse("upload-finalize", args=[upload_id]), {"content": "hi"}
+        )
+        self.assertEqual(response.status_code, 201)
+        message = Message.objects.get(id=response.data["id"])
+        self.assertEqual(message.content, "hi")
+        with message.image.open("rb") as stored:
+            self.assertEqual(stored.read(), self.image_bytes)
+
+        retry = self.client.post(
+            reverse("upload-finalize", args=[upload_id]), {"content": "hi"}
+        )
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.data["id"], message.id)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_concurrent_finalize_retries_create_one_message(self):
+        upload_id = self.create_session()
+        self.put_chunk(upload_id, 0, len(self.image_bytes))
+        # The retry read the session before the first finalize committed.
+        stale = UploadSession.objects.get(id=upload_id)
+        first = self.client.post(
+            reverse("upload-finalize", args=[upload_id]), {"content": "hi"}
+        )
+        self.assertEqual(first.status_code, 201)
+
+        with mock.patch.object(UploadSessionMixin, "get_session", return_value=stale):
+            retry = self.client.post(
+                reverse("upload-finalize", args=[upload_id]), {"content": "hi"}
+            )
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.data["id"], first.data["id"])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_chunk_with_wrong_length_is_rejected(self):
+        upload_id = self.create_session()
+        response = self.client.put(
+            reverse("upload-detail", args=[upload_id]),
+            data=self.image_bytes[:10],
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE=f"bytes 0-19/{len(self.image_bytes)}",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(UploadSession.objects.get(id=upload_id).received_ranges, [])
+
+    def test_non_image_upload_is_rejected_on_finalize(self):
+        self.image_bytes = b"not an image at all"
+        upload_id = self.create_session()
+        self.put_chunk(upload_id, 0, len(self.image_bytes))
+        response = self.client.post(reverse("upload-finalize", args=[upload_id]), {})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+    def test_concurrent_first_chunks_do_not_truncate_each_other(self):
+        upload_id = self.create_session()
+        total = len(self.image_bytes)
+        middle = total // 2
+        # Both requests find no part file yet; the later one must not wipe
+        # the bytes the earlier one wrote.
+        with mock.patch.object(Path, "exists", return_value=False):
+            self.put_chunk(upload_id, middle, total)
+            self.put_chunk(upload_id, 0, middle)
+        session = UploadSession.objects.get(id=upload_id)
+        self.assertEqual(get_part_path(session).read_bytes(), self.image_bytes)
+
+    def test_expired_sessions_are_gone_and_purged(self):
+        upload_id = self.create_session()
+        self.put_chunk(upload_id, 0, 10)
+        finalized_id = self.create_session()
+        self.put_chunk(finalized_id, 0, len(self.image_bytes))
+        self.client.post(reverse("upload-finalize", args=[finalized_id]), {})
+        fresh_id = self.create_session()
+        self.put_chunk(fresh_id, 0, 10)
+        orphan = (
+            Path(settings.CHUNKED_UPLOAD_TEMP_DIR)
+            / "0d5e6a1c-5b0e-4ad9-9a43-0cbd8d0f6a57.part"
+        )
+        orphan.write_bytes(b"left over")
+        os.utime(orphan, (0, 0))
+
+        UploadSession.objects.filter(id__in=[upload_id, finalized_id]).update(
+            expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        self.assertEqual(
+            self.client.get(reverse("upload-detail", args=[upload_id])).status_code, 404
+        )
+        self.assertEqual(self.put_chunk(upload_id, 10, 20).status_code, 404)
+
+        out = io.StringIO()
+        call_command("purge_upload_sessions", stdout=out)
+        self.assertIn(
+            "1 expired upload sessions and 1 orphaned part files deleted",
+            out.getvalue(),
+        )
+        self.assertEqual(
+            set(UploadSession.objects.values_list("id", flat=True)),
+            {UUID(finalized_id), UUID(fresh_id)},
+        )
+        self.assertEqual(
+            sorted(
+                path.name for path in Path(settings.CHUNKED_UPLOAD_TEMP_DIR).iterdir()
+            ),
+            [f"{fresh_id}.part"],
+        )
+
+    def test_only_participants_can_open_uploads(self):
+        self.client.force_authenticate(self.outsider)
+        response = self.client.post(
+            reverse("conversation-upload-create", args=[self.conversation.id]),
+            {"filename": "photo.png", "total_size": 10},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ProtectedMediaViewTests(TempMediaMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="media1@chat.com", password="pw1", username="media1"
+        )
+        cls.outsider = CustomUser.objects.create_user(
+            email="media2@chat.com", password="pw2", username="media2"
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1)
+        self.path = "message_images/photo.png"
+        media_root = Path(self.media_dir)
+        (media_root / "message_images").mkdir(parents=True)
+        (media_root / self.path).write_bytes(make_png_bytes())
+        Message.objects.create(
+            conversation=self.conversation, sender=self.user1, image=self.path
+        )
+        self.url = reverse("protected-media", kwargs={"path": self.path})
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+
+    def test_participant_gets_offloaded_response_with_cache_headers(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/" + self.path)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response.content, b"")
+
+    def test_etag_matches_nginx(self):
+        stat_result = os.stat(Path(self.media_dir) / self.path)
+        self.assertEqual(
+            self.client.get(self.url)["ETag"],
+            f'"{int(stat_result.st_mtime):x}-{stat_result.st_size:x}"',
+        )
+
+    @override_settings(MEDIA_SENDFILE_BACKEND="django")
+    def test_django_backend_streams_only_in_debug_and_tests(self):
+        response = self.client.get(self.url)
+        self.assertEqual(b"".join(response.streaming_content), make_png_bytes())
+        response.close()
+        with override_settings(TESTING=False):
+            with self.assertRaises(ImproperlyConfigured):
+                self.client.get(self.url)
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=999999-")
+        self.assertEqual(response.status_code, 416)
+        response = self.client.get(self.url, HTTP_RANGE="bytes=0-10")
+        self.assertEqual(response.status_code, 200)
+
+    def test_non_participant_and_traversal_are_hidden(self):
+        self.client.force_authenticate(self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        traversal = reverse("protected-media", kwargs={"path": "../settings.py"})
+        self.assertEqual(self.client.get(traversal).status_code, 404)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ConversationListSyncTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            email="list1@chat.com", password="pw1", username="list1"
+        )
+        cls.others = [
+            CustomUser.objects.create_user(
+                email=f"other{i}@chat.com", password="pw", username=f"other{i}"
+            )
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        self.conversations = []
+        for i, other in enumerate(self.others):
+            with freeze_time(f"2024-01-01 12:00:0{i}"):
+                conversation = Conversation.objects.create()
+                conversation.participants.add(self.user, other)
+            self.conversations.append(conversation)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse("conversation-list-create")
+
+    def test_plain_list_is_unchanged(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 5)
+
+    def test_cursor_pagination_by_activity(self):
+        response = self.client.get(self.url, {"limit": 2})
+        self.assertEqual(
+            [c["id"] for c in response.data["results"]],
+            [self.conversations[4].id, self.conversations[3].id],
+        )
+        seen = [c["id"] for c in response.data["results"]]
+        next_url = response.data["next"]
+        while next_url:
+            response = self.client.get(next_url)
+            seen += [c["id"] for c in response.data["results"]]
+            next_url = response.data["next"]
+        self.assertEqual(seen, [c.id for c in reversed(self.conversations)])
+
+    def test_since_token_returns_only_changed_conversations(self):
+        response = self.client.get(self.url, {"since": ""})
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertFalse(response.data["has_more"])
+        token = response.data["since"]
+
+        response = self.client.get(self.url, {"since": token})
+        self.assertEqual(response.data["results"], [])
+        self.assertEqual(response.data["since"], token)
+
+        with freeze_time("2024-01-02 09:00:00"):
+            self.conversations[1].save()
+        response = self.client.get(self.url, {"since": token})
+        self.assertEqual(
+            [c["id"] for c in response.data["results"]], [self.conversations[1].id]
+        )
+
+    @override_settings(SYNC_OVERLAP_SECONDS=10)
+    def test_since_token_stays_behind_recent_changes(self):
+        with freeze_time("2024-01-01 12:01:00"):
+            response = self.client.get(self.url, {"since": ""})
+            token = response.data["since"]
+            self.conversations[1].save()
+        with freeze_time("2024-01-01 12:01:05"):
+            response = self.client.get(self.url, {"since": token})
+            self.assertEqual(
+                [c["id"] for c in response.data["results"]], [self.conversations[1].id]
+            )
+            self.assertEqual(response.data["since"], token)
+        with freeze_time("2024-01-01 12:01:30"):
+            response = self.client.get(self.url, {"since": token})
+            self.assertEqual(
+                [c["id"] for c in response.data["results"]], [self.conversations[1].id]
+            )
+            token = response.data["since"]
+            self.assertEqual(
+                self.client.get(self.url, {"since": token}).data["results"], []
+            )
+
+    def test_invalid_since_token(self):
+        response = self.client.get(self.url, {"since": "garbage"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class MessageChangeFeedTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="feed1@chat.com", password="pw1", username="feed1"
+        )
+        cls.user2 = CustomUser.objects.create_user(
+            email="feed2@chat.com", password="pw2", username="feed2"
+        )
+        cls.outsider = CustomUser.objects.create_user(
+            email="feed3@chat.com", password="pw3", username="feed3"
+        )
+
+    def setUp(self):
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+        self.feed_url = reverse("message-change-feed")
+
+    def send(self, content):
+        response = self.client.post(
+            reverse("conversation-messages-list-create", args=[self.conversation.id]),
+            {"content": content},
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def test_feed_reports_creates_edits_and_deletes_since_cursor(self):
+        head = self.client.get(self.feed_url).data["since"]
+        with freeze_time("2024-01-01 12:00:00"):
+            first_id = self.send("first")
+            second_id = self.send("second")
+            self.client.patch(
+                reverse("message-detail-update-delete", args=[first_id]),
+                {"content": "edited"},
+            )
+            self.client.delete(
+                reverse("message-detail-update-delete", args=[second_id])
+            )
+
+        with freeze_time("2024-01-01 12:01:00"):
+            response = self.client.get(self.feed_url, {"since": head})
+            self.assertEqual(
+                [(c["message"]["id"], c["action"]) for c in response.data["results"]],
+                [(first_id, "edited"), (second_id, "deleted")],
+            )
+            self.assertEqual(
+                response.data["results"][0]["message"]["content"], "edited"
+            )
+            self.assertTrue(response.data["results"][1]["message"]["is_deleted"])
+
+            cursor = response.data["since"]
+            self.assertEqual(
+                self.client.get(self.feed_url, {"since": cursor}).data["results"], []
+            )
+
+    @override_settings(SYNC_OVERLAP_SECONDS=10)
+    def test_recent_changes_are_sent_again_until_they_settle(self):
+        with freeze_time("2024-01-01 12:00:00"):
+            settled_id = self.send("settled")
+        with freeze_time("2024-01-01 12:00:15"):
+            recent_id = self.send("recent")
+
+            # The head leaves the recent change ahead of it...
+            head = self.client.get(self.feed_url).data["since"]
+            response = self.client.get(self.feed_url, {"since": head})
+            self.assertEqual(
+                [c["message"]["id"] for c in response.data["results"]], [recent_id]
+            )
+
+            # ...and the cursor stops before it, so it comes again.
+            response = self.client.get(self.feed_url, {"since": 0})
+            self.assertEqual(
+                [c["message"]["id"] for c in response.data["results"]],
+                [settled_id, recent_id],
+            )
+            self.assertFalse(response.data["has_more"])
+            cursor = response.data["since"]
+            response = self.client.get(self.feed_url, {"since": cursor})
+            self.assertEqual(
+                [c["message"]["id"] for c in response.data["results"]], [recent_id]
+            )
+            self.assertEqual(response.data["since"], cursor)
+
+        with freeze_time("2024-01-01 12:00:30"):
+            response = self.client.get(self.feed_url, {"since": cursor})
+            self.assertEqual(
+                [c["message"]["id"] for c in response.data["results"]], [recent_id]
+            )
+            cursor = response.data["since"]
+            self.assertEqual(
+                self.client.get(self.feed_url, {"since": cursor}).data["results"], []
+            )
+
+    def test_feed_is_scoped_to_participants(self):
+        self.send("private")
+        self.client.force_authenticate(self.outsider)
+        response = self.client.get(self.feed_url, {"since": 0})
+        self.assertEqual(response.data["results"], [])
+
+    def test_missed_sequence_range_can_be_fetched(self):
+        for i in range(5):
+            self.send(f"message {i}")
+        response = self.client.get(
+            reverse("conversation-messages-list-create", args=[self.conversation.id]),
+            {"after_sequence": 1, "before_sequence": 4},
+        )
+        self.assertEqual([m["sequence"] for m in response.data], [2, 3])
+        self.assertEqual(response.data[0]["content"], "message 1")
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatConsumerResumeTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="ws1@chat.com", password="pw1", username="ws1"
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        event_buffer._event_buffer = event_buffer.InMemoryEventBuffer(size=3)
+
+    def tearDown(self):
+        event_buffer._event_buffer = None
+
+    def publish_messages(self, count):
+        for i in range(count):
+            publish_conversation_event(
+                self.conversation.id,
+                {"type": "chat.message", "message": {"content": f"missed {i}"}},
+            )
+
+    async def connect(self, query=""):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns),
+            f"/ws/chat/{self.conversation.id}/{query}",
+        )
+        communicator.scope["user"] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    @override_settings(CHAT_EVENT_REPLAY_OVERLAP=0)
+    def test_reconnect_replays_missed_events(self):
+        self.publish_messages(3)
+
+        async def scenario():
+            communicator = await self.connect("?last_event_id=1")
+            replayed = [await communicator.receive_json_from() for _ in range(3)]
+            await communicator.disconnect()
+            return replayed
+
+        first, second, done = async_to_sync(scenario)()
+        self.assertEqual(
+            (first["event_id"], first["message"]["content"]), (2, "missed 1")
+        )
+        self.assertEqual(
+            (second["event_id"], second["message"]["content"]), (3, "missed 2")
+        )
+        self.assertEqual(done["type"], "resume_complete")
+        self.assertEqual(done["last_event_id"], 3)
+
+    @override_settings(CHAT_EVENT_REPLAY_OVERLAP=2)
+    def test_resume_replays_events_delivered_out_of_order(self):
+        first = {"type": "chat.message", "message": {"content": "slow sender"}}
+        second = {"type": "chat.message", "message": {"content": "fast sender"}}
+
+        async def scenario():
+            communicator = await self.connect()
+            # Both senders get their ids, then the second one delivers first.
+            await sync_to_async(buffer_conversation_event)(self.conversation.id, first)
+            await sync_to_async(buffer_conversation_event)(self.conversation.id, second)
+            channel_layer = get_channel_layer()
+            group = conversation_group_name(self.conversation.id)
+            await channel_layer.group_send(group, second)
+            live = await communicator.receive_json_from()
+            await communicator.disconnect()
+            await channel_layer.group_send(group, first)
+
+            communicator = await self.connect(f"?last_event_id={live['event_id']}")
+            replayed = [await communicator.receive_json_from() for _ in range(3)]
+            await communicator.disconnect()
+            return live, replayed
+
+        live, (slow, fast, done) = async_to_sync(scenario)()
+        self.assertEqual(live["event_id"], 2)
+        self.assertEqual(
+            (slow["event_id"], slow["message"]["content"]), (1, "slow sender")
+        )
+        self.assertEqual(fast["event_id"], 2)
+        self.assertEqual(
+            (done["type"], done["replayed"], done["last_event_id"]),
+            ("resume_complete", 2, 2),
+        )
+
+    def test_resume_frame_past_buffer_requires_resync(self):
+        self.publish_messages(5)
+
+        async def scenario():
+            communicator = await self.connect()
+            await communicator.send_json_to(
+                {
+                    "type": "resume",
+                    "conversation_id": self.conversation.id,
+                    "last_event_id": 1,
+                }
+            )
+            reply = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return reply
+
+        reply = async_to_sync(scenario)()
+        self.assertEqual(reply["type"], "resync_required")
+        self.assertEqual(reply["last_event_id"], 5)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="etag1@chat.com", password="pw1", username="etag1"
+        )
+        cls.user2 = CustomUser.objects.create_user(
+            email="etag2@chat.com", password="pw2", username="etag2"
+        )
+
+    def setUp(self):
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, self.user2)
+        self.message = Message.objects.create(
+            conversation=self.conversation, sender=self.user2, content="hello"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+
+    def assertRevalidates(self, url, change):
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_history_revalidates_after_new_message(self):
+        url = reverse("conversation-messages-list-create", args=[self.conversation.id])
+        self.assertRevalidates(url, lambda: self.client.post(url, {"content": "new"}))
+
+    def test_history_revalidates_after_edit(self):
+        url = reverse("messages-with-user", args=[self.user1.id])
+        self.client.force_authenticate(self.user2)
+
+        def edit():
+            self.client.patch(
+                reverse("message-detail-update-delete", args=[self.message.id]),
+                {"content": "edited"},
+            )
+
+        self.assertRevalidates(url, edit)
+
+    def test_conversation_list_revalidates_after_profile_change(self):
+        def rename():
+            self.user2.first_name = "Renamed"
+            self.user2.save()
+
+        self.assertRevalidates(reverse("conversation-list-create"), rename)
+
+    def test_validator_is_per_user(self):
+        url = reverse("conversation-messages-list-create", args=[self.conversation.id])
+        etag = self.client.get(url)["ETag"]
+        self.client.force_authenticate(self.user2)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class StreamingListTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="stream1@chat.com", password="pw1", username="stream1"
+        )
+        cls.user2 = CustomUser.objects.create_user(
+            email="stream2@chat.com", password="pw2", username="stream2"
+        )
+        cls.conversation = Conversation.objects.create()
+        cls.conversation.participants.add(cls.user1, cls.user2)
+        for i in range(25):
+            Message.objects.create(
+                conversation=cls.conversation, sender=cls.user1, content=f"Héllo {i}"
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+
+    def test_streamed_history_matches_regular_response(self):
+        for url in (
+            reverse("conversation-messages-list-create", args=[self.conversation.id]),
+            reverse("messages-with-user", args=[self.user2.id]),
+        ):
+            regular = self.client.get(url)
+            streamed = self.client.get(url, {"stream": "true"})
+            self.assertTrue(streamed.streaming)
+            body = json.loads(b"".join(streamed.streaming_content))
+            self.assertEqual(len(body), 25)
+            self.assertEqual(body, json.loads(regular.content))
+
+    def test_streaming_empty_history(self):
+        url = reverse("conversation-messages-list-create", args=[self.conversation.id])
+        streamed = self.client.get(url, {"stream": "1", "after_sequence": 1000})
+        self.assertEqual(b"".join(streamed.streaming_content), b"[]")
+
+
+def asgi_get(path, token, query_string=b"", on_body=None, method="GET", body=b""):
+    """
+    GET ``path`` through Django's ASGI handler, as daphne serves it. Returns
+    the status and the body messages; ``on_body`` is called as each arrives.
+    Other methods send ``body`` as JSON.
+    """
+    # A fresh context, as in benchmarks.run_asgi_throughput.
+    return contextvars.Context().run(
+        asyncio.run, asgi_request(path, token, query_string, on_body, method, body)
+    )
+
+
+async def asgi_request(
+    path,
+    token,
+    query_string=b"",
+    on_body=None,
+    method="GET",
+    body=b"",
+    content_type="application/json",
+):
+    """``asgi_get`` as a coroutine, to run requests side by side."""
+    from django.core.handlers.asgi import ASGIHandler
+
+    headers = [(b"host", b"testserver"), (b"authorization", f"Bearer {token}".encode())]
+    if body:
+        headers += [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+        ]
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string,
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    sent = {"status": None, "bodies": []}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sent["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            if on_body is not None:
+                on_body(message)
+            sent["bodies"].append(message)
+
+    await ASGIHandler()(scope, receive, send)
+    return sent["status"], sent["bodies"]
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AsgiStreamingTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user1 = CustomUser.objects.create_user(
+            email="astream1@chat.com", password="pw1"
+        )
+        user2 = CustomUser.objects.create_user(
+            email="astream2@chat.com", password="pw2"
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user1, user2)
+        for i in range(25):
+            Message.objects.create(
+                conversation=self.conversation, sender=self.user1, content=f"m{i}"
+            )
+        self.token = str(AccessToken.for_user(self.user1))
+
+    def test_history_is_sent_before_it_is_all_serialized(self):
+        encode = JSONEncoder.encode
+        encoded = []
+        encoded_at_first_body = []
+
+        def counting_encode(encoder, obj):
+            encoded.append(obj)
+            return encode(encoder, obj)
+
+        def on_body(message):
+            if not encoded_at_first_body:
+                encoded_at_first_body.append(len(encoded))
+
+        with mock.patch.object(
+            StreamingListMixin, "stream_buffer_size", 1
+        ), mock.patch.object(JSONEncoder, "encode", counting_encode):
+            status, bodies = asgi_get(
+                reverse(
+                    "conversation-messages-list-create", args=[self.conversation.id]
+                ),
+                self.token,
+                b"stream=true",
+                on_body,
+            )
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            len(json.loads(b"".join(body.get("body", b"") for body in bodies))), 25
+        )
+        self.assertEqual(len(encoded), 25)
+        self.assertLess(encoded_at_first_body[0], 25)
+        self.assertGreater(len(bodies), 25)
+
+    def test_export_is_sent_before_it_is_all_read(self):
+        message_record = export.message_record
+        exported = []
+        exported_at_first_body = []
+
+        def counting_record(message):
+            exported.append(message.id)
+            return message_record(message)
+
+        def on_body(message):
+            if not exported_at_first_body:
+                exported_at_first_body.append(len(exported))
+
+        url = reverse("conversation-export", args=[self.conversation.id])
+        with mock.patch.object(export, "EXPORT_FLUSH_SIZE", 1), mock.patch.object(
+            export, "message_record", counting_record
+        ):
+            status, bodies = asgi_get(url, self.token, on_body=on_body)
+        self.assertEqual(status, 200)
+        plain = b"".join(body.get("body", b"") for body in bodies)
+        self.assertEqual(len(plain.splitlines()), 26)
+        self.assertLess(exported_at_first_body[0], 25)
+
+        status, bodies = asgi_get(url, self.token, b"compress=gzip")
+        self.assertEqual(
+            gzip.decompress(b"".join(body.get("body", b"") for body in bodies)), plain
+        )
+
+
+class ConversationExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="export1@chat.com", password="pw1", username="export1"
+        )
+        cls.user2 = CustomUser.objects.create_user(
+            email="export2@chat.com", password="pw2", username="export2"
+        )
+        cls.conversation = Conversation.objects.create()
+        cls.conversation.participants.add(cls.user1, cls.user2)
+        first = Message.objects.create(
+            conversation=cls.conversation, sender=cls.user1, content="first"
+        )
+        Message.objects.create(
+            conversation=cls.conversation,
+            sender=cls.user2,
+            image="message_images/a.png",
+            reply_to_message=first,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+        self.url = reverse("conversation-export", args=[self.conversation.id])
+
+    def read_lines(self, data):
+        return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+    def test_export_streams_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        header, first, second = self.read_lines(b"".join(response.streaming_content))
+        self.assertEqual(header["type"], "conversation")
+        self.assertEqual(
+            [p["email"] for p in header["participants"]],
+            ["export1@chat.com", "export2@chat.com"],
+        )
+        self.assertEqual((first["sequence"], first["content"]), (1, "first"))
+        self.assertEqual(second["image"], "message_images/a.png")
+        self.assertEqual(second["image_url"], "/media/message_images/a.png")
+        self.assertEqual(second["reply_to_message_id"], first["id"])
+
+    def test_gzip_export_matches_plain_export(self):
+        plain = b"".join(self.client.get(self.url).streaming_content)
+        response = self.client.get(self.url, {"compress": "gzip"})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), plain)
+
+    def test_export_requires_participation(self):
+        outsider = CustomUser.objects.create_user(
+            email="export3@chat.com", password="pw3"
+        )
+        self.client.force_authenticate(outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_management_command_writes_gzip_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/export.ndjson.gz"
+            call_command(
+                "export_conversations",
+                "--all",
+                "--gzip",
+                "-o",
+                path,
+                stderr=io.StringIO(),
+            )
+            with gzip.open(path, "rb") as exported:
+                records = self.read_lines(exported.read())
+        self.assertEqual(
+            [r["type"] for r in records], ["conversation", "message", "message"]
+        )
+
+
+class ImportMessagesCommandTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="import1@chat.com", password="pw1"
+        )
+        cls.user2 = CustomUser.objects.create_user(
+            email="import2@chat.com", password="pw2"
+        )
+        with freeze_time("2023-05-01 12:00:00"):
+            cls.source = Conversation.objects.create()
+            cls.source.participants.add(cls.user1, cls.user2)
+            first = Message.objects.create(
+                conversation=cls.source, sender=cls.user1, content="first\tline\nnext"
+            )
+        with freeze_time("2023-05-02 12:00:00"):
+            Message.objects.create(
+                conversation=cls.source,
+                sender=cls.user2,
+                content="reply",
+                reply_to_message=first,
+            )
+
+    def export_then_import(self, *extra_args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/export.ndjson.gz"
+            call_command(
+                "export_conversations",
+                str(self.source.id),
+                "--gzip",
+                "-o",
+                path,
+                stderr=io.StringIO(),
+            )
+            call_command(
+                "import_messages",
+                path,
+                *extra_args,
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+        return Conversation.objects.exclude(id=self.source.id).get()
+
+    def test_round_trip_preserves_history(self):
+        imported = self.export_then_import("--batch-size", "1")
+        self.assertEqual(set(imported.participants.all()), {self.user1, self.user2})
+        first, reply = imported.messages.order_by("sequence")
+        self.assertEqual((first.sequence, reply.sequence), (1, 2))
+        self.assertEqual(first.content, "first\tline\nnext")
+        self.assertEqual(reply.reply_to_message, first)
+        self.assertEqual(first.timestamp.isoformat(), "2023-05-01T12:00:00+00:00")
+        self.assertEqual(imported.last_sequence, 2)
+        self.assertEqual((imported.message_count, imported.participant_count), (2, 2))
+        self.assertEqual(imported.updated_at, reply.timestamp)
+
+        # New messages continue the imported sequence.
+        self.assertEqual(
+            Message.objects.create(conversation=imported, sender=self.user1).sequence, 3
+        )
+
+    def test_unknown_senders_are_skipped_or_created(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/export.ndjson"
+            call_command(
+                "export_conversations",
+                str(self.source.id),
+                "-o",
+                path,
+                stderr=io.StringIO(),
+            )
+            Path(path).write_text(
+                Path(path).read_text().replace("import2@chat.com", "new@chat.com")
+            )
+
+            call_command(
+                "import_messages", path, stdout=io.StringIO(), stderr=io.StringIO()
+            )
+            self.assertEqual(
+                Message.objects.exclude(conversation=self.source).count(), 1
+            )
+
+            call_command(
+                "import_messages",
+                path,
+                "--create-missing-users",
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+        newcomer = CustomUser.objects.get(email="new@chat.com")
+        self.assertFalse(newcomer.is_active)
+        self.assertEqual(Message.objects.filter(sender=newcomer).count(), 1)
+
+    def test_existing_users_match_regardless_of_case(self):
+        alice = CustomUser.objects.create_user(email="Alice@Example.com", password="pw")
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/export.ndjson"
+            call_command(
+                "export_conversations",
+                str(self.source.id),
+                "-o",
+                path,
+                stderr=io.StringIO(),
+            )
+            Path(path).write_text(
+                Path(path).read_text().replace("import2@chat.com", "alice@example.com")
+            )
+            out = io.StringIO()
+            call_command(
+                "import_messages",
+                path,
+                "--create-missing-users",
+                stdout=out,
+                stderr=io.StringIO(),
+            )
+        self.assertIn("skipped 0", out.getvalue())
+        imported = Conversation.objects.exclude(id=self.source.id).get()
+        self.assertEqual(set(imported.participants.all()), {self.user1, alice})
+        self.assertEqual(Message.objects.filter(sender=alice).count(), 1)
+        self.assertFalse(CustomUser.objects.filter(email="alice@example.com").exists())
+
+
+class MessagePartitionTests(TestCase):
+
+    def test_month_helpers(self):
+        month = partitions.month_start(datetime.datetime(2024, 11, 17, 8, 30))
+        self.assertEqual(month, datetime.date(2024, 11, 1))
+        self.assertEqual(partitions.add_months(month, 2), datetime.date(2025, 1, 1))
+        self.assertEqual(partitions.add_months(month, -11), datetime.date(2023, 12, 1))
+        self.assertEqual(partitions.partition_name(month), "chat_message_p202411")
+        self.assertEqual(partitions.partition_month("chat_message_p202411"), month)
+        self.assertIsNone(partitions.partition_month("chat_message_default"))
+
+    @skipUnless(
+        connection.vendor != "postgresql", "chat_message is partitioned on PostgreSQL"
+    )
+    def test_command_requires_partitioned_table(self):
+        with self.assertRaises(CommandError):
+            call_command("manage_message_partitions", stdout=io.StringIO())
+
+    def test_detaching_asks_for_confirmation(self):
+        current = partitions.month_start(timezone.now())
+        attached = {
+            partitions.partition_name(partitions.add_months(current, offset)): (
+                partitions.add_months(current, offset),
+                "",
+            )
+            for offset in range(-14, 4)
+        }
+        command = "chat.management.commands.manage_message_partitions"
+        out = io.StringIO()
+        with mock.patch(f"{command}.is_partitioned", return_value=True), mock.patch(
+            f"{command}.attached_partitions", return_value=attached
+        ), mock.patch("builtins.input", return_value="no") as prompt:
+            with self.assertRaisesMessage(CommandError, "Detaching cancelled."):
+                call_command(
+                    "manage_message_partitions",
+                    "--archive-older-than",
+                    "12",
+                    "--detach",
+                    stdout=out,
+                )
+        prompt.assert_called_once()
+        detached = [
+            partitions.partition_name(partitions.add_months(current, -offset))
+            for offset in (14, 13)
+        ]
+        self.assertIn(
+            f"Detaching {', '.join(detached)} removes their messages", out.getvalue()
+        )
+        self.assertNotIn("ALTER TABLE", out.getvalue())
+
+
+@skipUnless(
+    connection.vendor == "postgresql", "chat_message is only partitioned on PostgreSQL"
+)
+class PostgresMessagePartitionTests(TransactionTestCase):
+    """Run with TEST_DATABASE_URL pointing at a PostgreSQL server."""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="part1@chat.com", password="pw1"
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.month = partitions.month_start(timezone.now())
+
+    def execute(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def fetch(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] if len(row) == 1 else row for row in cursor.fetchall()]
+
+    def message_in_month(self, month):
+        message = Message.objects.create(
+            conversation=self.conversation, sender=self.user, content=f"{month:%Y-%m}"
+        )
+        # Updating the partition key moves the row to that month's partition.
+        Message.objects.filter(pk=message.pk).update(
+            timestamp=datetime.datetime(
+                month.year, month.month, 15, tzinfo=datetime.timezone.utc
+            )
+        )
+        return message
+
+    def partition_of(self, message):
+        return self.fetch(
+            f'SELECT tableoid::regclass::text FROM "{partitions.MESSAGE_TABLE}" WHERE id = %s',
+            [message.pk],
+        )[0]
+
+    def test_migrated_table_is_partitioned_by_month(self):
+        self.assertTrue(partitions.is_partitioned(connection))
+        primary_key = self.fetch(
+            """
+            SELECT a.attname FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = to_regclass(%s) AND i.indisprimary
+            """,
+            [partitions.MESSAGE_TABLE],
+        )
+        self.assertEqual(set(primary_key), {"id", "timestamp"})
+        with connection.cursor() as cursor:
+            attached = partitions.attached_partitions(cursor)
+        for offset in range(4):
+            self.assertIn(
+                partitions.partition_name(partitions.add_months(self.month, offset)),
+                attached,
+            )
+        message = Message.objects.create(
+            conversation=self.conversation, sender=self.user, content="now"
+        )
+        self.assertEqual(
+            self.partition_of(message), partitions.partition_name(self.month)
+        )
+
+    def test_command_creates_upcoming_partitions(self):
+        upcoming = [
+            partitions.partition_name(partitions.add_months(self.month, offset))
+            for offset in (4, 5)
+        ]
+        out = io.StringIO()
+        call_command(
+            "manage_message_partitions", "--ahead", "5", "--dry-run", stdout=out
+        )
+        with connection.cursor() as cursor:
+            self.assertFalse(
+                set(upcoming) & set(partitions.attached_partitions(cursor))
+            )
+        self.assertIn(f"Creating {upcoming[-1]}", out.getvalue())
+
+        call_command("manage_message_partitions", "--ahead", "5", stdout=io.StringIO())
+        with connection.cursor() as cursor:
+            self.assertTrue(
+                set(upcoming) <= set(partitions.attached_partitions(cursor))
+            )
+
+    def test_rows_in_the_default_partition_move_to_their_new_month(self):
+        month = partitions.add_months(self.month, 10)
+        message = self.message_in_month(month)
+        self.assertEqual(self.partition_of(message), partitions.DEFAULT_PARTITION)
+
+        call_command("manage_message_partitions", "--ahead", "10", stdout=io.StringIO())
+        self.assertEqual(self.partition_of(message), partitions.partition_name(month))
+        self.assertEqual(Message.objects.get(pk=message.pk).content, f"{month:%Y-%m}")
+
+    def test_old_partitions_are_detached(self):
+        month = partitions.add_months(self.month, -14)
+        name = partitions.partition_name(month)
+        with connection.cursor() as cursor:
+            partitions.create_month_partition(cursor, month)
+        # Once detached, the flush between tests no longer reaches it.
+        self.addCleanup(self.execute, f'DROP TABLE IF EXISTS "{name}"')
+        old = self.message_in_month(month)
+        recent = Message.objects.create(
+            conversation=self.conversation, sender=self.user, content="kept"
+        )
+
+        with mock.patch("builtins.input", return_value="no"):
+            with self.assertRaises(CommandError):
+                call_command(
+                    "manage_message_partitions",
+                    "--archive-older-than",
+                    "12",
+                    "--detach",
+                    stdout=io.StringIO(),
+                )
+        self.assertTrue(Message.objects.filter(pk=old.pk).exists())
+
+        out = io.StringIO()
+        call_command(
+            "manage_message_partitions",
+            "--archive-older-than",
+            "12",
+            "--detach",
+            "--no-input",
+            stdout=out,
+        )
+        with connection.cursor() as cursor:
+            self.assertNotIn(name, partitions.attached_partitions(cursor))
+        self.assertFalse(Message.objects.filter(pk=old.pk).exists())
+        self.assertTrue(Message.objects.filter(pk=recent.pk).exists())
+        self.assertEqual(self.fetch(f'SELECT COUNT(*) FROM "{name}"'), [1])
+
+        # The printed statement puts the month back.
+        restore = next(
+            line
+            for line in out.getvalue().splitlines()
+            if line.startswith("To restore it: ")
+        )
+        self.execute(restore.removeprefix("To restore it: "))
+        self.assertTrue(Message.objects.filter(pk=old.pk).exists())
+
+    def test_foreign_keys_to_messages_still_work(self):
+        # Nothing can reference (id, timestamp) by id alone, so no database
+        # constraint points at chat_message; its own foreign keys remain.
+        self.assertEqual(
+            self.fetch(
+                "SELECT conname FROM pg_constraint WHERE contype = 'f' AND confrelid = to_regclass(%s)",
+                [partitions.MESSAGE_TABLE],
+            ),
+            [],
+        )
+        referenced = self.fetch(
+            """
+            SELECT confrelid::regclass::text FROM pg_constraint
+            WHERE contype = 'f' AND conrelid = to_regclass(%s)
+            """,
+            [partitions.MESSAGE_TABLE],
+        )
+        self.assertEqual(
+            set(referenced), {"chat_conversation", CustomUser._meta.db_table}
+        )
+
+        original = Message.objects.create(
+            conversation=self.conversation, sender=self.user, content="original"
+        )
+        reply = Message.objects.create(
+            conversation=self.conversation,
+            sender=self.user,
+            content="reply",
+            reply_to_message=original,
+        )
+        MessageChange.record(original, MessageChange.EDITED)
+        session = UploadSession.objects.create(
+            conversation=self.conversation,
+            uploader=self.user,
+            filename="a.png",
+            total_size=1,
+            message=original,
+        )
+        self.assertEqual(
+            Message.objects.select_related("reply_to_message")
+            .get(pk=reply.pk)
+            .reply_to_message.content,
+            "original",
+        )
+        self.assertEqual(
+            MessageChange.objects.get(message=original).message_id, original.pk
+        )
+        self.assertEqual(UploadSession.objects.get(message=original).pk, session.pk)
+
+        # on_delete is applied by the ORM.
+        original.delete()
+        reply.refresh_from_db()
+        session.refresh_from_db()
+        self.assertIsNone(reply.reply_to_message_id)
+        self.assertIsNone(session.message_id)
+        self.assertFalse(MessageChange.objects.filter(message_id=original.pk).exists())
+
+
+@override_settings(
+    DATABASE_REPLICAS=["replica"],
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class ReplicaRoutingTests(TransactionTestCase):
+    # Not TestCase: reads inside an open transaction deliberately stay on the primary.
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email="replica@chat.com", password="pw"
+        )
+        self.factory = RequestFactory()
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(self.user)}"}
+
+    def routed_db(self, request, status_code=200):
+        seen = {}
+
+        def view(request):
+            seen["db"] = ReplicaRouter().db_for_read(Message)
+            return HttpResponse(status=status_code)
+
+        ReplicaRoutingMiddleware(view)(request)
+        return seen["db"]
+
+    def test_safe_api_reads_use_replica(self):
+        self.assertEqual(
+            self.routed_db(self.factory.get("/api/chat/conversations/", **self.auth)),
+            "replica",
+        )
+        self.assertEqual(self.routed_db(self.factory.get("/admin/")), "default")
+        self.assertEqual(ReplicaRouter().db_for_read(Message), "default")
+
+    def test_user_is_pinned_to_primary_after_a_write(self):
+        request = self.factory.post("/api/chat/conversations/", **self.auth)
+        request.user = self.user
+        self.routed_db(request, status_code=201)
+
+        self.assertEqual(
+            self.routed_db(self.factory.get("/api/users/", **self.auth)), "default"
+        )
+        other = CustomUser.objects.create_user(email="replica2@chat.com", password="pw")
+        other_auth = {"HTTP_AUTHORIZATION": f"Bearer {AccessToken.for_user(other)}"}
+        self.assertEqual(
+            self.routed_db(self.factory.get("/api/users/", **other_auth)), "replica"
+        )
+
+    def test_failed_write_does_not_pin(self):
+        request = self.factory.post("/api/chat/conversations/", **self.auth)
+        request.user = self.user
+        self.routed_db(request, status_code=400)
+        self.assertEqual(
+            self.routed_db(self.factory.get("/api/users/", **self.auth)), "replica"
+        )
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.autocommit = True
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql):
+                if connection.closed:
+                    raise RuntimeError("connection closed")
+
+        return Cursor()
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def test_connections_are_reused_and_bounded(self):
+        pool = ConnectionPool(max_size=2, timeout=0.05)
+        first = pool.acquire(FakeConnection)
+        second = pool.acquire(FakeConnection)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(FakeConnection)
+
+        pool.release(first)
+        self.assertIs(pool.acquire(FakeConnection), first)
+        self.assertEqual(first.rollbacks, 1)
+        stats = pool.stats()
+        self.assertEqual(
+            (stats["size"], stats["in_use"], stats["timeouts_total"]), (2, 2, 1)
+        )
+        self.assertEqual(stats["waits_total"], 1)
+        pool.release(second)
+
+    def test_waiter_gets_released_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=5)
+        held = pool.acquire(FakeConnection)
+        threading.Timer(0.05, pool.release, [held]).start()
+        self.assertIs(pool.acquire(FakeConnection), held)
+        self.assertGreater(pool.stats()["wait_seconds_max"], 0)
+
+    def test_broken_connections_are_replaced(self):
+        pool = ConnectionPool(max_size=1, check_interval=0)
+        broken = pool.acquire(FakeConnection)
+        pool.release(broken)
+        broken.closed = True
+
+        replacement = pool.acquire(FakeConnection)
+        self.assertIsNot(replacement, broken)
+        self.assertEqual(pool.stats()["discarded_total"], 1)
+
+    def test_released_connections_count_towards_size_while_reset(self):
+        pool = ConnectionPool(max_size=2, timeout=5)
+        lock = threading.Lock()
+        open_connections = peak = 0
+
+        class SlowResetConnection(FakeConnection):
+            def __init__(self):
+                nonlocal open_connections, peak
+                super().__init__()
+                with lock:
+                    open_connections += 1
+                    peak = max(peak, open_connections)
+
+            def rollback(self):
+                super().rollback()
+                time.sleep(0.002)
+
+            def close(self):
+                nonlocal open_connections
+                super().close()
+                with lock:
+                    open_connections -= 1
+
+        sizes = []
+
+        def worker():
+            for _ in range(20):
+                connection = pool.acquire(SlowResetConnection)
+                sizes.append(pool.size)
+                pool.release(connection)
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(peak, 2)
+        self.assertLessEqual(max(sizes), 2)
+        self.assertLessEqual(pool.stats()["size"], 2)
+
+
+class LoadTestHarnessTests(TransactionTestCase):
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 0.5), 0.0)
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 0.5), 3)
+        self.assertEqual(percentile(range(1, 101), 0.99), 99)
+
+    def test_in_process_run_reports_broadcast_latency(self):
+        out = io.StringIO()
+        call_command(
+            "loadtest_ws",
+            "--clients",
+            "4",
+            "--conversation-size",
+            "2",
+            "--duration",
+            "0.5",
+            "--message-interval",
+            "0.1",
+            "--json",
+            stdout=out,
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["connect_failures"], 0)
+        self.assertGreater(report["messages_sent"], 0)
+        # Every message reaches both sockets of its two-person conversation.
+        self.assertEqual(report["deliveries"], 2 * report["messages_sent"])
+        self.assertGreater(report["latency_p99_ms"], 0)
+        self.assertIsNotNone(report["memory_per_connection_kb"])
+        self.assertFalse(
+            CustomUser.objects.filter(email__endswith="@loadtest.invalid").exists()
+        )
+
+
+class SeedChatCommandTests(TempMediaMixin, TestCase):
+
+    def test_seeds_consistent_dataset(self):
+        call_command(
+            "seed_chat",
+            "--users",
+            "30",
+            "--conversations",
+            "20",
+            "--messages",
+            "500",
+            "--reply-ratio",
+            "0.3",
+            "--image-ratio",
+            "0.2",
+            "--batch-size",
+            "100",
+            "--seed",
+            "7",
+            stdout=io.StringIO(),
+            stderr=io.StringIO(),
+        )
+        self.assertEqual(
+            CustomUser.objects.filter(email__endswith="@seed.local").count(), 30
+        )
+        self.assertFalse(CustomUser.objects.filter(profile__isnull=True).exists())
+        self.assertEqual(Message.objects.count(), 500)
+
+        for conversation in Conversation.objects.all():
+            sequences = list(
+                conversation.messages.order_by("sequence").values_list(
+                    "sequence", flat=True
+                )
+            )
+            self.assertEqual(sequences, list(range(1, len(sequences) + 1)))
+            self.assertEqual(conversation.last_sequence, len(sequences))
+            self.assertEqual(conversation.message_count, len(sequences))
+            self.assertEqual(
+                conversation.participant_count, conversation.participants.count()
+            )
+            self.assertGreaterEqual(conversation.participant_count, 2)
+
+        replies = Message.objects.filter(reply_to_message__isnull=False).select_related(
+            "reply_to_message"
+        )
+        self.assertTrue(replies.exists())
+        for reply in replies:
+            self.assertEqual(
+                reply.reply_to_message.conversation_id, reply.conversation_id
+            )
+            self.assertLess(reply.reply_to_message.sequence, reply.sequence)
+
+        with_image = Message.objects.exclude(image="").exclude(image=None).first()
+        self.assertTrue(Path(self.media_dir, with_image.image.name).exists())
+        # New messages continue after the explicitly assigned ids.
+        conversation = Conversation.objects.first()
+        Message.objects.create(
+            conversation=conversation, sender=conversation.participants.first()
+        )
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class EndpointQueryBudgetTests(TestCase):
+    """Query counts must not grow with the number of rows an endpoint returns."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_dir = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_dir)
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_dir, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "seed_chat",
+            "--users",
+            "12",
+            "--conversations",
+            "25",
+            "--messages",
+            "600",
+            "--group-ratio",
+            "0.4",
+            "--reply-ratio",
+            "0.4",
+            "--image-ratio",
+            "0",
+            "--days",
+            "1",
+            "--seed",
+            "3",
+            stdout=io.StringIO(),
+            stderr=io.StringIO(),
+        )
+        cls.user = (
+            CustomUser.objects.annotate(conversation_total=Count("conversations"))
+            .order_by("-conversation_total")
+            .first()
+        )
+        for message in Message.objects.filter(conversation__participants=cls.user)[:20]:
+            MessageChange.record(message, MessageChange.EDITED)
+
+    def test_endpoints_stay_within_query_budget(self):
+        client = APIClient()
+        # A real token, as the async views authenticate it themselves.
+        client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}"
+        )
+        context = benchmarks.build_context(self.user)
+
+        for endpoint in benchmarks.ENDPOINTS:
+            with self.subTest(endpoint=endpoint.name):
+                self.assertTrue(
+                    all(context.get(key) is not None for key in endpoint.requires)
+                )
+                result = benchmarks.run_endpoint(
+                    client, endpoint, context, iterations=1
+                )
+                self.assertLess(result["status"], 400)
+                self.assertLessEqual(result["queries"], endpoint.budget)
+
+    def test_every_api_url_is_benchmarked(self):
+        context = {
+            "conversation_id": 1,
+            "other_user_id": 1,
+            "own_message_id": 1,
+            "since_token": "",
+            "tail_sequence": 0,
+        }
+        benchmarked = {
+            resolve(endpoint.url(context).split("?")[0]).url_name
+            for endpoint in benchmarks.ENDPOINTS
+        }
+        api_url_names = {
+            pattern.name
+            for resolver in get_resolver().url_patterns
+            if str(resolver.pattern).startswith("api/")
+            for pattern in resolver.url_patterns
+            if pattern.name
+        }
+        self.assertEqual(api_url_names - benchmarks.UNBENCHMARKED - benchmarked, set())
+
+    def test_baseline_comparison_flags_regressions(self):
+        baseline = {
+            "results": [{"name": "auth-check", "queries": 2, "latency_ms_p50": 10.0}]
+        }
+        same = [{"name": "auth-check", "queries": 2, "latency_ms_p50": 12.0}]
+        worse = [{"name": "auth-check", "queries": 3, "latency_ms_p50": 20.0}]
+        self.assertEqual(benchmarks.compare_to_baseline(same, baseline), [])
+        self.assertEqual(len(benchmarks.compare_to_baseline(worse, baseline)), 2)
+
+
+INSTRUMENTED_CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "chat.layers.InstrumentedChannelLayer",
+        "CONFIG": IN_MEMORY_CHANNEL_LAYERS["default"],
+    }
+}
+
+
+def sample(metric, **labels):
+    return metric.samples().get(
+        tuple(str(labels[name]) for name in metric.labelnames), 0
+    )
+
+
+class MetricsRegistryTests(SimpleTestCase):
+
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = metrics.Registry()
+        latency = registry.histogram(
+            "test_latency_seconds", "Latency.", ["view"], buckets=(0.1, 1)
+        )
+        for value in (0.05, 0.5, 5):
+            latency.observe(value, view="a")
+
+        text = metrics.render(metrics.merge_snapshots([registry.snapshot()]))
+        self.assertIn('test_latency_seconds_bucket{view="a",le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{view="a",le="1"} 2', text)
+        self.assertIn('test_latency_seconds_bucket{view="a",le="+Inf"} 3', text)
+        self.assertIn('test_latency_seconds_count{view="a"} 3', text)
+
+    def test_snapshots_of_other_workers_are_added_up(self):
+        registry = metrics.Registry()
+        requests = registry.counter("test_requests_total", "Requests.", ["status"])
+        requests.inc(status=200)
+        other_worker = registry.snapshot()
+        requests.inc(2, status=200)
+        requests.inc(status=500)
+
+        merged = metrics.merge_snapshots([registry.snapshot(), other_worker])
+        self.assertEqual(merged["test_requests_total"]["samples"][("200",)], 4)
+        self.assertEqual(merged["test_requests_total"]["samples"][("500",)], 1)
+
+    def test_stale_and_own_snapshots_are_skipped(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        metrics.write_snapshot(directory)
+        for pid, age in ((1, 0), (2, 3600)):
+            path = Path(directory, f"metrics-{pid}.json")
+            path.write_text(json.dumps({}))
+            stale = time.time() - age
+            os.utime(path, (stale, stale))
+
+        self.assertEqual(len(metrics.read_snapshots(directory, max_age=60)), 1)
+
+
+@override_settings(CHANNEL_LAYERS=INSTRUMENTED_CHANNEL_LAYERS, METRICS_TOKEN=None)
+class MetricsInstrumentationTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="metrics@chat.com", password="pw", username="metrics"
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        event_buffer._event_buffer = event_buffer.InMemoryEventBuffer(size=10)
+
+    def tearDown(self):
+        event_buffer._event_buffer = None
+
+    def test_http_requests_are_counted_and_exposed(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        before = sample(
+            metrics.HTTP_REQUESTS,
+            method="GET",
+            view="conversation-list-create",
+            status=200,
+        )
+        client.get(reverse("conversation-list-create"))
+
+        self.assertEqual(
+            sample(
+                metrics.HTTP_REQUESTS,
+                method="GET",
+                view="conversation-list-create",
+                status=200,
+            ),
+            before + 1,
+        )
+        with self.settings(DEBUG=True):
+            response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'chat_http_requests_total{method="GET",view="conversation-list-create",status="200"}',
+            response.content.decode(),
+        )
+
+    @override_settings(METRICS_TOKEN="scrape")
+    def test_metrics_token_is_required_when_set(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape")
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_need_staff_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        CustomUser.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    def test_full_channels_are_counted_apart_from_errors(self):
+        class StricterChannelFull(ChannelFull):
+            pass
+
+        layer = InstrumentedChannelLayer("channels.layers.InMemoryChannelLayer")
+        full_before = sample(
+            metrics.CHANNEL_LAYER_OPERATIONS, operation="send", outcome="full"
+        )
+        with mock.patch.object(layer.layer, "send", side_effect=StricterChannelFull):
+            with self.assertRaises(ChannelFull):
+                async_to_sync(layer.send)("test.channel", {"type": "test"})
+        self.assertEqual(
+            sample(metrics.CHANNEL_LAYER_OPERATIONS, operation="send", outcome="full"),
+            full_before + 1,
+        )
+
+    def test_websocket_consumer_is_instrumented(self):
+        open_before = sample(metrics.WEBSOCKET_CONNECTIONS, consumer="chat")
+        created_before = sample(metrics.MESSAGES_CREATED, source="websocket")
+        group_sends_before = sample(
+            metrics.CHANNEL_LAYER_OPERATIONS, operation="group_send", outcome="ok"
+        )
+        db_calls_before = metrics.DB_THREAD_WAIT_SECONDS.samples().get((), [[], 0, 0])[
+            2
+        ]
+
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f"/ws/chat/{self.conversation.id}/"
+            )
+            communicator.scope["user"] = self.user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            open_during = sample(metrics.WEBSOCKET_CONNECTIONS, consumer="chat")
+            await communicator.send_json_to(
+                {
+                    "type": "chat_message_new",
+                    "conversation_id": self.conversation.id,
+                    "content": "counted",
+                }
+            )
+            await communicator.receive_json_from()
+            await communicator.disconnect()
+            return open_during
+
+        self.assertEqual(async_to_sync(scenario)(), open_before + 1)
+        self.assertEqual(
+            sample(metrics.WEBSOCKET_CONNECTIONS, consumer="chat"), open_before
+        )
+        self.assertEqual(
+            sample(metrics.MESSAGES_CREATED, source="websocket"), created_before + 1
+        )
+        self.assertGreater(
+            sample(
+                metrics.CHANNEL_LAYER_OPERATIONS, operation="group_send", outcome="ok"
+            ),
+            group_sends_before,
+        )
+        self.assertGreater(
+            metrics.DB_THREAD_WAIT_SECONDS.samples()[()][2], db_calls_before
+        )
+        self.assertEqual(metrics.DB_THREAD_QUEUE_DEPTH.samples()[()], 0)
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    QUERY_PROFILER_SAMPLE_RATE=1.0,
+    QUERY_PROFILER_DUPLICATE_THRESHOLD=5,
+    QUERY_PROFILER_MAX_QUERIES=30,
+)
+class QueryProfilerTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="profiled@chat.com", password="pw", username="profiled"
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        event_buffer._event_buffer = event_buffer.InMemoryEventBuffer(size=10)
+
+    def tearDown(self):
+        event_buffer._event_buffer = None
+
+    def test_fingerprint_collapses_literals_and_value_lists(self):
+        self.assertEqual(
+            query_profiler.fingerprint(
+                "SELECT * FROM t WHERE id IN (%s, %s,  %s) AND name = 'x'"
+            ),
+            "SELECT * FROM t WHERE id IN (?) AND name = ?",
+        )
+        self.assertEqual(
+            query_profiler.fingerprint("SELECT * FROM chat_message_p202401 LIMIT 21"),
+            "SELECT * FROM chat_message_p202401 LIMIT ?",
+        )
+
+    def test_repeated_queries_are_logged(self):
+        with self.assertLogs("src.query_profiler", "WARNING") as logs:
+            with query_profiler.query_profile("loop") as profile:
+                for message_id in range(6):
+                    list(Message.objects.filter(id=message_id))
+        self.assertEqual(profile.count, 6)
+        self.assertEqual(profile.duplicates()[0][1], 6)
+        self.assertIn("Query profile loop: 6 queries", logs.output[0])
+
+    def test_unsampled_work_is_not_profiled(self):
+        with query_profiler.query_profile("skipped", sample_rate=0) as profile:
+            list(Message.objects.all())
+        self.assertIsNone(profile)
+
+    def test_request_within_limits_is_not_logged(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        with self.assertNoLogs("src.query_profiler", "WARNING"):
+            response = client.get(reverse("conversation-list-create"))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(QUERY_PROFILER_MAX_QUERIES=0)
+    def test_consumer_event_collects_queries_from_db_thread(self):
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f"/ws/chat/{self.conversation.id}/"
+            )
+            communicator.scope["user"] = self.user
+            await communicator.connect()
+            await communicator.send_json_to(
+                {
+                    "type": "chat_message_new",
+                    "conversation_id": self.conversation.id,
+                    "content": "profiled",
+                }
+            )
+            await communicator.receive_json_from()
+            await communicator.disconnect()
+
+        with self.assertLogs("src.query_profiler", "WARNING") as logs:
+            async_to_sync(scenario)()
+        self.assertTrue(
+            any(
+                "Query profile ws chat chat_message_new:" in line
+                for line in logs.output
+            )
+        )
+
+
+@override_settings(
+    CHANNEL_LAYERS=INSTRUMENTED_CHANNEL_LAYERS,
+    TRACING_SAMPLE_RATE=1.0,
+    QUERY_PROFILER_SAMPLE_RATE=0,
+)
+class TracingTests(TransactionTestCase):
+
+    def setUp(self):
+        self.exporter = tracing.MemoryExporter()
+        tracing.set_exporter(self.exporter)
+        self.sender = CustomUser.objects.create_user(
+            email="tracer@chat.com", password="pw", username="tracer"
+        )
+        self.recipient = CustomUser.objects.create_user(
+            email="traced@chat.com", password="pw", username="traced"
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.sender, self.recipient)
+        event_buffer._event_buffer = event_buffer.InMemoryEventBuffer(size=10)
+
+    def tearDown(self):
+        tracing.set_exporter(None)
+        event_buffer._event_buffer = None
+
+    def spans_by_name(self):
+        return {span["name"]: span for span in self.exporter.spans}
+
+    def test_unsampled_trace_records_nothing(self):
+        with override_settings(TRACING_SAMPLE_RATE=0):
+            with tracing.start_trace("root") as root:
+                with tracing.span("child") as child:
+                    event = tracing.inject({"type": "x"})
+        self.assertIsNone(root)
+        self.assertIsNone(child)
+        self.assertNotIn("trace", event)
+        self.assertEqual(self.exporter.spans, [])
+
+    def test_child_spans_and_injected_context_share_the_trace(self):
+        with tracing.start_trace("root") as root:
+            with tracing.span("child"):
+                event = tracing.inject({"type": "x"})
+        with tracing.start_trace("deliver", parent=event["trace"]):
+            pass
+
+        spans = self.spans_by_name()
+        self.assertEqual({span["traceId"] for span in spans.values()}, {root.trace_id})
+        self.assertEqual(spans["child"]["parentId"], spans["root"]["id"])
+        self.assertEqual(spans["deliver"]["parentId"], spans["child"]["id"])
+        self.assertIn("queued_ms", spans["deliver"]["tags"])
+
+    def test_websocket_message_is_traced_to_the_recipient(self):
+        async def connect(user):
+            communicator = WebsocketCommunicator(
+                JWTAuthMiddleware(URLRouter(websocket_urlpatterns)),
+                f"/ws/chat/{self.conversation.id}/?token={AccessToken.for_user(user)}",
+            )
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            return communicator
+
+        async def scenario():
+            sender = await connect(self.sender)
+            recipient = await connect(self.recipient)
+            await sender.send_json_to(
+                {
+                    "type": "chat_message_new",
+                    "conversation_id": self.conversation.id,
+                    "content": "traced",
+                }
+            )
+            received = await recipient.receive_json_from()
+            await sender.receive_json_from()
+            await sender.disconnect()
+            await recipient.disconnect()
+            return received
+
+        received = async_to_sync(scenario)()
+        self.assertEqual(received["message"]["content"], "traced")
+
+        auth = next(span for span in self.exporter.spans if span["name"] == "ws.auth")
+        self.assertEqual(auth["tags"]["authenticated"], "True")
+        receive = next(
+            span for span in self.exporter.spans if span["name"] == "ws.receive"
+        )
+        self.assertEqual(receive["tags"]["event_type"], "chat_message_new")
+        in_trace = [
+            span
+            for span in self.exporter.spans
+            if span["traceId"] == receive["traceId"]
+        ]
+        names = {span["name"] for span in in_trace}
+        self.assertTrue(
+            {
+                "db.save_message_to_db",
+                "db.serialize_db_message",
+                "channel_layer.group_send",
+            }
+            <= names
+        )
+        group_send = next(
+            span for span in in_trace if span["name"] == "channel_layer.group_send"
+        )
+        deliveries = [span for span in in_trace if span["name"] == "ws.deliver"]
+        self.assertEqual(len(deliveries), 2)
+        self.assertTrue(
+            all(span["parentId"] == group_send["id"] for span in deliveries)
+        )
+
+    def test_rest_message_create_is_traced(self):
+        client = APIClient()
+        client.force_authenticate(user=self.sender)
+        response = client.post(
+            reverse("conversation-messages-list-create", args=[self.conversation.id]),
+            {"content": "over rest"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+
+        spans = self.spans_by_name()
+        root = spans["http conversation-messages-list-create"]
+        self.assertEqual(root["tags"]["status"], "201")
+        for name in ("db.create_message", "serialize_message", "broadcast_new_message"):
+            self.assertEqual(spans[name]["parentId"], root["id"])
+        self.assertEqual(spans["channel_layer.group_send"]["traceId"], root["traceId"])
+
+
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+)
+class ConversationAdminTranscriptTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = CustomUser.objects.create_superuser(
+            email="admin@chat.com", password="pw", username="admin"
+        )
+        cls.user_a = CustomUser.objects.create_user(
+            email="ta@chat.com", password="pw", username="ta"
+        )
+        cls.user_b = CustomUser.objects.create_user(
+            email="tb@chat.com", password="pw", username="tb"
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def make_conversation(self, count):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user_a, self.user_b)
+        first = None
+        for i in range(count):
+            message = Message.objects.create(
+                conversation=conversation,
+                sender=self.user_a if i % 2 else self.user_b,
+                content=f"line {i}",
+                reply_to_message=first,
+            )
+            first = first or message
+        return conversation
+
+    def change_page(self, conversation):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(
+                reverse("admin:chat_conversation_change", args=[conversation.id])
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(captured.captured_queries)
+
+    def test_change_page_renders_newest_page_with_bounded_queries(self):
+        small_conversation = self.make_conversation(5)
+        self.change_page(small_conversation)  # fills the per-process caches
+        small, small_queries = self.change_page(small_conversation)
+        big, big_queries = self.change_page(self.make_conversation(120))
+
+        self.assertNotIn("admin-chat-load-older", small)
+        self.assertEqual(big.count("admin-chat-message-wrapper"), 50)
+        self.assertIn("line 119", big)
+        self.assertNotIn("line 69<", big)
+        self.assertIn('data-before="71"', big)
+        self.assertEqual(big_queries, small_queries)
+
+    def test_transcript_endpoint_pages_back_to_the_start(self):
+        conversation = self.make_conversation(120)
+        url = reverse("admin:chat_conversation_transcript", args=[conversation.id])
+
+        page = self.client.get(url, {"before": 71}).json()
+        self.assertEqual(page["html"].count("admin-chat-message-wrapper"), 50)
+        self.assertIn("line 69<", page["html"])
+        self.assertEqual(page["before"], 21)
+
+        page = self.client.get(url, {"before": 21}).json()
+        self.assertEqual(page["html"].count("admin-chat-message-wrapper"), 20)
+        self.assertIsNone(page["before"])
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+    def test_transcript_endpoint_requires_staff(self):
+        conversation = self.make_conversation(3)
+        self.client.force_login(self.user_a)
+        response = self.client.get(
+            reverse("admin:chat_conversation_transcript", args=[conversation.id]),
+            {"before": 3},
+        )
+        self.assertEqual(response.status_code, 302)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ConversationCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="count1@chat.com", password="pw1"
+        )
+        cls.user2 = CustomUser.objects.create_user(
+            email="count2@chat.com", password="pw2"
+        )
+        cls.user3 = CustomUser.objects.create_user(
+            email="count3@chat.com", password="pw3"
+        )
+
+    def counters(self, conversation):
+        conversation.refresh_from_db()
+        return conversation.message_count, conversation.participant_count
+
+    def test_counters_follow_messages_and_members(self):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user1, self.user2)
+        conversation.participants.add(self.user2)  # already a member
+        self.user3.conversations.add(conversation)
+        self.assertEqual(self.counters(conversation), (0, 3))
+
+        first = Message.objects.create(
+            conversation=conversation, sender=self.user1, content="a"
+        )
+        Message.objects.create(
+            conversation=conversation, sender=self.user2, content="b"
+        )
+        self.assertEqual(self.counters(conversation), (2, 3))
+
+        # Renaming or touching the conversation never writes back stale counters.
+        stale = Conversation.objects.get(pk=conversation.pk)
+        Message.objects.create(
+            conversation=conversation, sender=self.user1, content="c"
+        )
+        stale.save()
+        self.assertEqual(self.counters(conversation), (3, 3))
+
+        first.delete()
+        conversation.participants.remove(self.user1)
+        self.user3.conversations.remove(conversation)
+        self.assertEqual(self.counters(conversation), (2, 1))
+        conversation.participants.clear()
+        self.assertEqual(self.counters(conversation), (2, 0))
+
+    def test_user_deletion_updates_counters(self):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user1, self.user2, self.user3)
+        Message.objects.create(
+            conversation=conversation, sender=self.user3, content="bye"
+        )
+        Message.objects.create(
+            conversation=conversation, sender=self.user1, content="hi"
+        )
+
+        self.user3.delete()
+        self.assertEqual(self.counters(conversation), (1, 2))
+
+    def test_bulk_delete_updates_each_conversation_once(self):
+        first, second = Conversation.objects.create(), Conversation.objects.create()
+        for conversation in (first, second):
+            conversation.participants.add(self.user1, self.user2)
+            for i in range(3):
+                Message.objects.create(
+                    conversation=conversation, sender=self.user1, content=f"m{i}"
+                )
+
+        with CaptureQueriesContext(connection) as queries:
+            deleted, _ = Message.objects.exclude(
+                conversation=second, content="m0"
+            ).delete()
+        self.assertEqual(deleted, 5)
+        counter_updates = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('UPDATE "chat_conversation"')
+        ]
+        self.assertEqual(len(counter_updates), 1)
+        self.assertEqual(self.counters(first), (0, 2))
+        self.assertEqual(self.counters(second), (1, 2))
+
+    @override_settings(
+        STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage"
+    )
+    def test_admin_filters_by_counter_ranges(self):
+        admin_user = CustomUser.objects.create_superuser(
+            email="countadmin@chat.com", password="pw"
+        )
+        direct = Conversation.objects.create()
+        direct.participants.add(self.user1, self.user2)
+        group = Conversation.objects.create()
+        group.participants.add(self.user1, self.user2, self.user3)
+        Message.objects.create(conversation=group, sender=self.user1, content="hi")
+
+        self.client.force_login(admin_user)
+        url = reverse("admin:chat_conversation_changelist")
+        for params, expected in (
+            ({"participants": "3+"}, [group]),
+            ({"participants": "2"}, [direct]),
+            ({"messages": "0"}, [direct]),
+            ({"messages": "1-99", "participants": "3+"}, [group]),
+            ({"messages": "10000+"}, []),
+        ):
+            with self.subTest(**params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(list(response.context["cl"].queryset), expected)
+
+    def test_api_exposes_and_filters_by_counters(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user1)
+        url = reverse("conversation-list-create")
+        response = client.post(
+            url, {"participant_ids": [self.user2.id, self.user3.id]}, format="json"
+        )
+        group_id = response.data["id"]
+        self.assertEqual(response.data["participant_count"], 3)
+        client.post(url, {"participant_ids": [self.user2.id]}, format="json")
+        client.post(
+            reverse("conversation-messages-list-create", args=[group_id]),
+            {"content": "hello group"},
+        )
+
+        conversations = client.get(url).data
+        counts = {
+            c["id"]: (c["message_count"], c["participant_count"]) for c in conversations
+        }
+        self.assertEqual(counts[group_id], (1, 3))
+        self.assertEqual(len(counts), 2)
+
+        groups = client.get(url, {"min_participants": 3}).data
+        self.assertEqual([c["id"] for c in groups], [group_id])
+        active = client.get(url, {"min_messages": 1}).data
+        self.assertEqual([c["id"] for c in active], [group_id])
+        self.assertEqual(client.get(url, {"min_messages": "x"}).status_code, 400)
+
+    def test_reconcile_command_fixes_drift(self):
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user1, self.user2)
+        Message.objects.create(
+            conversation=conversation, sender=self.user1, content="a"
+        )
+        healthy = Conversation.objects.create()
+        healthy.participants.add(self.user1, self.user3)
+        # What a bulk_create behind the signals' back leaves behind.
+        Message.objects.bulk_create(
+            [Message(conversation=conversation, sender=self.user2, sequence=2)]
+        )
+        Conversation.objects.filter(pk=conversation.pk).update(participant_count=7)
+
+        out = io.StringIO()
+        call_command("reconcile_conversation_counters", "--dry-run", stdout=out)
+        self.assertIn(
+            f"Conversation {conversation.pk}: message_count 1 -> 2", out.getvalue()
+        )
+        self.assertNotIn(f"Conversation {healthy.pk}:", out.getvalue())
+        self.assertEqual(self.counters(conversation), (1, 7))
+
+        out = io.StringIO()
+        call_command("reconcile_conversation_counters", "--batch-size", "1", stdout=out)
+        self.assertIn("Checked 2 conversations, 1 fixed.", out.getvalue())
+        self.assertEqual(self.counters(conversation), (2, 2))
+        self.assertEqual(self.counters(healthy), (0, 2))
+
+
+@override_settings(CHANNEL_LAYERS=INSTRUMENTED_CHANNEL_LAYERS)
+class NotificationFanOutTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            CustomUser.objects.create_user(email=f"fan{index}@chat.com", password="pw")
+            for index in range(4)
+        ]
+        cls.conversation = Conversation.objects.create()
+        cls.conversation.participants.add(*cls.users)
+
+    def setUp(self):
+        event_buffer._event_buffer = event_buffer.InMemoryEventBuffer(size=10)
+
+    def tearDown(self):
+        event_buffer._event_buffer = None
+
+    def test_message_create_notifies_other_participants_in_one_batch(self):
+        channel_layer = get_channel_layer()
+        groups = [user_group_name(user.id) for user in self.users]
+        channels = async_to_sync(benchmarks.subscribe)(channel_layer, groups)
+        batches_before = sample(
+            metrics.CHANNEL_LAYER_OPERATIONS, operation="group_send_many", outcome="ok"
+        )
+
+        client = APIClient()
+        client.force_authenticate(user=self.users[0])
+        response = client.post(
+            reverse("conversation-messages-list-create", args=[self.conversation.id]),
+            {"content": "to everyone"},
+        )
+        self.assertEqual(response.status_code, 201)
+
+        async def pending(channel):
+            try:
+                return await asyncio.wait_for(channel_layer.receive(channel), 0.05)
+            except asyncio.TimeoutError:
+                return None
+
+        received = [async_to_sync(pending)(channel) for channel in channels]
+        self.assertIsNone(received[0])
+        for event in received[1:]:
+            self.assertEqual(event["type"], "new.message.notification")
+            self.assertEqual(event["message"]["content"], "to everyone")
+        self.assertEqual(
+            sample(
+                metrics.CHANNEL_LAYER_OPERATIONS,
+                operation="group_send_many",
+                outcome="ok",
+            ),
+            batches_before + 1,
+        )
+
+    def test_bench_fanout_command(self):
+        out = io.StringIO()
+        call_command(
+            "bench_fanout",
+            "--sizes",
+            "2,6",
+            "--iterations",
+            "1",
+            "--layer",
+            "memory",
+            stdout=out,
+        )
+        rows = out.getvalue().splitlines()[1:]
+        self.assertEqual(
+            [row.split()[:2] for row in rows], [["2", "201"], ["6", "201"]]
+        )
+        self.assertFalse(
+            CustomUser.objects.filter(email__endswith="@fanout.invalid").exists()
+        )
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AsyncMessageViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="async1@chat.com", password="pw1"
+        )
+        cls.user2 = CustomUser.objects.create_user(
+            email="async2@chat.com", password="pw2"
+        )
+        cls.user3 = CustomUser.objects.create_user(
+            email="async3@chat.com", password="pw3"
+        )
+        cls.conversation = Conversation.objects.create()
+        cls.conversation.participants.add(cls.user1, cls.user2)
+
+    def setUp(self):
+        event_buffer._event_buffer = event_buffer.InMemoryEventBuffer(size=10)
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user1)}"
+        )
+
+    def tearDown(self):
+        event_buffer._event_buffer = None
+
+    def test_create_matches_the_drf_view(self):
+        sync_response = self.client.post(
+            reverse("conversation-messages-list-create", args=[self.conversation.id]),
+            {"content": "sync"},
+            format="json",
+        )
+        response = self.client.post(
+            reverse("async-conversation-messages-create", args=[self.conversation.id]),
+            {"content": "async", "reply_to_message_id": sync_response.data["id"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(set(data), set(sync_response.data))
+        self.assertEqual(data["sequence"], 2)
+        self.assertEqual(data["reply_to_message_details"]["content"], "sync")
+        message = Message.objects.get(id=data["id"])
+        self.assertEqual((message.sender, message.content), (self.user1, "async"))
+        self.assertTrue(
+            MessageChange.objects.filter(
+                message=message, action=MessageChange.CREATED
+            ).exists()
+        )
+
+    def test_create_rejects_bad_requests(self):
+        url = reverse("async-conversation-messages-create", args=[self.conversation.id])
+        self.assertEqual(
+            APIClient().post(url, {"content": "x"}, format="json").status_code, 401
+        )
+        self.assertEqual(self.client.post(url, {}, format="json").status_code, 400)
+
+        other = Conversation.objects.create()
+        other.participants.add(self.user2, self.user3)
+        foreign = Message.objects.create(
+            conversation=other, sender=self.user2, content="elsewhere"
+        )
+        response = self.client.post(
+            url, {"content": "x", "reply_to_message_id": foreign.id}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("not found in this conversation", response.json()["detail"])
+        response = self.client.post(
+            reverse("async-conversation-messages-create", args=[other.id]),
+            {"content": "x"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_send_to_user_reuses_or_creates_the_conversation(self):
+        response = self.client.post(
+            reverse("async-messages-send-to-user", args=[self.user2.id]),
+            {"content": "hi"},
+            format="json",
+        )
+        self.assertEqual(response.json()["conversation"], self.conversation.id)
+
+        response = self.client.post(
+            reverse("async-messages-send-to-user", args=[self.user3.id]),
+            {"content": "new"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        created = Conversation.objects.get(id=response.json()["conversation"])
+        self.assertEqual(set(created.participants.all()), {self.user1, self.user3})
+        self.assertEqual((created.message_count, created.participant_count), (1, 2))
+
+        response = self.client.post(
+            reverse("async-messages-send-to-user", args=[self.user1.id]),
+            {"content": "me"},
+            format="json",
+        )
+        self.assertEqual(
+            response.json(), {"detail": "Cannot send messages to yourself."}
+        )
+
+    def test_edit_and_delete(self):
+        message = Message.objects.create(
+            conversation=self.conversation, sender=self.user1, content="draft"
+        )
+        url = reverse("async-message-detail-update-delete", args=[message.id])
+
+        response = self.client.patch(url, {"content": "final"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.json()["content"], response.json()["is_edited"]), ("final", True)
+        )
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        message.refresh_from_db()
+        self.assertTrue(message.is_deleted)
+        self.assertEqual(
+            list(message.changes.values_list("action", flat=True)),
+            [MessageChange.EDITED, MessageChange.DELETED],
+        )
+        self.assertEqual(
+            self.client.patch(url, {"content": "again"}, format="json").status_code, 400
+        )
+
+        theirs = Message.objects.create(
+            conversation=self.conversation, sender=self.user2, content="no"
+        )
+        response = self.client.delete(
+            reverse("async-message-detail-update-delete", args=[theirs.id])
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS,
+    QUERY_PROFILER_SAMPLE_RATE=1.0,
+    QUERY_PROFILER_MAX_QUERIES=0,
+)
+class AsyncMiddlewareTests(TempMediaMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(
+            email="amw1@chat.com", password="pw1"
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        event_buffer._event_buffer = event_buffer.InMemoryEventBuffer(size=10)
+
+    def tearDown(self):
+        event_buffer._event_buffer = None
+        super().tearDown()
+
+    def test_middleware_follows_the_handler_mode(self):
+        async def async_view(request):
+            return HttpResponse()
+
+        for middleware in (
+            tracing.TracingMiddleware,
+            metrics.MetricsMiddleware,
+            query_profiler.QueryProfilerMiddleware,
+            ReplicaRoutingMiddleware,
+        ):
+            with self.subTest(middleware=middleware.__name__):
+                self.assertTrue(iscoroutinefunction(middleware(async_view)))
+                self.assertFalse(
+                    iscoroutinefunction(middleware(lambda request: HttpResponse()))
+                )
+
+    def test_async_view_queries_are_measured_under_asgi(self):
+        view = "async-conversation-messages-create"
+        db_before = metrics.HTTP_REQUEST_DB_SECONDS.samples().get((view,), [[], 0, 0])
+
+        with self.assertLogs("src.query_profiler", "WARNING") as logs:
+            status, _ = asgi_get(
+                reverse(view, args=[self.conversation.id]),
+                AccessToken.for_user(self.user),
+                method="POST",
+                body=json.dumps({"content": "measured"}).encode(),
+            )
+        self.assertEqual(status, 201)
+        _, db_seconds, requests = metrics.HTTP_REQUEST_DB_SECONDS.samples()[(view,)]
+        self.assertEqual(requests, db_before[2] + 1)
+        self.assertGreater(db_seconds, db_before[1])
+        self.assertTrue(
+            any(f"Query profile POST {view}:" in line for line in logs.output)
+        )
+
+    @override_settings(QUERY_PROFILER_SAMPLE_RATE=0.0)
+    def test_image_upload_does_not_hold_up_other_requests(self):
+        # Validation of the upload waits until another request has been
+        # answered, which it can only be if validation is off the event loop.
+        other_answered = threading.Event()
+        waited = []
+        validate = AsyncMessageCreateSerializer.validate
+
+        def slow_validate(serializer, attrs):
+            waited.append(other_answered.wait(timeout=5))
+            return validate(serializer, attrs)
+
+        token = AccessToken.for_user(self.user)
+        body = encode_multipart(
+            BOUNDARY,
+            {"image": SimpleUploadedFile("a.png", make_png_bytes(), "image/png")},
+        )
+
+        async def scenario():
+            upload = asyncio.ensure_future(
+                asgi_request(
+                    reverse(
+                        "async-conversation-messages-create",
+                        args=[self.conversation.id],
+                    ),
+                    token,
+                    method="POST",
+                    body=body,
+                    content_type=MULTIPART_CONTENT,
+                )
+            )
+            other = await asgi_request(reverse("check"), token)
+            other_answered.set()
+            return await upload, other
+
+        with mock.patch.object(AsyncMessageCreateSerializer, "validate", slow_validate):
+            (upload_status, _), (other_status, _) = contextvars.Context().run(
+                asyncio.run, scenario()
+            )
+        self.assertEqual((upload_status, other_status), (201, 200))
+        self.assertEqual(waited, [True])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class AsgiThroughputBenchmarkTests(TransactionTestCase):
+
+    def test_bench_asgi_command(self):
+        out = io.StringIO()
+        call_command(
+            "bench_asgi",
+            "--participants",
+            "3",
+            "--requests",
+            "4",
+            "--concurrency",
+            "2",
+            "--layer",
+            "memory",
+            stdout=out,
+        )
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual(
+            [(row[0], row[-1]) for row in rows], [("sync", "4"), ("async", "4")]
+        )
+        self.assertFalse(Conversation.objects.exists())
+        self.assertFalse(Message.objects.exists())
+
+
+class FailingChannelLayer:
+
+    async def group_send(self, group, message):
+        raise ConnectionError("redis is down")
+
+
+class LeaseCheckingChannelLayer:
+    """Records what another dispatcher would find due while a batch is sent."""
+
+    def __init__(self, on_send=None):
+        self.due_while_sending = []
+        self.on_send = on_send
+
+    async def group_send(self, group, message):
+        def due():
+            if self.on_send:
+                self.on_send()
+            return pending_events().filter(available_at__lte=timezone.now()).count()
+
+        self.due_while_sending.append(await sync_to_async(due)())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class BroadcastOutboxTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user1 = CustomUser.objects.create_user(
+            email="outbox1@chat.com", password="pw1"
+        )
+        cls.user2 = CustomUser.objects.create_user(
+            email="outbox2@chat.com", password="pw2"
+        )
+        cls.conversation = Conversation.objects.create()
+        cls.conversation.participants.add(cls.user1, cls.user2)
+
+    def setUp(self):
+        event_buffer._event_buffer = event_buffer.InMemoryEventBuffer(size=10)
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user1)}"
+        )
+        self.channel_layer = get_channel_layer()
+        self.channels = async_to_sync(benchmarks.subscribe)(
+            self.channel_layer,
+            [
+                conversation_group_name(self.conversation.id),
+                user_group_name(self.user2.id),
+            ],
+        )
+
+    def tearDown(self):
+        event_buffer._event_buffer = None
+
+    def received(self):
+        async def pending(channel):
+            try:
+                return await asyncio.wait_for(self.channel_layer.receive(channel), 0.05)
+            except asyncio.TimeoutError:
+                return None
+
+        return [async_to_sync(pending)(channel) for channel in self.channels]
+
+    @override_settings(CHAT_BROADCAST_OUTBOX=True)
+    def test_views_write_the_outbox_and_the_dispatcher_sends_it(self):
+        response = self.client.post(
+            reverse("conversation-messages-list-create", args=[self.conversation.id]),
+            {"content": "via the outbox"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            reverse("async-conversation-messages-create", args=[self.conversation.id]),
+            {"content": "async too"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.received(), [None, None])
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list("kind", flat=True)),
+            [OutboxEvent.CONVERSATION, OutboxEvent.USERS] * 2,
+        )
+
+        out = io.StringIO()
+        call_command("dispatch_outbox", "--once", "--batch-size", "3", stdout=out)
+        self.assertIn("Sent 4 events, 0 attempts failed.", out.getvalue())
+        self.assertFalse(OutboxEvent.objects.exists())
+        chat_event, notification = self.received()
+        self.assertEqual(chat_event["type"], "chat.message")
+        self.assertEqual(chat_event["message"]["content"], "via the outbox")
+        self.assertEqual(chat_event["event_id"], 1)
+        self.assertEqual(notification["type"], "new.message.notification")
+        self.assertEqual(self.received()[0]["message"]["content"], "async too")
+
+    def test_broadcasts_are_dropped_with_a_failed_write(self):
+        event = {"type": "chat.message", "message": {"content": "rolled back"}}
+        with self.assertRaises(ValueError), defer_broadcasts():
+            publish_conversation_event(self.conversation.id, event)
+            raise ValueError
+        with override_settings(CHAT_BROADCAST_OUTBOX=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                publish_conversation_event(self.conversation.id, event)
+                raise ValueError
+        self.assertEqual(self.received(), [None, None])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_direct_broadcasts_wait_for_the_write(self):
+        with defer_broadcasts():
+            publish_conversation_event(self.conversation.id, {"type": "chat.message"})
+            self.assertEqual(self.received(), [None, None])
+        self.assertEqual(self.received()[0]["type"], "chat.message")
+
+    def test_failed_sends_are_retried_then_marked_failed(self):
+        outbox_event = OutboxEvent.objects.create(
+            kind=OutboxEvent.CONVERSATION,
+            conversation_id=self.conversation.id,
+            event={"type": "chat.message", "message": {"content": "retry me"}},
+        )
+        failing = FailingChannelLayer()
+        self.assertEqual(dispatch_batch(max_attempts=2, channel_layer=failing), (0, 1))
+        outbox_event.refresh_from_db()
+        self.assertEqual(outbox_event.attempts, 1)
+        self.assertIn("redis is down", outbox_event.last_error)
+        self.assertGreater(outbox_event.available_at, timezone.now())
+        # Buffered once; retries keep the id.
+        self.assertEqual(outbox_event.event["event_id"], 1)
+        self.assertEqual(dispatch_batch(max_attempts=2, channel_layer=failing), (0, 0))
+
+        OutboxEvent.objects.update(available_at=timezone.now())
+        self.assertEqual(dispatch_batch(max_attempts=2, channel_layer=failing), (0, 1))
+        outbox_event.refresh_from_db()
+        self.assertIsNotNone(outbox_event.failed_at)
+
+        out = io.StringIO()
+        call_command("dispatch_outbox", "--once", "--retry-failed", stdout=out)
+        self.assertIn("Queued 1 failed events again.", out.getvalue())
+        self.assertFalse(OutboxEvent.objects.exists())
+        chat_event = self.received()[0]
+        self.assertEqual(
+            (chat_event["message"]["content"], chat_event["event_id"]), ("retry me", 1)
+        )
+
+    def test_events_are_leased_while_they_are_sent(self):
+        for content in ("one", "two"):
+            OutboxEvent.objects.create(
+                kind=OutboxEvent.CONVERSATION,
+                conversation_id=self.conversation.id,
+                event={"type": "chat.message", "message": {"content": content}},
+            )
+        layer = LeaseCheckingChannelLayer()
+        self.assertEqual(dispatch_batch(channel_layer=layer), (2, 0))
+        self.assertEqual(layer.due_while_sending, [0, 0])
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    @override_settings(CHAT_OUTBOX_LEASE_SECONDS=30)
+    def test_events_claimed_again_after_the_lease_are_left_alone(self):
+        outbox_event = OutboxEvent.objects.create(
+            kind=OutboxEvent.USERS,
+            user_ids=[self.user2.id],
+            event={"type": "new.message.notification"},
+        )
+        # Another dispatcher claims the event once this one's lease is over.
+        reclaimed_at = timezone.now() + timedelta(minutes=5)
+        layer = LeaseCheckingChannelLayer(
+            on_send=lambda: OutboxEvent.objects.update(available_at=reclaimed_at)
+        )
+        self.assertEqual(dispatch_batch(channel_layer=layer), (1, 0))
+        outbox_event.refresh_from_db()
+        self.assertEqual(outbox_event.available_at, reclaimed_at)
+
+
+def redis_available():
+    try:
+        return redis.Redis.from_url(
+            settings.REDIS_URL, socket_connect_timeout=0.2
+        ).ping()
+    except (redis.exceptions.RedisError, OSError):
+        return False
+
+
+class LocalDeliveryLayerTests(SimpleTestCase):
+
+    def test_sends_to_local_channels_skip_redis(self):
+        # Nothing listens there; the local path must not need Redis.
+        layer = LocalDeliveryRedisChannelLayer(
+            hosts=["redis://127.0.0.1:1/0"], capacity=2
+        )
+        other = LocalDeliveryRedisChannelLayer(hosts=["redis://127.0.0.1:1/0"])
+
+        async def exchange():
+            channel = await layer.new_channel()
+            self.assertTrue(layer.is_local(channel))
+            self.assertFalse(layer.is_local(await other.new_channel()))
+            self.assertFalse(layer.is_local("http.request"))
+            message = {"type": "chat.message", "message": {"content": "first"}}
+            await layer.send(channel, message)
+            message["message"]["content"] = "changed after sending"
+            await layer.send(
+                channel, {"type": "chat.message", "message": {"content": "second"}}
+            )
+            with self.assertRaises(ChannelFull):
+                await layer.send(channel, {"type": "chat.message"})
+            return [await layer.receive(channel), await layer.receive(channel)]
+
+        received = async_to_sync(exchange)()
+        self.assertEqual(
+            [event["message"]["content"] for event in received], ["first", "second"]
+        )
+
+    @skipUnless(redis_available(), "needs Redis at REDIS_URL")
+    def test_group_send_reaches_local_and_remote_members(self):
+        layer = LocalDeliveryRedisChannelLayer(hosts=[settings.REDIS_URL])
+        other = LocalDeliveryRedisChannelLayer(hosts=[settings.REDIS_URL])
+        group = "test_local_delivery"
+        local_before = sample(metrics.CHANNEL_LAYER_DELIVERIES, route="local")
+
+        async def exchange():
+            local_channels = [await layer.new_channel() for _ in range(2)]
+            remote_channel = await other.new_channel()
+            for channel in local_channels:
+                await layer.group_add(group, channel)
+            await other.group_add(group, remote_channel)
+            try:
+                await layer.group_send(
+                    group, {"type": "chat.message", "to": "everyone"}
+                )
+                received = [await layer.receive(channel) for channel in local_channels]
+                received.append(
+                    await asyncio.wait_for(other.receive(remote_channel), 5)
+                )
+                await other.group_discard(group, remote_channel)
+                await layer.group_send(group, {"type": "chat.message", "to": "local"})
+                received += [await layer.receive(channel) for channel in local_channels]
+            finally:
+                for channel in local_channels:
+                    await layer.group_discard(group, channel)
+                await other.group_discard(group, remote_channel)
+                await layer.close_pools()
+                await other.close_pools()
+            return received
+
+        received = async_to_sync(exchange)()
+        self.assertEqual(
+            [event["to"] for event in received], ["everyone"] * 3 + ["local"] * 2
+        )
+        self.assertEqual(
+            sample(metrics.CHANNEL_LAYER_DELIVERIES, route="local"), local_before + 4
+        )
+
+    @skipUnless(redis_available(), "needs Redis at REDIS_URL")
+    def test_bench_local_delivery_command(self):
+        out = io.StringIO()
+        call_command(
+            "bench_local_delivery",
+            "--recipients",
+            "4",
+            "--local-shares",
+            "0,0.5",
+            "--iterations",
+            "2",
+            stdout=out,
+        )
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual([row[:3] for row in rows], [["4", "0", "4"], ["4", "2", "2"]])
+
+    def test_bench_local_delivery_rejects_bad_shares(self):
+        with self.assertRaises(CommandError):
+            call_command("bench_local_delivery", "--local-shares", "0.5,2")
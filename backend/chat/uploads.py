@@ -0,0 +1,111 @@
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+
+CHUNK_READ_SIZE = 64 * 1024
+
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+class ChunkError(Exception):
+    """Raised when an uploaded chunk does not match its declared byte range."""
+
+
+def get_part_path(session):
+    """Where the partially uploaded bytes of ``session`` live on disk."""
+    upload_dir = Path(settings.CHUNKED_UPLOAD_TEMP_DIR)
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    return upload_dir / f"{session.id}.part"
+
+
+def parse_content_range(header_value, total_size):
+    """
+    Parse a ``Content-Range: bytes <start>-<end>/<total>`` header.
+
+    Returns the half-open ``(start, end)`` range or raises ``ChunkError``.
+    """
+    match = _CONTENT_RANGE_RE.match((header_value or "").strip())
+    if not match:
+        raise ChunkError(
+            "Content-Range header must look like 'bytes <start>-<end>/<total>'."
+        )
+
+    start, last = int(match.group(1)), int(match.group(2))
+    declared_total = match.group(3)
+    if declared_total != "*" and int(declared_total) != total_size:
+        raise ChunkError("Content-Range total does not match the upload size.")
+    if start > last or last >= total_size:
+        raise ChunkError("Content-Range is outside of the upload.")
+    return start, last + 1
+
+
+def merge_range(ranges, start, end):
+    """Return ``ranges`` with ``[start, end)`` merged in, sorted and coalesced."""
+    merged = []
+    for r_start, r_end in sorted([*ranges, [start, end]]):
+        if merged and r_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], r_end)
+        else:
+            merged.append([r_start, r_end])
+    return merged
+
+
+def missing_ranges(ranges, total_size):
+    """The half-open byte ranges of the upload that have not been received yet."""
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < total_size:
+        missing.append([position, total_size])
+    return missing
+
+
+def write_chunk(session, stream, start, end):
+    """
+    Stream ``end - start`` bytes from ``stream`` into the session's part file
+    at offset ``start``, without holding the chunk in memory.
+    """
+    # Concurrent chunks may both be first: create the file if needed, but
+    # never truncate what another request already wrote.
+    fd = os.open(get_part_path(session), os.O_CREAT | os.O_RDWR, 0o600)
+    remaining = end - start
+    with os.fdopen(fd, "r+b") as part_file:
+        part_file.seek(start)
+        while remaining > 0:
+            data = stream.read(min(CHUNK_READ_SIZE, remaining))
+            if not data:
+                break
+            part_file.write(data)
+            remaining -= len(data)
+    if remaining:
+        raise ChunkError(f"Chunk ended {remaining} bytes before the declared range.")
+
+
+def discard_part(session):
+    try:
+        os.remove(get_part_path(session))
+    except FileNotFoundError:
+        pass
+
+
+class PartFile(File):
+    """
+    The assembled upload, named after the client's file.
+
+    Exposing ``temporary_file_path`` lets Pillow validate the image straight
+    from disk and lets ``FileSystemStorage`` move the file into ``MEDIA_ROOT``
+    instead of copying it through memory.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def open_part_file(session):
+    return PartFile(open(get_part_path(session), "rb"), name=session.filename)
@@ -1,11 +1,21 @@
 # chat/urls.py
 from django.urls import path
+from .async_views import (
+    AsyncSendMessageToUserView,
+    AsyncConversationMessageCreateView,
+    AsyncMessageDetailView,
+)
 from .views import (
     GetMessagesWithUserView,
     SendMessageToUserView,
     ConversationListCreateView,
     MessageListInConversationView,
     MessageDetailUpdateDeleteView,
+    UploadSessionCreateView,
+    UploadSessionDetailView,
+    UploadSessionFinalizeView,
+    MessageChangeFeedView,
+    ConversationExportView,
 )
 
 urlpatterns = [
@@ -34,4 +44,44 @@ urlpatterns = [
         MessageDetailUpdateDeleteView.as_view(),
         name="message-detail-update-delete",
     ),
+    path(
+        "conversations/<int:conversation_pk>/uploads/",
+        UploadSessionCreateView.as_view(),
+        name="conversation-upload-create",
+    ),
+    path(
+        "uploads/<uuid:upload_id>/",
+        UploadSessionDetailView.as_view(),
+        name="upload-detail",
+    ),
+    path(
+        "uploads/<uuid:upload_id>/finalize/",
+        UploadSessionFinalizeView.as_view(),
+        name="upload-finalize",
+    ),
+    path(
+        "changes/",
+        MessageChangeFeedView.as_view(),
+        name="message-change-feed",
+    ),
+    path(
+        "conversations/<int:conversation_pk>/export/",
+        ConversationExportView.as_view(),
+        name="conversation-export",
+    ),
+    path(
+        "async/send/<int:receiver_id>/",
+        AsyncSendMessageToUserView.as_view(),
+        name="async-messages-send-to-user",
+    ),
+    path(
+        "async/conversations/<int:conversation_pk>/messages/",
+        AsyncConversationMessageCreateView.as_view(),
+        name="async-conversation-messages-create",
+    ),
+    path(
+        "async/<int:message_pk>/",
+        AsyncMessageDetailView.as_view(),
+        name="async-message-detail-update-delete",
+    ),
 ]
@@ -1,45 +1,107 @@
 # chat/views.py
+from datetime import timedelta
+from django.conf import settings
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
-from rest_framework import generics, status, permissions, serializers
+from django.db import transaction
+from rest_framework import exceptions, generics, status, permissions, serializers, views
 from rest_framework.response import Response
-from .models import Conversation, Message
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from django.db.models import Count, OuterRef, Subquery
+from .models import Conversation, Message, MessageChange, UploadSession, upload_expiry
+from django.db.models import Count, Max, OuterRef, Q, Subquery, prefetch_related_objects
+from users.models import UserProfile
+from src.metrics import MESSAGES_CREATED
+from src.tracing import span
+from .conditional import ConditionalGetMixin
+from .streaming import StreamingListMixin, streaming_response
+from .export import iter_conversation_records, iter_ndjson
+from .broadcast import (
+    defer_broadcasts,
+    broadcast_new_message,
+    broadcast_message_updated,
+    broadcast_message_deleted,
+    publish_to_users,
+)
+from .pagination import (
+    ConversationCursorPagination,
+    encode_since_token,
+    filter_changed_since,
+)
 from .serializers import (
     ConversationSerializer,
     MessageSerializer,
     MessageCreateSerializer,
     MessageEditSerializer,
+    MessageChangeSerializer,
+    UploadSessionSerializer,
+    UploadSessionCreateSerializer,
+    UploadFinalizeSerializer,
+)
+from .uploads import (
+    ChunkError,
+    parse_content_range,
+    merge_range,
+    missing_ranges,
+    write_chunk,
+    discard_part,
+    open_part_file,
 )
 
 
 CustomUser = get_user_model()
 
 
-# URL: /api/messages/user/<int:user_id>/ (GET - Gets messages for a 1-on-1 chat with user_id)
-class GetMessagesWithUserView(generics.ListAPIView):
+def conversation_validator_parts(conversation_id, user):
+    """
+    Cheap values that change whenever a conversation's message history would
+    serialize differently: new messages bump last_sequence, edits and deletes
+    add MessageChange rows, and profile or name changes bump the participants'
+    profile updated_at. Returns ``None`` if ``user`` is not a participant.
+    """
+    conversation = (
+        Conversation.objects.filter(id=conversation_id, participants=user)
+        .values_list("last_sequence", "updated_at")
+        .first()
+    )
+    if conversation is None:
+        return None
+    last_change_id = MessageChange.objects.filter(
+        conversation_id=conversation_id
+    ).aggregate(last=Max("id"))["last"]
+    profiles = UserProfile.objects.filter(
+        user__conversations=conversation_id
+    ).aggregate(last=Max("updated_at"), count=Count("id"))
+    return (*conversation, last_change_id, profiles["last"], profiles["count"])
+
+
+# URL: /api/messages/user/<int:user_id>/ (GET - Gets messages for a 1-on-1 chat with user_id, ?stream=true streams it)
+class GetMessagesWithUserView(
+    ConditionalGetMixin, StreamingListMixin, generics.ListAPIView
+):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
+    def get_conversation(self):
+        if not hasattr(self, "_conversation"):
+            self._conversation = self.find_conversation()
+        return self._conversation
+
+    def find_conversation(self):
         user_to_chat_with_id = self.kwargs.get("user_id")
         current_user = self.request.user
 
         if not user_to_chat_with_id:
-            return Message.objects.none()
+            return None
 
         try:
             CustomUser.objects.get(id=user_to_chat_with_id)
         except CustomUser.DoesNotExist:
-            return Message.objects.none()
+            return None
 
         if current_user.id == user_to_chat_with_id:
-            return Message.objects.none()
+            return None
 
-        conversation = (
+        return (
             Conversation.objects.annotate(num_participants=Count("participants"))
             .filter(participants=current_user)
             .filter(participants__id=user_to_chat_with_id)
@@ -47,20 +109,23 @@ class GetMessagesWithUserView(generics.ListAPIView):
             .first()
         )
 
+    def get_validator_parts(self):
+        conversation = self.get_conversation()
+        if conversation is None:
+            return None
+        return conversation_validator_parts(conversation.id, self.request.user)
+
+    def get_queryset(self):
+        conversation = self.get_conversation()
         if conversation:
             return (
                 conversation.messages.all()
-                .select_related("sender", "sender__profile")
-                .order_by("timestamp")
+                .select_related("sender__profile", "reply_to_message__sender__profile")
+                .order_by("sequence")
             )
 
         return Message.objects.none()
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
-
 
 # URL: /api/messages/send/<int:receiver_id>/ (POST - Initiates a chat or sends to existing 1-on-1)
 class SendMessageToUserView(generics.CreateAPIView):
@@ -119,45 +184,51 @@ class SendMessageToUserView(generics.CreateAPIView):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-        message_instance = Message.objects.create(
-            sender=sender,
-            conversation=conversation,
-            content=create_serializer.validated_data.get("content"),
-            image=create_serializer.validated_data.get("image"),
-            reply_to_message=reply_to_instance,
-        )
-
-        response_serializer = MessageSerializer(
-            message_instance, context={"request": request}
-        )
-        broadcast_data = response_serializer.data
+        with defer_broadcasts(), transaction.atomic():
+            with span("db.create_message"):
+                message_instance = Message.objects.create(
+                    sender=sender,
+                    conversation=conversation,
+                    content=create_serializer.validated_data.get("content"),
+                    image=create_serializer.validated_data.get("image"),
+                    reply_to_message=reply_to_instance,
+                )
+                MessageChange.record(message_instance, MessageChange.CREATED)
 
-        channel_layer = get_channel_layer()
-        group_name = f"conversation_{conversation.id}"
-        async_to_sync(channel_layer.group_send)(
-            group_name, {"type": "chat.message.event", "message": broadcast_data}
-        )
-        async_to_sync(channel_layer.group_send)(
-            f"user_{receiver.id}",
-            {
-                "type": "new.message.notification",
-                "message": broadcast_data,
-                "conversation_id": conversation.id,
-                "sender_id": sender.id,
-                "sender_username": sender.get_full_name() or sender.username,
-            },
-        )
+            with span("serialize_message"):
+                message_data = MessageSerializer(
+                    message_instance, context={"request": request}
+                ).data
+            with span("broadcast_new_message"):
+                broadcast_new_message(conversation, message_data, sender)
+        MESSAGES_CREATED.inc(source="rest")
 
-        headers = self.get_success_headers(response_serializer.data)
-        return Response(
-            response_serializer.data, status=status.HTTP_201_CREATED, headers=headers
-        )
+        headers = self.get_success_headers(message_data)
+        return Response(message_data, status=status.HTTP_201_CREATED, headers=headers)
 
 
 # URL: /api/messages/conversations/ (GET, POST)
-class ConversationListCreateView(generics.ListCreateAPIView):
+# GET ?limit=&cursor= pages by activity, GET ?since=<token> returns only conversations changed after the token
+class ConversationListCreateView(ConditionalGetMixin, generics.ListCreateAPIView):
     serializer_class = ConversationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ConversationCursorPagination
+    sync_page_size = 100
+
+    def get_validator_parts(self):
+        user = self.request.user
+        conversations = Conversation.objects.filter(
+            id__in=user.conversations.values("id")
+        ).aggregate(
+            count=Count("id", distinct=True),
+            last_updated=Max("updated_at"),
+            participant_total=Count("participants"),
+            last_profile=Max("participants__profile__updated_at"),
+        )
+        last_change_id = MessageChange.objects.filter(
+            conversation__participants=user
+        ).aggregate(last=Max("id"))["last"]
+        return (*conversations.values(), last_change_id)
 
     def get_queryset(self):
         user = self.request.user
@@ -168,9 +239,17 @@ class ConversationListCreateView(generics.ListCreateAPIView):
             .values("timestamp")[:1]
         )
 
+        # ConversationSerializer loads these messages for the whole page at once.
+        last_visible_message_subquery = (
+            Message.objects.filter(conversation=OuterRef("pk"), is_deleted=False)
+            .order_by("-timestamp")
+            .values("id")[:1]
+        )
+
         conversations = (
             user.conversations.annotate(
-                last_message_timestamp_annotated=Subquery(latest_message_subquery)
+                last_message_timestamp_annotated=Subquery(latest_message_subquery),
+                last_message_id_annotated=Subquery(last_visible_message_subquery),
             )
             .prefetch_related(
                 "participants",
@@ -179,8 +258,53 @@ class ConversationListCreateView(generics.ListCreateAPIView):
             .order_by("-updated_at", "-last_message_timestamp_annotated")
         )
 
+        # Filter on the counter columns, e.g. ?min_participants=3 for group chats.
+        try:
+            min_participants = self.request.query_params.get("min_participants")
+            if min_participants is not None:
+                conversations = conversations.filter(
+                    participant_count__gte=int(min_participants)
+                )
+            min_messages = self.request.query_params.get("min_messages")
+            if min_messages is not None:
+                conversations = conversations.filter(
+                    message_count__gte=int(min_messages)
+                )
+        except ValueError:
+            raise serializers.ValidationError(
+                {"detail": "Counter filters must be integers."}
+            )
+
         return conversations
 
+    def list(self, request, *args, **kwargs):
+        since_token = request.query_params.get("since")
+        if since_token is None:
+            return super().list(request, *args, **kwargs)
+
+        changed = list(
+            filter_changed_since(self.get_queryset(), since_token)[
+                : self.sync_page_size + 1
+            ]
+        )
+        has_more = len(changed) > self.sync_page_size
+        changed = changed[: self.sync_page_size]
+        # updated_at is set before commit, so the token only moves past rows
+        # older than SYNC_OVERLAP_SECONDS (see filter_changed_since).
+        settled_before = timezone.now() - timedelta(
+            seconds=settings.SYNC_OVERLAP_SECONDS
+        )
+        for conversation in changed:
+            if conversation.updated_at >= settled_before:
+                has_more = False
+                break
+            since_token = encode_since_token(conversation.updated_at, conversation.pk)
+
+        serializer = self.get_serializer(changed, many=True)
+        return Response(
+            {"results": serializer.data, "since": since_token, "has_more": has_more}
+        )
+
     def perform_create(self, serializer):
         request_user = self.request.user
         participant_ids_from_request = self.request.data.get("participant_ids", [])
@@ -217,32 +341,44 @@ class ConversationListCreateView(generics.ListCreateAPIView):
             if existing_convo:
                 pass
 
-        conversation = serializer.save(
-            participants_qs=participants_qs, request_user=request_user
-        )
-
-        for p_user in participants_qs:
-            if p_user != request_user:
-                async_to_sync(get_channel_layer().group_send)(
-                    f"user_{p_user.id}",
-                    {
-                        "type": "user.notification",
-                        "data": {
-                            "event_type": "new_conversation_added",
-                            "conversation_id": conversation.id,
-                            "conversation_data": ConversationSerializer(
-                                conversation, context={"request": self.request}
-                            ).data,
-                            "created_by": request_user.username,
-                        },
+        with defer_broadcasts(), transaction.atomic():
+            conversation = serializer.save(
+                participants_qs=participants_qs, request_user=request_user
+            )
+            # Serialized twice, for the notification and the response: load
+            # the participants once, and the new conversation has no messages.
+            prefetch_related_objects([conversation], "participants__profile")
+            conversation.last_message_loaded = None
+            setattr(conversation, f"unread_for_{request_user.id}", 0)
+
+            publish_to_users(
+                [p_user.id for p_user in participants_qs if p_user != request_user],
+                {
+                    "type": "user.notification",
+                    "data": {
+                        "event_type": "new_conversation_added",
+                        "conversation_id": conversation.id,
+                        "conversation_data": ConversationSerializer(
+                            conversation, context={"request": self.request}
+                        ).data,
+                        "created_by": request_user.username,
                     },
-                )
+                },
+            )
 
 
 # URL: /api/messages/conversations/<int:conversation_pk>/messages/ (GET, POST)
-class MessageListInConversationView(generics.ListCreateAPIView):
+# GET ?after_sequence=&before_sequence= (exclusive) fetches just a missed range, ?stream=true streams it
+class MessageListInConversationView(
+    ConditionalGetMixin, StreamingListMixin, generics.ListCreateAPIView
+):
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_validator_parts(self):
+        return conversation_validator_parts(
+            self.kwargs.get("conversation_pk"), self.request.user
+        )
+
     def get_serializer_class(self):
         if self.request.method == "POST":
             return MessageCreateSerializer
@@ -255,12 +391,25 @@ class MessageListInConversationView(generics.ListCreateAPIView):
         ).exists():
             return Message.objects.none()
 
-        return (
+        queryset = (
             Message.objects.filter(conversation_id=conversation_id)
-            .select_related("sender", "sender__profile")
-            .order_by("timestamp")
+            .select_related("sender__profile", "reply_to_message__sender__profile")
+            .order_by("sequence")
         )
 
+        try:
+            after_sequence = self.request.query_params.get("after_sequence")
+            if after_sequence is not None:
+                queryset = queryset.filter(sequence__gt=int(after_sequence))
+            before_sequence = self.request.query_params.get("before_sequence")
+            if before_sequence is not None:
+                queryset = queryset.filter(sequence__lt=int(before_sequence))
+        except ValueError:
+            raise serializers.ValidationError(
+                {"detail": "Sequence bounds must be integers."}
+            )
+        return queryset
+
     def create(self, request, *args, **kwargs):
         conversation_id = self.kwargs.get("conversation_pk")
         try:
@@ -293,44 +442,28 @@ class MessageListInConversationView(generics.ListCreateAPIView):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-        message_instance = Message.objects.create(
-            sender=request.user,
-            conversation=conversation,
-            content=create_serializer.validated_data.get("content"),
-            image=create_serializer.validated_data.get("image"),
-            reply_to_message=reply_to_instance,
-        )
-        conversation.save()
-
-        response_serializer = MessageSerializer(
-            message_instance, context={"request": request}
-        )
-        broadcast_data = response_serializer.data
-
-        channel_layer = get_channel_layer()
-        group_name = f"conversation_{conversation.id}"
-        async_to_sync(channel_layer.group_send)(
-            group_name, {"type": "chat.message", "message": broadcast_data}
-        )
-
-        for participant in conversation.participants.all():
-            if participant != request.user:
-                async_to_sync(channel_layer.group_send)(
-                    f"user_{participant.id}",
-                    {
-                        "type": "new.message.notification",
-                        "message": broadcast_data,
-                        "conversation_id": conversation.id,
-                        "sender_id": request.user.id,
-                        "sender_username": request.user.get_full_name()
-                        or request.user.username,
-                    },
+        with defer_broadcasts(), transaction.atomic():
+            with span("db.create_message"):
+                message_instance = Message.objects.create(
+                    sender=request.user,
+                    conversation=conversation,
+                    content=create_serializer.validated_data.get("content"),
+                    image=create_serializer.validated_data.get("image"),
+                    reply_to_message=reply_to_instance,
                 )
+                MessageChange.record(message_instance, MessageChange.CREATED)
+                conversation.save()
 
-        headers = self.get_success_headers(response_serializer.data)
-        return Response(
-            response_serializer.data, status=status.HTTP_201_CREATED, headers=headers
-        )
+            with span("serialize_message"):
+                message_data = MessageSerializer(
+                    message_instance, context={"request": request}
+                ).data
+            with span("broadcast_new_message"):
+                broadcast_new_message(conversation, message_data, request.user)
+        MESSAGES_CREATED.inc(source="rest")
+
+        headers = self.get_success_headers(message_data)
+        return Response(message_data, status=status.HTTP_201_CREATED, headers=headers)
 
 
 class MessageDetailUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
@@ -346,10 +479,8 @@ class MessageDetailUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
         message_id = self.kwargs.get("message_pk")
         message = get_object_or_404(Message, id=message_id)
 
-        if message.sender != self.request.user:
-            raise serializers.PermissionDenied(
-                "You are not the sender of this message."
-            )
+        if message.sender_id != self.request.user.id:
+            raise exceptions.PermissionDenied("You are not the sender of this message.")
         if message.is_deleted:
             raise serializers.ValidationError(
                 {"detail": "Cannot modify a deleted message."}
@@ -358,22 +489,18 @@ class MessageDetailUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
         #  Time limit for editing (24 hours)
         time_since_sent = timezone.now() - message.timestamp
         if time_since_sent.total_seconds() > 24 * 60 * 60:
-            raise serializers.PermissionDenied("Edit time limit exceeded.")
+            raise exceptions.PermissionDenied("Edit time limit exceeded.")
 
         return message
 
     def perform_update(self, serializer):
-        instance = serializer.save(is_edited=True)
-        conversation = instance.conversation
-        response_serializer = MessageSerializer(
-            instance, context={"request": self.request}
-        )
-
-        channel_layer = get_channel_layer()
-        group_name = f"conversation_{conversation.id}"
-        async_to_sync(channel_layer.group_send)(
-            group_name, {"type": "message.updated", "message": response_serializer.data}
-        )
+        with defer_broadcasts(), transaction.atomic():
+            instance = serializer.save(is_edited=True)
+            MessageChange.record(instance, MessageChange.EDITED)
+            response_serializer = MessageSerializer(
+                instance, context={"request": self.request}
+            )
+            broadcast_message_updated(instance, response_serializer.data)
 
     def perform_destroy(self, instance):
         if instance.is_deleted:
@@ -382,26 +509,296 @@ class MessageDetailUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
         instance.is_deleted = True
         instance.content = None
         instance.image = None
-        instance.save()
-
-        conversation = instance.conversation
-        deleted_message_data = MessageSerializer(
-            instance, context={"request": self.request}
-        ).data
-
-        channel_layer = get_channel_layer()
-        group_name = f"conversation_{conversation.id}"
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                "type": "message.deleted",
-                "message_id": instance.id,
-                "deleted_message_data": deleted_message_data,
-                "conversation_id": conversation.id,
-            },
-        )
+        with defer_broadcasts(), transaction.atomic():
+            instance.save()
+            MessageChange.record(instance, MessageChange.DELETED)
+
+            deleted_message_data = MessageSerializer(
+                instance, context={"request": self.request}
+            ).data
+            broadcast_message_deleted(instance, deleted_message_data)
 
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         self.perform_destroy(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+# URL: /api/messages/conversations/<int:conversation_pk>/uploads/ (POST - Opens a chunked image upload)
+class UploadSessionCreateView(generics.CreateAPIView):
+    serializer_class = UploadSessionCreateSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def create(self, request, *args, **kwargs):
+        conversation_id = self.kwargs.get("conversation_pk")
+        try:
+            conversation = Conversation.objects.get(
+                id=conversation_id, participants=request.user
+            )
+        except Conversation.DoesNotExist:
+            return Response(
+                {"detail": "Conversation not found or you are not a participant."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        create_serializer = self.get_serializer(data=request.data)
+        create_serializer.is_valid(raise_exception=True)
+        session = create_serializer.save(
+            conversation=conversation, uploader=request.user
+        )
+
+        return Response(
+            UploadSessionSerializer(session, context={"request": request}).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class UploadSessionMixin:
+    def get_session(self, request, upload_id):
+        return get_object_or_404(
+            UploadSession.objects.select_related("conversation").filter(
+                Q(message__isnull=False) | Q(expires_at__gt=timezone.now())
+            ),
+            id=upload_id,
+            uploader=request.user,
+            conversation__participants=request.user,
+        )
+
+
+# URL: /api/messages/uploads/<uuid:upload_id>/ (GET - Upload status, PUT - Upload a byte range)
+class UploadSessionDetailView(UploadSessionMixin, views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, upload_id, *args, **kwargs):
+        session = self.get_session(request, upload_id)
+        return Response(UploadSessionSerializer(session).data)
+
+    def put(self, request, upload_id, *args, **kwargs):
+        """
+        Store one chunk. The raw request body holds the bytes and the
+        ``Content-Range`` header says where they go; the body is streamed to
+        disk so neither Django nor DRF ever buffers the whole chunk.
+        """
+        session = self.get_session(request, upload_id)
+        if session.is_finalized:
+            return Response(
+                {"detail": "This upload has already been finalized."},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        try:
+            start, end = parse_content_range(
+                request.headers.get("Content-Range"), session.total_size
+            )
+            content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+            if content_length != end - start or request.stream is None:
+                raise ChunkError("Content-Length must match the Content-Range size.")
+            write_chunk(session, request.stream, start, end)
+        except ChunkError as e:
+            return Response(
+                {
+                    "detail": str(e),
+                    "missing_ranges": missing_ranges(
+                        session.received_ranges, session.total_size
+                    ),
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Only record the range once its bytes are safely on disk.
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            session.received_ranges = merge_range(session.received_ranges, start, end)
+            session.expires_at = upload_expiry()
+            session.save(update_fields=["received_ranges", "expires_at", "updated_at"])
+
+        return Response(UploadSessionSerializer(session).data)
+
+
+# URL: /api/messages/uploads/<uuid:upload_id>/finalize/ (POST - Turns a complete upload into a message)
+class UploadSessionFinalizeView(UploadSessionMixin, views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, upload_id, *args, **kwargs):
+        session = self.get_session(request, upload_id)
+        with defer_broadcasts(), transaction.atomic():
+            # Concurrent retries wait here for the first one, then find the
+            # message it created instead of creating another from the same part.
+            session = get_object_or_404(
+                UploadSession.objects.select_for_update(of=("self",)).select_related(
+                    "conversation", "message"
+                ),
+                pk=session.pk,
+            )
+            if session.is_finalized:
+                # Finalize is idempotent so a client can safely retry after a dropped response.
+                return Response(
+                    MessageSerializer(
+                        session.message, context={"request": request}
+                    ).data,
+                    status=status.HTTP_200_OK,
+                )
+            if not session.is_complete:
+                return Response(
+                    {
+                        "detail": "Upload is not complete yet.",
+                        "missing_ranges": missing_ranges(
+                            session.received_ranges, session.total_size
+                        ),
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            finalize_serializer = UploadFinalizeSerializer(data=request.data)
+            finalize_serializer.is_valid(raise_exception=True)
+            conversation = session.conversation
+
+            reply_to_message_id = finalize_serializer.validated_data.get(
+                "reply_to_message_id"
+            )
+            reply_to_instance = None
+            if reply_to_message_id:
+                try:
+                    reply_to_instance = Message.objects.get(
+                        id=reply_to_message_id,
+                        conversation=conversation,
+                        is_deleted=False,
+                    )
+                except Message.DoesNotExist:
+                    return Response(
+                        {
+                            "detail": "Message being replied to not found in this conversation or has been deleted."
+                        },
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
+
+            with open_part_file(session) as part_file:
+                create_serializer = MessageCreateSerializer(
+                    data={
+                        "content": finalize_serializer.validated_data.get(
+                            "content", ""
+                        ),
+                        "image": part_file,
+                    }
+                )
+                if not create_serializer.is_valid():
+                    discard_part(session)
+                    session.delete()
+                    return Response(
+                        create_serializer.errors, status=status.HTTP_400_BAD_REQUEST
+                    )
+
+                with span("db.create_message"):
+                    message_instance = Message.objects.create(
+                        sender=request.user,
+                        conversation=conversation,
+                        content=create_serializer.validated_data.get("content"),
+                        image=create_serializer.validated_data.get("image"),
+                        reply_to_message=reply_to_instance,
+                    )
+                    MessageChange.record(message_instance, MessageChange.CREATED)
+                    session.message = message_instance
+                    session.save(update_fields=["message", "updated_at"])
+                    conversation.save()
+
+            with span("serialize_message"):
+                message_data = MessageSerializer(
+                    message_instance, context={"request": request}
+                ).data
+            with span("broadcast_new_message"):
+                broadcast_new_message(conversation, message_data, request.user)
+        discard_part(session)
+        MESSAGES_CREATED.inc(source="upload")
+
+        return Response(message_data, status=status.HTTP_201_CREATED)
+
+
+# URL: /api/messages/changes/?since=<change_id> (GET - Message creates/edits/deletes across the user's conversations)
+class MessageChangeFeedView(generics.ListAPIView):
+    serializer_class = MessageChangeSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    page_size = 200
+
+    def get_queryset(self):
+        return (
+            MessageChange.objects.filter(conversation__participants=self.request.user)
+            .select_related(
+                "message__sender__profile",
+                "message__reply_to_message__sender__profile",
+            )
+            .order_by("id")
+        )
+
+    def list(self, request, *args, **kwargs):
+        # Change ids are handed out at INSERT, not at commit: id N can become
+        # visible after N + 1 has been read. So the cursor only moves past
+        # changes older than SYNC_OVERLAP_SECONDS; newer ones are sent, and
+        # sent again next time. Clients apply them by message id, so a repeat
+        # just rewrites the same state.
+        settled_before = timezone.now() - timedelta(
+            seconds=settings.SYNC_OVERLAP_SECONDS
+        )
+        since = request.query_params.get("since")
+        if since is None:
+            # Without a cursor, hand out the current head so the client can load
+            # histories once and then only follow changes from here on.
+            head = (
+                self.get_queryset()
+                .filter(created_at__lt=settled_before)
+                .aggregate(head=Max("id"))["head"]
+                or 0
+            )
+            return Response({"results": [], "since": head, "has_more": False})
+
+        try:
+            since = int(since)
+        except ValueError:
+            raise serializers.ValidationError({"since": "Must be a change id."})
+
+        changes = list(self.get_queryset().filter(id__gt=since)[: self.page_size + 1])
+        has_more = len(changes) > self.page_size
+        changes = changes[: self.page_size]
+        for change in changes:
+            if change.created_at >= settled_before:
+                # The rest of the page is sent but not skipped from now on;
+                # there is no next page until it settles.
+                has_more = False
+                break
+            since = change.id
+
+        # Messages are serialized in their current state, so only the latest
+        # change per message in this batch needs to be sent.
+        latest_changes = {change.message_id: change for change in changes}
+        collapsed = sorted(latest_changes.values(), key=lambda change: change.id)
+
+        serializer = self.get_serializer(collapsed, many=True)
+        return Response(
+            {"results": serializer.data, "since": since, "has_more": has_more}
+        )
+
+
+# URL: /api/messages/conversations/<int:conversation_pk>/export/ (GET - NDJSON export, ?compress=gzip for a .gz archive)
+class ConversationExportView(views.APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, conversation_pk, *args, **kwargs):
+        conversations = Conversation.objects.filter(id=conversation_pk)
+        if not request.user.is_staff:
+            conversations = conversations.filter(participants=request.user)
+        if not conversations.exists():
+            return Response(
+                {"detail": "Conversation not found or you are not a participant."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        compress = request.query_params.get("compress") == "gzip"
+        response = streaming_response(
+            request,
+            iter_ndjson(iter_conversation_records(conversations), compress=compress),
+            content_type="application/gzip" if compress else "application/x-ndjson",
+        )
+        filename = f"conversation-{conversation_pk}.ndjson" + (
+            ".gz" if compress else ""
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
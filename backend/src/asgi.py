@@ -12,6 +12,9 @@ django_asgi_app = get_asgi_application()
 
 import chat.routing  # noqa: E402
 from users.middleware import JWTAuthMiddleware  # noqa: E402
+from src.metrics import start_snapshot_writer  # noqa: E402
+
+start_snapshot_writer()
 
 
 application = ProtocolTypeRouter(
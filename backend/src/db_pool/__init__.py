@@ -0,0 +1,9 @@
+"""
+PostgreSQL backend that shares a bounded connection pool between threads.
+
+Use ``"ENGINE": "src.db_pool"`` with ``CONN_MAX_AGE = 0``: Django then
+"closes" the connection at the end of every request and around every
+``database_sync_to_async`` call, which hands it back to the pool instead of
+keeping one idle connection per worker thread. Pool options are read from the
+``POOL`` key of the database settings.
+"""
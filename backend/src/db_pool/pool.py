@@ -0,0 +1,208 @@
+"""
+A small, thread-safe, bounded pool of DB-API connections.
+
+At most ``max_size`` connections exist at once. ``acquire()`` hands out an idle
+connection (health-checking it if it sat unused for a while), opens a new one
+while under the limit, or waits up to ``timeout`` seconds for one to be
+released. Time spent waiting is recorded in ``stats()``.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    __slots__ = ("connection", "created_at", "released_at")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = self.released_at = time.monotonic()
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        max_size=10,
+        timeout=10.0,
+        max_lifetime=3600.0,
+        check_interval=30.0,
+        reset_query=None,
+        slow_wait=0.1,
+    ):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self.reset_query = reset_query
+        self.slow_wait = slow_wait
+
+        self._idle = []
+        self._in_use = {}
+        self._pending = 0
+        self._condition = threading.Condition()
+
+        self._acquired = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+    @property
+    def size(self):
+        return len(self._idle) + len(self._in_use) + self._pending
+
+    def acquire(self, connect):
+        """
+        Return a connection, creating it with ``connect()`` if the pool has
+        room. Raises ``PoolTimeout`` when none frees up within ``timeout``.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            with self._condition:
+                while not self._idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        self._record_wait(
+                            time.monotonic() - started, waited, acquired=False
+                        )
+                        raise PoolTimeout(
+                            f"No database connection became free within {self.timeout}s "
+                            f"(pool size {self.max_size})."
+                        )
+                    waited = True
+                    self._condition.wait(remaining)
+                pooled = self._idle.pop() if self._idle else None
+                # Counted towards size while it is opened or health-checked
+                # outside the lock, so the pool never overshoots max_size.
+                self._pending += 1
+
+            try:
+                if pooled is None:
+                    pooled = PooledConnection(connect())
+                elif not self._is_healthy(pooled):
+                    self._close_quietly(pooled.connection)
+                    pooled = None
+            except BaseException:
+                with self._condition:
+                    self._pending -= 1
+                    self._condition.notify()
+                raise
+
+            with self._condition:
+                self._pending -= 1
+                if pooled is None:
+                    self._discarded += 1
+                    self._condition.notify()
+                    continue
+                self._in_use[id(pooled.connection)] = pooled
+                self._record_wait(time.monotonic() - started, waited)
+            return pooled.connection
+
+    def release(self, connection):
+        """Hand ``connection`` back, resetting its session state first."""
+        with self._condition:
+            pooled = self._in_use.pop(id(connection), None)
+            # Still counted towards size while it is reset outside the lock.
+            self._pending += pooled is not None
+        if pooled is None:
+            self._close_quietly(connection)
+            return
+
+        reusable = False
+        try:
+            reusable = self._reset(pooled) and not self._expired(pooled)
+        finally:
+            if not reusable:
+                self._close_quietly(pooled.connection)
+            with self._condition:
+                self._pending -= 1
+                if reusable:
+                    pooled.released_at = time.monotonic()
+                    self._idle.append(pooled)
+                else:
+                    self._discarded += 1
+                self._condition.notify()
+
+    def close_all(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._close_quietly(pooled.connection)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "max_size": self.max_size,
+                "size": self.size,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "acquired_total": self._acquired,
+                "waits_total": self._waits,
+                "wait_seconds_total": self._wait_seconds,
+                "wait_seconds_max": self._max_wait_seconds,
+                "timeouts_total": self._timeouts,
+                "discarded_total": self._discarded,
+            }
+
+    def _record_wait(self, seconds, waited, acquired=True):
+        self._acquired += acquired
+        if not waited:
+            return
+        self._waits += 1
+        self._wait_seconds += seconds
+        self._max_wait_seconds = max(self._max_wait_seconds, seconds)
+        if seconds >= self.slow_wait:
+            logger.warning(
+                f"Waited {seconds * 1000:.0f}ms for a pooled database connection"
+            )
+
+    def _expired(self, pooled):
+        return time.monotonic() - pooled.created_at > self.max_lifetime
+
+    def _is_healthy(self, pooled):
+        connection = pooled.connection
+        if getattr(connection, "closed", False) or self._expired(pooled):
+            return False
+        if time.monotonic() - pooled.released_at < self.check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, pooled):
+        connection = pooled.connection
+        if getattr(connection, "closed", False):
+            return False
+        try:
+            # Roll back anything left open; a no-op outside a transaction.
+            connection.rollback()
+            if self.reset_query:
+                autocommit = connection.autocommit
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute(self.reset_query)
+                connection.autocommit = autocommit
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
@@ -0,0 +1,162 @@
+"""
+Routes safe API reads to read replicas.
+
+``ReplicaRoutingMiddleware`` marks GET/HEAD requests under ``/api/`` as
+replica-eligible and ``ReplicaRouter`` then sends their reads to one of
+``settings.DATABASE_REPLICAS``. Writes always go to ``default``.
+
+Replicas lag behind the primary, so a user who just wrote something is pinned
+to the primary for ``READ_YOUR_WRITES_SECONDS``: successful unsafe requests
+(and WebSocket message writes, via ``pin_to_primary``) set a per-user key in
+the shared cache that later reads check.
+"""
+
+import contextvars
+import logging
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.exceptions import TokenError
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_read_from_replica = contextvars.ContextVar("read_from_replica", default=False)
+
+
+def replicas_configured():
+    return bool(getattr(settings, "DATABASE_REPLICAS", ()))
+
+
+@contextmanager
+def use_replica(enabled=True):
+    token = _read_from_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _read_from_replica.reset(token)
+
+
+def _pin_key(user_id):
+    return f"db:primary-pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    """Send this user's reads to the primary for the read-your-writes window."""
+    if not replicas_configured() or user_id is None:
+        return
+    try:
+        cache.set(_pin_key(user_id), 1, timeout=settings.READ_YOUR_WRITES_SECONDS)
+    except Exception as e:
+        logger.error(f"Could not pin user {user_id} to the primary database: {e}")
+
+
+def is_pinned_to_primary(user_id):
+    if user_id is None:
+        return False
+    try:
+        return cache.get(_pin_key(user_id)) is not None
+    except Exception as e:
+        # Without the pin we cannot promise read-your-writes; stay on the primary.
+        logger.error(f"Could not check primary pin for user {user_id}: {e}")
+        return True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _read_from_replica.get() or not replicas_configured():
+            return "default"
+        # Reads inside a transaction on the primary must see its own writes.
+        if connections["default"].in_atomic_block:
+            return "default"
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+def request_user_id(request):
+    """
+    The id of the user making ``request``, without touching the database.
+    DRF authenticates inside the view, so bearer and ``?token=`` JWTs are
+    decoded here; session users come from Django's AuthenticationMiddleware.
+    """
+    raw_token = None
+    header = request.headers.get("Authorization", "")
+    parts = header.split()
+    if len(parts) == 2 and parts[0] in jwt_settings.AUTH_HEADER_TYPES:
+        raw_token = parts[1]
+    elif request.GET.get("token"):
+        raw_token = request.GET["token"]
+
+    if raw_token:
+        try:
+            return AccessToken(raw_token).get(jwt_settings.USER_ID_CLAIM)
+        except TokenError:
+            return None
+
+    if "_auth_user_id" in getattr(request, "session", {}):
+        return request.session["_auth_user_id"]
+    return None
+
+
+def pin_writer(request):
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        pin_to_primary(user.pk)
+
+
+def reads_from_replica(request):
+    return not is_pinned_to_primary(request_user_id(request))
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas_configured() or not request.path.startswith("/api/"):
+            return self.get_response(request)
+
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            if response.status_code < 400:
+                pin_writer(request)
+            return response
+
+        with use_replica(reads_from_replica(request)):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not replicas_configured() or not request.path.startswith("/api/"):
+            return await self.get_response(request)
+
+        # The session, the lazy request.user and the cache are sync.
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            if response.status_code < 400:
+                await sync_to_async(pin_writer)(request)
+            return response
+
+        with use_replica(await sync_to_async(reads_from_replica)(request)):
+            return await self.get_response(request)
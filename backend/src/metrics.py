@@ -0,0 +1,499 @@
+"""
+Process-local metrics with a Prometheus text exposition at ``/metrics``.
+
+Metrics are plain counters, gauges and histograms guarded by one lock each,
+so recording a sample costs a dict lookup and an addition. Daphne runs one
+process per worker, so with ``METRICS_DIR`` set every process periodically
+writes a snapshot of its metrics there (see ``start_snapshot_writer``), and
+whichever worker serves ``/metrics`` adds up the snapshots of all workers that
+wrote one recently. Without ``METRICS_DIR`` only the serving process is shown.
+"""
+
+import atexit
+import contextvars
+import hmac
+import json
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """``{label values: value}``; histograms use ``[bucket counts, sum, count]``."""
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def _copy(self, value):
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """For totals that are counted elsewhere, e.g. by the connection pool."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        # Counts per bucket, not cumulative; the last slot is +Inf.
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _copy(self, value):
+        return [list(value[0]), value[1], value[2]]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collect_hooks = []
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def on_collect(self, hook):
+        """Run ``hook()`` before every snapshot, e.g. to refresh gauges."""
+        self.collect_hooks.append(hook)
+        return hook
+
+    def snapshot(self):
+        """A JSON-serialisable copy of every metric in this process."""
+        for hook in self.collect_hooks:
+            hook()
+        return {
+            name: {
+                "kind": metric.kind,
+                "documentation": metric.documentation,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": [
+                    [list(key), value] for key, value in metric.samples().items()
+                ],
+            }
+            for name, metric in self.metrics.items()
+        }
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "chat_http_requests_total",
+    "HTTP requests by view and status.",
+    ["method", "view", "status"],
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "chat_http_request_duration_seconds", "Time to build an HTTP response.", ["view"]
+)
+HTTP_REQUEST_DB_SECONDS = REGISTRY.histogram(
+    "chat_http_request_db_seconds",
+    "Time spent in SQL queries per HTTP request.",
+    ["view"],
+)
+WEBSOCKET_CONNECTIONS = REGISTRY.gauge(
+    "chat_websocket_connections", "Open WebSocket connections.", ["consumer"]
+)
+WEBSOCKET_CONNECTS = REGISTRY.counter(
+    "chat_websocket_connects_total",
+    "WebSocket connection attempts.",
+    ["consumer", "outcome"],
+)
+WEBSOCKET_FRAMES_RECEIVED = REGISTRY.counter(
+    "chat_websocket_frames_received_total",
+    "Client frames by event type.",
+    ["consumer", "type"],
+)
+MESSAGES_CREATED = REGISTRY.counter(
+    "chat_messages_created_total", "Chat messages saved.", ["source"]
+)
+CHANNEL_LAYER_OPERATIONS = REGISTRY.counter(
+    "chat_channel_layer_operations_total",
+    "Channel layer calls.",
+    ["operation", "outcome"],
+)
+CHANNEL_LAYER_SECONDS = REGISTRY.histogram(
+    "chat_channel_layer_duration_seconds", "Channel layer call latency.", ["operation"]
+)
+CHANNEL_LAYER_DELIVERIES = REGISTRY.counter(
+    "chat_channel_layer_deliveries_total",
+    "Channels a group message was delivered to, in memory or through Redis.",
+    ["route"],
+)
+DB_THREAD_QUEUE_DEPTH = REGISTRY.gauge(
+    "chat_db_thread_queue_depth", "database_sync_to_async calls waiting for a thread."
+)
+DB_THREAD_WAIT_SECONDS = REGISTRY.histogram(
+    "chat_db_thread_wait_seconds",
+    "Time database_sync_to_async calls wait for a thread.",
+)
+DB_THREAD_CALL_SECONDS = REGISTRY.histogram(
+    "chat_db_thread_call_seconds", "Run time of database_sync_to_async calls."
+)
+QUERY_PROFILE_OFFENDERS = REGISTRY.counter(
+    "chat_query_profile_offenders_total",
+    "Sampled requests and consumer events flagged by the query profiler.",
+    ["endpoint", "reason"],
+)
+DB_POOL_CONNECTIONS = REGISTRY.gauge(
+    "chat_db_pool_connections", "Pooled database connections.", ["alias", "state"]
+)
+DB_POOL_WAIT_SECONDS = REGISTRY.counter(
+    "chat_db_pool_wait_seconds_total",
+    "Time spent waiting for a pooled connection.",
+    ["alias"],
+)
+DB_POOL_WAITS = REGISTRY.counter(
+    "chat_db_pool_waits_total", "Connection requests that had to wait.", ["alias"]
+)
+DB_POOL_TIMEOUTS = REGISTRY.counter(
+    "chat_db_pool_timeouts_total", "Connection requests that timed out.", ["alias"]
+)
+
+
+@REGISTRY.on_collect
+def collect_pool_stats():
+    # Imported here: src.db_pool pulls in the PostgreSQL backend.
+    from src.db_pool.base import pool_stats
+
+    for alias, stats in pool_stats().items():
+        DB_POOL_CONNECTIONS.set(stats["in_use"], alias=alias, state="in_use")
+        DB_POOL_CONNECTIONS.set(stats["idle"], alias=alias, state="idle")
+        DB_POOL_WAIT_SECONDS.set_total(stats["wait_seconds_total"], alias=alias)
+        DB_POOL_WAITS.set_total(stats["waits_total"], alias=alias)
+        DB_POOL_TIMEOUTS.set_total(stats["timeouts_total"], alias=alias)
+
+
+def merge_snapshots(snapshots):
+    """Add up the samples of several process snapshots."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            for key, value in metric["samples"]:
+                key = tuple(key)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = value
+                elif metric["kind"] == "histogram":
+                    target["samples"][key] = [
+                        [a + b for a, b in zip(current[0], value[0])],
+                        current[1] + value[1],
+                        current[2] + value[2],
+                    ]
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render(merged):
+    """Prometheus text format (version 0.0.4)."""
+    lines = []
+    for name, metric in sorted(merged.items()):
+        lines.append(f"# HELP {name} {metric['documentation']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labelnames"]
+        for key, value in sorted(metric["samples"].items()):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, key)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip([*metric["buckets"], "+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{name}_bucket{_labels(names, key, [('le', bound)])} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_labels(names, key)} {total}")
+            lines.append(f"{name}_count{_labels(names, key)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+
+def write_snapshot(directory):
+    path = _snapshot_path(directory, os.getpid())
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as snapshot_file:
+        json.dump(REGISTRY.snapshot(), snapshot_file)
+    os.replace(temporary, path)
+
+
+def read_snapshots(directory, max_age):
+    """Snapshots of the other processes that wrote one in the last ``max_age`` seconds."""
+    own = os.path.basename(_snapshot_path(directory, os.getpid()))
+    cutoff = time.time() - max_age
+    snapshots = []
+    for filename in os.listdir(directory):
+        if (
+            filename == own
+            or not filename.startswith("metrics-")
+            or not filename.endswith(".json")
+        ):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                continue
+            with open(path) as snapshot_file:
+                snapshots.append(json.load(snapshot_file))
+        except (OSError, ValueError):
+            # Removed or half-written by its process meanwhile.
+            continue
+    return snapshots
+
+
+_writer_started = False
+
+
+def start_snapshot_writer():
+    """Write this process's snapshot to ``METRICS_DIR`` every few seconds."""
+    global _writer_started
+    directory = getattr(settings, "METRICS_DIR", None)
+    if not directory or _writer_started:
+        return
+    _writer_started = True
+    os.makedirs(directory, exist_ok=True)
+    interval = settings.METRICS_SNAPSHOT_SECONDS
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(directory)
+            except OSError:
+                pass
+
+    threading.Thread(target=run, name="metrics-snapshot", daemon=True).start()
+
+    @atexit.register
+    def remove_snapshot():
+        try:
+            os.remove(_snapshot_path(directory, os.getpid()))
+        except OSError:
+            pass
+
+
+def can_read_metrics(request):
+    """Staff, or the ``METRICS_TOKEN`` bearer; anyone only in DEBUG without a token."""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_staff:
+        return True
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if not token:
+        return settings.DEBUG
+    return hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    )
+
+
+def metrics_view(request):
+    if not can_read_metrics(request):
+        return HttpResponse("Unauthorized", status=401, content_type="text/plain")
+
+    snapshots = [REGISTRY.snapshot()]
+    directory = getattr(settings, "METRICS_DIR", None)
+    if directory and os.path.isdir(directory):
+        snapshots += read_snapshots(directory, settings.METRICS_SNAPSHOT_SECONDS * 3)
+    return HttpResponse(
+        render(merge_snapshots(snapshots)), content_type="text/plain; version=0.0.4"
+    )
+
+
+# SQL time of the request being measured, as a one-item list.
+_request_db_time = contextvars.ContextVar("request_db_time", default=None)
+
+
+def time_request_query(execute, sql, params, many, context):
+    db_time = _request_db_time.get()
+    if db_time is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        db_time[0] += time.perf_counter() - started
+
+
+def install_query_timer(connection, **kwargs):
+    # At the front, as execute_wrapper() blocks pop their own off the end.
+    if time_request_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_request_query)
+
+
+# Async views query from sync_to_async threads, out of the middleware's
+# reach, so every connection gets the timer as it connects. The request's
+# context (and so _request_db_time) is copied into those threads.
+connection_created.connect(install_query_timer)
+
+
+class MetricsMiddleware:
+    """Counts requests and times them, in total and in SQL."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for alias in connections:
+            install_query_timer(connections[alias])
+        db_time = [0.0]
+        token = _request_db_time.set(db_time)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_db_time.reset(token)
+        self.record(request, response, time.perf_counter() - started, db_time[0])
+        return response
+
+    async def __acall__(self, request):
+        db_time = [0.0]
+        token = _request_db_time.set(db_time)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_db_time.reset(token)
+        self.record(request, response, time.perf_counter() - started, db_time[0])
+        return response
+
+    def record(self, request, response, elapsed, db_seconds):
+        match = request.resolver_match
+        # Route names keep the label set small; raw paths would not.
+        view = match.view_name if match and match.view_name else "unmatched"
+        if view == "metrics":
+            return
+        HTTP_REQUESTS.inc(method=request.method, view=view, status=response.status_code)
+        HTTP_REQUEST_SECONDS.observe(elapsed, view=view)
+        HTTP_REQUEST_DB_SECONDS.observe(db_seconds, view=view)
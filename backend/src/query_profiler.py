@@ -0,0 +1,197 @@
+"""
+Sampled per-request and per-consumer-event query profiling.
+
+A profile counts the SQL queries of one unit of work, groups them by
+fingerprint (the SQL with its literals and IN lists collapsed) and adds up
+their time. A profile that runs too many queries, repeats one fingerprint
+too often (the usual N+1 shape) or spends too long in the database is logged
+with its label and counted in ``/metrics``. Only ``QUERY_PROFILER_SAMPLE_RATE``
+of the units are profiled, so it can stay on in production.
+
+HTTP requests are profiled by ``QueryProfilerMiddleware``. Consumers profile
+an event with ``query_profile()``; the ``database_sync_to_async`` calls made
+during it record into the same profile from the database thread (see
+``record_queries``). Queries are recorded by a wrapper every connection gets
+when it connects, into the profile of the context they run in, so the
+``sync_to_async`` threads of async views count too.
+"""
+
+import contextvars
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from src.metrics import QUERY_PROFILE_OFFENDERS
+
+logger = logging.getLogger(__name__)
+
+_current_profile = contextvars.ContextVar("query_profile", default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """``sql`` with literals and parameters replaced by ``?``."""
+    sql = _WHITESPACE.sub(" ", sql)
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    return _VALUE_LIST.sub("(?)", sql).strip()
+
+
+class QueryProfile:
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[fingerprint(sql)] += 1
+
+    def duplicates(self):
+        threshold = settings.QUERY_PROFILER_DUPLICATE_THRESHOLD
+        return [
+            (sql, count)
+            for sql, count in self.fingerprints.most_common()
+            if count >= threshold
+        ]
+
+    def problems(self):
+        problems = []
+        if self.duplicates():
+            problems.append("duplicates")
+        if self.count > settings.QUERY_PROFILER_MAX_QUERIES:
+            problems.append("query_count")
+        if self.duration > settings.QUERY_PROFILER_SLOW_DB_SECONDS:
+            problems.append("db_time")
+        return problems
+
+    def report(self):
+        problems = self.problems()
+        for reason in problems:
+            QUERY_PROFILE_OFFENDERS.inc(endpoint=self.label, reason=reason)
+        if not problems:
+            return
+        repeated = "; ".join(
+            f"{count}x {sql[:200]}" for sql, count in self.duplicates()[:3]
+        )
+        logger.warning(
+            f"Query profile {self.label}: {self.count} queries, "
+            f"{self.duration * 1000:.1f}ms in the database ({', '.join(problems)})"
+            + (f". Repeated: {repeated}" if repeated else "")
+        )
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - started)
+
+
+def current_profile():
+    return _current_profile.get()
+
+
+def record_query(execute, sql, params, many, context):
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile.execute_wrapper(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    # At the front, as execute_wrapper() blocks pop their own off the end.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+def _install_recorders():
+    """For this thread's connections, in case they connected before this module was imported."""
+    for alias in connections:
+        install_query_recorder(connections[alias])
+
+
+@contextmanager
+def query_profile(label, sample_rate=None):
+    """
+    Profile the queries run in this context, including the ``sync_to_async``
+    and ``record_queries`` calls made from it. Yields the profile, or None
+    when this unit of work was not sampled.
+    """
+    if sample_rate is None:
+        sample_rate = settings.QUERY_PROFILER_SAMPLE_RATE
+    if current_profile() is not None or random.random() >= sample_rate:
+        yield None
+        return
+
+    profile = QueryProfile(label)
+    token = _current_profile.set(profile)
+    try:
+        _install_recorders()
+        yield profile
+    finally:
+        _current_profile.reset(token)
+        profile.report()
+
+
+@contextmanager
+def record_queries(label):
+    """
+    For code running on another thread (``database_sync_to_async``): add its
+    queries to the caller's profile, or profile it on its own (sampled) when
+    the caller is not being profiled.
+    """
+    if current_profile() is None:
+        with query_profile(label):
+            yield
+        return
+    _install_recorders()
+    yield
+
+
+class QueryProfilerMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with query_profile(f"{request.method} unmatched") as profile:
+            response = self.get_response(request)
+            self.label(profile, request)
+            return response
+
+    async def __acall__(self, request):
+        with query_profile(f"{request.method} unmatched") as profile:
+            response = await self.get_response(request)
+            self.label(profile, request)
+            return response
+
+    def label(self, profile, request):
+        match = request.resolver_match
+        if profile is not None and match and match.view_name:
+            # Label by route, so the offender counts stay few.
+            profile.label = f"{request.method} {match.view_name}"
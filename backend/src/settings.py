@@ -4,6 +4,7 @@ from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -16,6 +17,9 @@ SECRET_KEY = os.environ.get("SECRET_KEY")
 
 DEBUG = os.environ.get("DEBUG", "False").lower() in ("true", "1", "t")
 
+# Running the test suite, under manage.py test or pytest
+TESTING = "test" in sys.argv or "pytest" in sys.modules
+
 ALLOWED_HOSTS = ["*"]
 
 
@@ -41,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "src.tracing.TracingMiddleware",
+    "src.metrics.MetricsMiddleware",
+    "src.query_profiler.QueryProfilerMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -48,6 +55,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "src.db_router.ReplicaRoutingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "debug_toolbar.middleware.DebugToolbarMiddleware",
@@ -77,16 +85,55 @@ ASGI_APPLICATION = "src.asgi.application"
 
 DATABASES = {
     "default": dj_database_url.config(conn_max_age=600, ssl_require=False),
-    "test": {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': ':memory:'
-    }
+    "test": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"},
 }
 
-import sys
-if 'test' in sys.argv:
-    DATABASES['default'] = DATABASES['test']
-    
+if TESTING:
+    # TEST_DATABASE_URL runs the tests on that database instead, e.g. on
+    # PostgreSQL for the tests of the partitioned message table.
+    if os.environ.get("TEST_DATABASE_URL"):
+        DATABASES["default"] = dj_database_url.parse(os.environ["TEST_DATABASE_URL"])
+    else:
+        DATABASES["default"] = DATABASES["test"]
+
+# Read replicas, comma-separated database URLs. Safe /api/ reads go to them
+# (see src/db_router.py) except for users who wrote in the last few seconds.
+DATABASE_REPLICAS = []
+if not TESTING:
+    for index, url in enumerate(
+        filter(None, os.environ.get("DATABASE_REPLICA_URLS", "").split(","))
+    ):
+        alias = "replica" if index == 0 else f"replica_{index + 1}"
+        DATABASES[alias] = dj_database_url.parse(url.strip(), conn_max_age=600)
+        DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+        DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ["src.db_router.ReplicaRouter"]
+READ_YOUR_WRITES_SECONDS = int(os.environ.get("READ_YOUR_WRITES_SECONDS", 5))
+# Ids and auto_now timestamps are taken before commit, so a slow transaction
+# can commit rows that sort before ones already handed out. Sync cursors
+# (change feed, conversation since tokens) stay this many seconds behind the
+# newest rows; what falls inside the window is sent again on the next sync.
+SYNC_OVERLAP_SECONDS = int(os.environ.get("SYNC_OVERLAP_SECONDS", 10))
+
+# PostgreSQL connections come from a bounded pool shared by all threads of a
+# process (src/db_pool), instead of one persistent connection per thread.
+# Set DATABASE_POOL_MAX_SIZE=0 to go back to plain persistent connections.
+DATABASE_POOL_MAX_SIZE = int(os.environ.get("DATABASE_POOL_MAX_SIZE", 20))
+if DATABASE_POOL_MAX_SIZE > 0:
+    for database in DATABASES.values():
+        if database.get("ENGINE") == "django.db.backends.postgresql":
+            database["ENGINE"] = "src.db_pool"
+            database["CONN_MAX_AGE"] = 0
+            database["POOL"] = {
+                "max_size": DATABASE_POOL_MAX_SIZE,
+                "timeout": float(os.environ.get("DATABASE_POOL_TIMEOUT", 10)),
+                "max_lifetime": float(
+                    os.environ.get("DATABASE_POOL_MAX_LIFETIME", 3600)
+                ),
+                "check_interval": 30.0,
+                # Drops leftover session state (e.g. abandoned WITH HOLD cursors).
+                "reset_query": "DISCARD ALL",
+            }
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -120,6 +167,28 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Outside DEBUG, media is access-checked by Django and the bytes are sent by the
+# front proxy: "nginx" (X-Accel-Redirect) or "apache" (X-Sendfile). "django"
+# streams them from Django itself and is only allowed in DEBUG and the tests.
+MEDIA_SENDFILE_BACKEND = os.environ.get("MEDIA_SENDFILE_BACKEND", "nginx")
+if MEDIA_SENDFILE_BACKEND == "django" and not (DEBUG or TESTING):
+    raise ImproperlyConfigured(
+        'MEDIA_SENDFILE_BACKEND = "django" is for development; use "nginx" or "apache".'
+    )
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get(
+    "MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/"
+)
+
+# Resumable chunked uploads are assembled here before being moved into MEDIA_ROOT
+CHUNKED_UPLOAD_TEMP_DIR = Path(
+    os.environ.get("CHUNKED_UPLOAD_TEMP_DIR", BASE_DIR / "upload_parts")
+)
+CHUNKED_UPLOAD_MAX_SIZE = int(
+    os.environ.get("CHUNKED_UPLOAD_MAX_SIZE", 20 * 1024 * 1024)
+)
+# Seconds an unfinished upload is kept after its last chunk
+CHUNKED_UPLOAD_EXPIRY = int(os.environ.get("CHUNKED_UPLOAD_EXPIRY", 24 * 60 * 60))
+
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 AUTH_USER_MODEL = "users.CustomUser"
@@ -144,7 +213,7 @@ CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
 if not DEBUG:
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "BACKEND": "chat.layers.LocalDeliveryRedisChannelLayer",
             "CONFIG": {
                 "hosts": [("localhost", 6379)],
             },
@@ -200,7 +269,7 @@ REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
 if not DEBUG and REDIS_URL:
     CHANNEL_LAYERS = {
         "default": {
-            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "BACKEND": "chat.layers.LocalDeliveryRedisChannelLayer",
             "CONFIG": {
                 "hosts": [REDIS_URL],
             },
@@ -208,11 +277,73 @@ if not DEBUG and REDIS_URL:
     }
     if "channels_redis" not in INSTALLED_APPS:
         INSTALLED_APPS.append("channels_redis")
+    # Shared between workers, e.g. for the read-your-writes pins
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
 else:
     CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
 
+# Time every channel layer call for /metrics
+CHANNEL_LAYERS["default"] = {
+    "BACKEND": "chat.layers.InstrumentedChannelLayer",
+    "CONFIG": CHANNEL_LAYERS["default"],
+}
+
+# Metrics: with several worker processes, point METRICS_DIR at a directory they
+# share so /metrics adds them all up. /metrics is readable by staff and with
+# METRICS_TOKEN as a bearer token; without a token it is open only in DEBUG.
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
+METRICS_SNAPSHOT_SECONDS = float(os.environ.get("METRICS_SNAPSHOT_SECONDS", 5))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN") or None
+
+# Query profiler: share of requests and consumer events profiled, and what gets
+# one logged as an offender.
+QUERY_PROFILER_SAMPLE_RATE = float(
+    os.environ.get("QUERY_PROFILER_SAMPLE_RATE", 1.0 if DEBUG else 0.01)
+)
+QUERY_PROFILER_DUPLICATE_THRESHOLD = int(
+    os.environ.get("QUERY_PROFILER_DUPLICATE_THRESHOLD", 5)
+)
+QUERY_PROFILER_MAX_QUERIES = int(os.environ.get("QUERY_PROFILER_MAX_QUERIES", 30))
+QUERY_PROFILER_SLOW_DB_SECONDS = float(
+    os.environ.get("QUERY_PROFILER_SLOW_DB_SECONDS", 0.5)
+)
+
+# Tracing is off unless TRACING_EXPORT is set (file:///path/spans.jsonl or
+# udp://host:port); then TRACING_SAMPLE_RATE of requests and frames are traced.
+TRACING_EXPORT = os.environ.get("TRACING_EXPORT") or None
+TRACING_SAMPLE_RATE = float(os.environ.get("TRACING_SAMPLE_RATE", 0.01))
+TRACING_SERVICE_NAME = os.environ.get("TRACING_SERVICE_NAME", "chat-backend")
+
 USE_REDIS_FOR_PRESENCE = True
+USE_REDIS_FOR_EVENT_BUFFER = True
+
+# Recent message events kept per conversation for WebSocket resume
+CHAT_EVENT_BUFFER_SIZE = int(os.environ.get("CHAT_EVENT_BUFFER_SIZE", 500))
+CHAT_EVENT_BUFFER_TTL = int(os.environ.get("CHAT_EVENT_BUFFER_TTL", 24 * 60 * 60))
+# Resumes also replay this many events before the client's last_event_id, which
+# concurrent senders may have delivered after it; clients drop the ids they have
+CHAT_EVENT_REPLAY_OVERLAP = int(os.environ.get("CHAT_EVENT_REPLAY_OVERLAP", 20))
+
+# With the outbox on, the REST views write their broadcasts to chat.OutboxEvent
+# in the message's transaction and `manage.py dispatch_outbox` sends them, so
+# it must be running. Events still failing after CHAT_OUTBOX_MAX_ATTEMPTS are
+# kept as failed.
+CHAT_BROADCAST_OUTBOX = os.environ.get("CHAT_BROADCAST_OUTBOX", "False").lower() in (
+    "true",
+    "1",
+    "t",
+)
+CHAT_OUTBOX_MAX_ATTEMPTS = int(os.environ.get("CHAT_OUTBOX_MAX_ATTEMPTS", 10))
+# A dispatcher claims a batch for this long; if it has not sent the batch by
+# then, another one may claim and send it again.
+CHAT_OUTBOX_LEASE_SECONDS = int(os.environ.get("CHAT_OUTBOX_LEASE_SECONDS", 60))
 
 if DEBUG:
     USE_REDIS_FOR_PRESENCE = False
+    USE_REDIS_FOR_EVENT_BUFFER = False
     CORS_ALLOW_ALL_ORIGINS = True
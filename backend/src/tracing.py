@@ -0,0 +1,246 @@
+"""
+A small in-process tracer for following one message through the backend.
+
+``start_trace()`` opens a root span at an entry point (an HTTP request, a
+WebSocket frame, a channel layer event) for ``TRACING_SAMPLE_RATE`` of them;
+``span()`` opens a child of the current span and does nothing outside a
+sampled trace. The current span lives in a context variable, so it follows
+``sync_to_async``/``database_sync_to_async`` into their threads.
+
+To follow a message from the sender's consumer to the recipients' sockets,
+``inject()`` adds the trace context to a channel layer event and the
+receiving consumer continues the trace from it (``start_trace(parent=...)``).
+
+Finished spans are exported in the Zipkin v2 JSON format to ``TRACING_EXPORT``:
+``file:///path/spans.jsonl`` appends one span per line, ``udp://host:port``
+sends one span per datagram to a local collector.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# The current Span, or _UNSAMPLED inside a trace that was not sampled.
+_current_span = contextvars.ContextVar("trace_span", default=None)
+_UNSAMPLED = object()
+
+
+class Span:
+    def __init__(self, name, trace_id=None, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def context(self):
+        """What ``inject()`` sends along with an event."""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "sent_at": time.time(),
+        }
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        exporter = get_exporter()
+        if exporter is not None:
+            exporter.export(self.to_zipkin())
+
+    def to_zipkin(self):
+        span = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": int(self.timestamp * 1_000_000),
+            "duration": max(1, int(self.duration * 1_000_000)),
+            "localEndpoint": {"serviceName": settings.TRACING_SERVICE_NAME},
+            "tags": {key: str(value) for key, value in self.attributes.items()},
+        }
+        if self.parent_id:
+            span["parentId"] = self.parent_id
+        return span
+
+
+def current_span():
+    span = _current_span.get()
+    return span if isinstance(span, Span) else None
+
+
+@contextmanager
+def _activate(span):
+    token = _current_span.set(span)
+    try:
+        if span is _UNSAMPLED:
+            yield None
+            return
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            span.finish()
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def start_trace(name, parent=None, **attributes):
+    """
+    Open a root span, or continue the trace in ``parent`` (a context from
+    ``inject()``). Nested in another trace it is just a child span. Yields
+    the span, or None when this trace is not sampled.
+    """
+    current = _current_span.get()
+    if parent:
+        queued = time.time() - parent.get("sent_at", time.time())
+        span = Span(name, parent["trace_id"], parent["span_id"], attributes)
+        span.set(queued_ms=round(queued * 1000, 2))
+    elif isinstance(current, Span):
+        span = Span(name, current.trace_id, current.span_id, attributes)
+    elif current is _UNSAMPLED:
+        span = _UNSAMPLED
+    elif get_exporter() is not None and random.random() < settings.TRACING_SAMPLE_RATE:
+        span = Span(name, attributes=attributes)
+    else:
+        span = _UNSAMPLED
+    with _activate(span) as active:
+        yield active
+
+
+@contextmanager
+def span(name, **attributes):
+    """A child of the current span; a no-op outside a sampled trace."""
+    current = _current_span.get()
+    if not isinstance(current, Span):
+        yield None
+        return
+    with _activate(Span(name, current.trace_id, current.span_id, attributes)) as child:
+        yield child
+
+
+def inject(message):
+    """``message`` with the current trace context, for a channel layer event."""
+    current = current_span()
+    if current is None:
+        return message
+    return {**message, "trace": current.context()}
+
+
+class MemoryExporter:
+    """Keeps finished spans in ``spans``; for tests and shell sessions."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class FileExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span) + "\n"
+        with self._lock:
+            try:
+                with open(self.path, "a") as spans_file:
+                    spans_file.write(line)
+            except OSError as e:
+                logger.error(f"Could not write span to {self.path}: {e}")
+
+
+class UdpExporter:
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(self, span):
+        try:
+            self.socket.sendto(json.dumps(span).encode(), self.address)
+        except OSError:
+            # A missing collector must never slow down or break a request.
+            pass
+
+
+_exporter = None
+_exporter_url = None
+_exporter_override = None
+
+
+def get_exporter():
+    global _exporter, _exporter_url
+    if _exporter_override is not None:
+        return _exporter_override
+    url = settings.TRACING_EXPORT
+    if url != _exporter_url:
+        _exporter, _exporter_url = (exporter_from_url(url) if url else None), url
+    return _exporter
+
+
+def set_exporter(exporter):
+    """Use ``exporter`` instead of ``TRACING_EXPORT``, e.g. a MemoryExporter; None undoes it."""
+    global _exporter_override
+    _exporter_override = exporter
+
+
+def exporter_from_url(url):
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return FileExporter(parsed.path)
+    if parsed.scheme == "udp":
+        return UdpExporter(parsed.hostname, parsed.port)
+    raise ValueError(f"Unsupported TRACING_EXPORT {url!r}; use file:// or udp://.")
+
+
+class TracingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with start_trace("http", method=request.method, path=request.path) as trace:
+            response = self.get_response(request)
+            self.finish(trace, request, response)
+            return response
+
+    async def __acall__(self, request):
+        with start_trace("http", method=request.method, path=request.path) as trace:
+            response = await self.get_response(request)
+            self.finish(trace, request, response)
+            return response
+
+    def finish(self, trace, request, response):
+        if trace is None:
+            return
+        match = request.resolver_match
+        if match and match.view_name:
+            trace.name = f"http {match.view_name}"
+        trace.set(status=response.status_code)
@@ -1,9 +1,11 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from debug_toolbar.toolbar import debug_toolbar_urls
 import users.urls
+from chat.media import ProtectedMediaView
+from src.metrics import metrics_view
 
 
 urlpatterns = [
@@ -11,8 +13,17 @@ urlpatterns = [
     path("api/auth/", include(users.urls.auth_urlpatterns)),
     path("api/users/", include(users.urls.user_urlpatterns)),
     path("api/messages/", include("chat.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += debug_toolbar_urls()
+else:
+    urlpatterns += [
+        re_path(
+            r"^%s(?P<path>.+)$" % settings.MEDIA_URL.lstrip("/"),
+            ProtectedMediaView.as_view(),
+            name="protected-media",
+        ),
+    ]
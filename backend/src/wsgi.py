@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "src.settings")
 
 application = get_wsgi_application()
+
+from src.metrics import start_snapshot_writer  # noqa: E402
+
+start_snapshot_writer()
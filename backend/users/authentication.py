@@ -0,0 +1,17 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+class QueryParamJWTAuthentication(JWTAuthentication):
+    """
+    Authenticates with an access token passed as ``?token=``, the same way
+    ``JWTAuthMiddleware`` does for WebSockets. Only meant for endpoints loaded
+    by the browser directly (e.g. ``<img src>``), which cannot set headers.
+    """
+
+    def authenticate(self, request):
+        raw_token = request.query_params.get("token")
+        if not raw_token:
+            return None
+
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_user(validated_token), validated_token
@@ -6,6 +6,7 @@ from django.contrib.auth import get_user_model
 from urllib.parse import parse_qs
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from src.tracing import start_trace
 
 
 User = get_user_model()
@@ -35,9 +36,12 @@ class JWTAuthMiddleware(BaseMiddleware):
         query_params = parse_qs(query_string)
         token_key = query_params.get("token", [None])[0]
 
-        if token_key:
-            scope["user"] = await get_user_from_jwt_token(token_key)
-        else:
-            scope["user"] = AnonymousUser()
+        with start_trace("ws.auth", path=scope.get("path")) as trace:
+            if token_key:
+                scope["user"] = await get_user_from_jwt_token(token_key)
+            else:
+                scope["user"] = AnonymousUser()
+            if trace is not None:
+                trace.set(authenticated=scope["user"].is_authenticated)
 
         return await super().__call__(scope, receive, send)
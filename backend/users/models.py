@@ -78,6 +78,9 @@ class UserProfile(models.Model):
     )
     phone_number = models.CharField(max_length=20, blank=True, null=True)
     bio = models.CharField(blank=True, max_length=255, null=True)
+    # Also bumped whenever the user is saved (see create_or_update_user_profile),
+    # so it versions everything UserSerializer shows.
+    updated_at = models.DateTimeField(auto_now=True)
 
     def bio_shortened(self):
         if self.bio: